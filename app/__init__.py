@@ -20,18 +20,79 @@ def create_app(config_name=None):
     # Load configuration from config.py
     app.config.from_object(config.get(config_name, config['development']))
     
+    # Engine options and SQLite PRAGMAs for the configured backend
+    from app import engine
+    engine.configure(app)
+    
     # Initialize extensions with app
     db.init_app(app)
+    engine.init_app(app)
     login_manager.init_app(app)
     csrf.init_app(app)
     
+    # Share compiled templates between workers through a bytecode cache
+    from app import templating
+    templating.init_app(app)
+    
+    # Record per-endpoint latency, SQL and template time for /metrics
+    from app import metrics
+    metrics.init_app(app)
+    
+    # Profile flagged requests and log slow queries while an admin has it on
+    from app import profiling
+    profiling.init_app(app)
+    
+    # Hash passwords on a bounded pool instead of the request thread
+    from app import passwords
+    passwords.init_app(app)
+    
+    # Count SQL statements per request and enforce the configured budget
+    from app import query_budget
+    query_budget.init_app(app)
+    
+    # Keep the full-text search index in sync with doctor/patient changes
+    from app import search
+    search.init_app(app)
+    
+    # Maintain the dashboard counters alongside appointment/profile writes
+    from app import counters
+    counters.init_app(app)
+    
+    # Cache specializations and the doctor directory in process
+    from app import reference_data
+    reference_data.init_app(app)
+    
+    # Keep each doctor's next free slots current for the earliest-available search
+    from app import next_slots
+    next_slots.init_app(app)
+    
+    # Load the logged-in user and their profile in one query per request
+    from app import identity
+    identity.init_app(app)
+    
+    # Bump per-doctor/patient version stamps for API ETags
+    from app import versions
+    versions.init_app(app)
+    
+    # Publish slot-taken/freed events for the live booking pages after commit
+    from app import slot_events
+    slot_events.init_app(app)
+    
+    # Keep each doctor's patient roster in step with appointment changes
+    from app import roster
+    roster.init_app(app)
+    
+    # Send the reads of read-only views to the replica, if one is configured
+    from app import replica
+    replica.init_app(app)
+    
     # Login manager configuration
     login_manager.login_view = 'auth.login'
     login_manager.login_message = 'Please log in to access this page.'
     login_manager.login_message_category = 'info'
     
     # Register blueprints (routes)
-    from app.routes import home, auth, admin, doctor, patient, specialization, availability
+    from app.routes import home, auth, admin, doctor, patient, specialization, availability, api
     
     app.register_blueprint(home.bp)
     app.register_blueprint(auth.bp)
@@ -40,6 +101,11 @@ def create_app(config_name=None):
     app.register_blueprint(patient.bp)
     app.register_blueprint(specialization.bp)
     app.register_blueprint(availability.bp)
+    app.register_blueprint(api.bp)
+    
+    # Maintenance commands (flask create-indexes, ...)
+    from app import cli
+    cli.init_app(app)
     
     # Error handlers
     @app.errorhandler(404)
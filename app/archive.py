@@ -0,0 +1,191 @@
+"""Archive tier for closed appointments.
+
+Completed and Cancelled appointments older than ARCHIVE_AFTER_DAYS are
+moved, with their treatments, from `appointments`/`treatments` into
+`appointments_archive`/`treatments_archive`, keeping their ids. The hot
+tables then hold only recent and open appointments, which is what booking
+checks, lists and status filters read.
+
+`archive()` works in batches of ARCHIVE_BATCH_SIZE appointments, one
+transaction each (copy, then delete), walking the appointment date index
+from the oldest row. Stopping at any point leaves every appointment in
+exactly one of the two tables, so a run can simply be started again. A
+pause between batches (ARCHIVE_BATCH_PAUSE) keeps it from hogging the
+database.
+
+Dashboard counters keep counting archived appointments, the doctor's
+patient roster (app/roster.py) is built from both tiers, and the
+appointment lists, the patient history and the doctor's appointment
+detail read both tiers through the helpers below. Each batch bumps the
+change stamps (app/versions.py) of the patients and doctors it moved, as
+the rows their API lists return now come from the other table.
+"""
+import time
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from flask import current_app
+from sqlalchemy import delete, func, insert, literal, select, tuple_
+from sqlalchemy.orm import contains_eager, joinedload
+from app import db, versions
+from app.models import Appointment, ArchivedAppointment, ArchivedTreatment, Treatment
+from app.pagination import paginate_keyset_union
+
+ARCHIVABLE_STATUSES = ('Completed', 'Cancelled')
+
+ArchiveReport = namedtuple('ArchiveReport', 'appointments treatments batches finished')
+
+_APPOINTMENT_COLUMNS = ('id', 'patient_id', 'doctor_id', 'appointment_date', 'reason',
+                        'appointment_time', 'status', 'created_at')
+_TREATMENT_COLUMNS = ('id', 'appointment_id', 'diagnosis', 'prescription', 'notes', 'created_at')
+
+
+def cutoff(days=None):
+    """Appointments before this date are old enough to archive"""
+    if days is None:
+        days = current_app.config.get('ARCHIVE_AFTER_DAYS', 365)
+    return date.today() - timedelta(days=days)
+
+
+def _candidates(before):
+    return (
+        select(Appointment.id)
+        .where(Appointment.appointment_date < before,
+               Appointment.status.in_(ARCHIVABLE_STATUSES))
+    )
+
+
+def pending(before=None):
+    """Number of appointments the next run would archive"""
+    before = before or cutoff()
+    return db.session.scalar(select(func.count()).select_from(_candidates(before).subquery()))
+
+
+def _copy(connection, source, target, columns, condition, archived_at=None):
+    selected = [source.c[name] for name in columns]
+    names = list(columns)
+    if archived_at is not None:
+        selected.append(literal(archived_at, target.c.archived_at.type))
+        names.append('archived_at')
+    return connection.execute(
+        insert(target).from_select(names, select(*selected).where(condition))
+    ).rowcount
+
+
+def _archive_batch(connection, before, position, batch_size):
+    """Move one batch; returns (appointments, treatments, last sort key)"""
+    order = (Appointment.appointment_date, Appointment.appointment_time, Appointment.id)
+    query = (
+        select(*order, Appointment.patient_id, Appointment.doctor_id)
+        .where(Appointment.appointment_date < before,
+               Appointment.status.in_(ARCHIVABLE_STATUSES))
+        .order_by(*order)
+        .limit(batch_size)
+        # PostgreSQL: leave rows someone is writing to the next run
+        .with_for_update(skip_locked=True)
+    )
+    if position is not None:
+        bound = tuple_(*[literal(value, column.type) for column, value in zip(order, position)])
+        query = query.where(tuple_(*order) > bound)
+    rows = connection.execute(query).all()
+    if not rows:
+        return 0, 0, None
+    ids = [row.id for row in rows]
+
+    appointments, treatments = Appointment.__table__, Treatment.__table__
+    moved = _copy(connection, appointments, ArchivedAppointment.__table__, _APPOINTMENT_COLUMNS,
+                  appointments.c.id.in_(ids), archived_at=datetime.utcnow())
+    moved_treatments = _copy(connection, treatments, ArchivedTreatment.__table__, _TREATMENT_COLUMNS,
+                             treatments.c.appointment_id.in_(ids))
+    connection.execute(delete(treatments).where(treatments.c.appointment_id.in_(ids)))
+    connection.execute(delete(appointments).where(appointments.c.id.in_(ids)))
+    versions.bump(connection, {('patient', row.patient_id) for row in rows}
+                  | {('doctor', row.doctor_id) for row in rows})
+    return moved, moved_treatments, tuple(rows[-1])[:len(order)]
+
+
+def archive(before=None, batch_size=None, pause=None, max_batches=None, on_batch=None):
+    """Move closed appointments dated before `before` into the archive tables"""
+    config = current_app.config
+    before = before or cutoff()
+    batch_size = batch_size or config.get('ARCHIVE_BATCH_SIZE', 500)
+    pause = config.get('ARCHIVE_BATCH_PAUSE', 0.2) if pause is None else pause
+
+    appointments = treatments = batches = 0
+    position = None
+    while max_batches is None or batches < max_batches:
+        # Core statements bypass the flush hooks, which is what we want:
+        # the counters keep counting archived appointments
+        with db.engine.begin() as connection:
+            moved, moved_treatments, position = _archive_batch(connection, before, position, batch_size)
+        if not moved:
+            return ArchiveReport(appointments, treatments, batches, True)
+        appointments += moved
+        treatments += moved_treatments
+        batches += 1
+        if on_batch is not None:
+            on_batch(appointments, treatments)
+        if pause:
+            time.sleep(pause)
+    return ArchiveReport(appointments, treatments, batches, False)
+
+
+# Read-through helpers for views that show past appointments
+
+TIERS = (Appointment, ArchivedAppointment)
+
+
+def appointment_page(build, per_page=None):
+    """Keyset page of appointments from both tiers, newest first.
+
+    `build(model)` returns the filtered query for Appointment and for
+    ArchivedAppointment; the page cursor works across the two.
+    """
+    return paginate_keyset_union(
+        [(build(model), [model.appointment_date, model.appointment_time, model.id]) for model in TIERS],
+        descending=True, per_page=per_page
+    )
+
+
+def doctor_day(doctor_id, day):
+    """A doctor's appointments on one day from both tiers, by time"""
+    appointments = []
+    for model in TIERS:
+        appointments += model.query.options(
+            joinedload(model.doctor), joinedload(model.patient)
+        ).filter(
+            model.doctor_id == doctor_id,
+            model.appointment_date == day
+        ).all()
+    return sorted(appointments, key=lambda a: (a.appointment_time, a.id))
+
+def treatment_history(patient_id, order_by_treatment=False):
+    """Treatments of a patient's completed appointments, both tiers, newest first"""
+    hot = Treatment.query.join(Appointment).options(
+        contains_eager(Treatment.appointment).joinedload(Appointment.doctor)
+    ).filter(
+        Appointment.patient_id == patient_id,
+        Appointment.status == 'Completed'
+    ).all()
+    archived = ArchivedTreatment.query.join(ArchivedTreatment.appointment).options(
+        contains_eager(ArchivedTreatment.appointment).joinedload(ArchivedAppointment.doctor)
+    ).filter(
+        ArchivedAppointment.patient_id == patient_id,
+        ArchivedAppointment.status == 'Completed'
+    ).all()
+    if order_by_treatment:
+        key = lambda t: t.created_at or datetime.min
+    else:
+        key = lambda t: (t.appointment.appointment_date, t.appointment.appointment_time)
+    return sorted(hot + archived, key=key, reverse=True)
+
+
+def find_appointment(appointment_id):
+    """The Appointment, or the ArchivedAppointment with that id, or None"""
+    appointment = Appointment.query.options(
+        joinedload(Appointment.patient)
+    ).filter_by(id=appointment_id).first()
+    if appointment is None:
+        appointment = ArchivedAppointment.query.options(
+            joinedload(ArchivedAppointment.patient)
+        ).filter_by(id=appointment_id).first()
+    return appointment
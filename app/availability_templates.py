@@ -0,0 +1,259 @@
+"""Weekly availability templates and the bulk Availability generator.
+
+A template says "Mondays 09:00-13:00 in 20-minute slots" for one doctor,
+optionally between two dates. `generate()` expands every active template
+over a date range, cuts out AvailabilityException periods and writes the
+missing windows with a single bulk INSERT. A run reads templates,
+exceptions and existing availability once each, however many doctors it
+covers.
+
+Runs are idempotent: a window that already exists (same doctor, date,
+start and end) is skipped. A generated window that overlaps a different
+existing window is not inserted and is reported as a conflict.
+"""
+from collections import defaultdict, namedtuple
+from datetime import date, time, timedelta
+from sqlalchemy import delete, or_, select
+from app import db, next_slots, slot_events, slots, versions
+from app.models import Availability, AvailabilityException, AvailabilityTemplate, ExceptionCutWindow
+
+WHOLE_DAY = (0, 24 * 60)
+
+GenerationReport = namedtuple('GenerationReport', 'created existing conflicts')
+Conflict = namedtuple('Conflict', 'doctor_id date start_time end_time existing_start existing_end')
+
+
+def _minute(value):
+    return value.hour * 60 + value.minute
+
+
+def _time(minute):
+    return time(minute // 60, minute % 60)
+
+
+def subtract(intervals, blocked):
+    """Minute intervals [(start, end), ...] with the `blocked` intervals cut out"""
+    result = []
+    for interval in intervals:
+        pieces = [interval]
+        for blocked_start, blocked_end in blocked:
+            remaining = []
+            for start, end in pieces:
+                if blocked_end <= start or blocked_start >= end:
+                    remaining.append((start, end))
+                    continue
+                if start < blocked_start:
+                    remaining.append((start, blocked_start))
+                if blocked_end < end:
+                    remaining.append((blocked_end, end))
+            pieces = remaining
+        result.extend(pieces)
+    return result
+
+
+def exception_span(exception):
+    if exception.start_time is None or exception.end_time is None:
+        return WHOLE_DAY
+    return (_minute(exception.start_time), _minute(exception.end_time))
+
+
+def find_template_overlap(doctor_id, weekday, start_time, end_time,
+                          valid_from=None, valid_until=None, exclude_id=None):
+    """An active template of the doctor that overlaps the given one, or None"""
+    query = AvailabilityTemplate.query.filter(
+        AvailabilityTemplate.doctor_id == doctor_id,
+        AvailabilityTemplate.weekday == weekday,
+        AvailabilityTemplate.is_active.isnot(False),
+        AvailabilityTemplate.start_time < end_time,
+        AvailabilityTemplate.end_time > start_time,
+    )
+    if valid_from is not None:
+        query = query.filter(or_(AvailabilityTemplate.valid_until.is_(None),
+                                 AvailabilityTemplate.valid_until >= valid_from))
+    if valid_until is not None:
+        query = query.filter(or_(AvailabilityTemplate.valid_from.is_(None),
+                                 AvailabilityTemplate.valid_from <= valid_until))
+    if exclude_id is not None:
+        query = query.filter(AvailabilityTemplate.id != exclude_id)
+    return query.first()
+
+
+def find_availability_overlap(doctor_id, day, start_time, end_time):
+    """An existing availability window of the doctor that overlaps, or None"""
+    return Availability.query.filter(
+        Availability.doctor_id == doctor_id,
+        Availability.date == day,
+        Availability.start_time < end_time,
+        Availability.end_time > start_time,
+    ).first()
+
+
+def plan(connection, start_date, end_date, doctor_ids=None):
+    """Rows `generate()` would insert, plus the existing count and conflicts"""
+    default_length = slots.slot_minutes()
+
+    templates = select(AvailabilityTemplate.__table__).where(
+        AvailabilityTemplate.is_active.isnot(False),
+        or_(AvailabilityTemplate.valid_from.is_(None), AvailabilityTemplate.valid_from <= end_date),
+        or_(AvailabilityTemplate.valid_until.is_(None), AvailabilityTemplate.valid_until >= start_date),
+    )
+    if doctor_ids is not None:
+        templates = templates.where(AvailabilityTemplate.doctor_id.in_(doctor_ids))
+    by_weekday = defaultdict(list)
+    for template in connection.execute(templates):
+        by_weekday[template.weekday].append(template)
+    doctors = {t.doctor_id for day_templates in by_weekday.values() for t in day_templates}
+    if not doctors:
+        return [], 0, []
+
+    blocked = defaultdict(list)
+    for exception in connection.execute(
+        select(AvailabilityException.__table__).where(
+            AvailabilityException.doctor_id.in_(doctors),
+            AvailabilityException.date.between(start_date, end_date))
+    ):
+        blocked[(exception.doctor_id, exception.date)].append(exception_span(exception))
+
+    taken = defaultdict(list)
+    for doctor_id, day, start_time, end_time in connection.execute(
+        select(Availability.doctor_id, Availability.date,
+               Availability.start_time, Availability.end_time)
+        .where(Availability.doctor_id.in_(doctors),
+               Availability.date.between(start_date, end_date))
+    ):
+        taken[(doctor_id, day)].append((_minute(start_time), _minute(end_time)))
+
+    rows, existing, conflicts = [], 0, []
+    day = start_date
+    while day <= end_date:
+        for template in sorted(by_weekday[day.weekday()], key=lambda t: (t.doctor_id, t.start_time)):
+            if template.valid_from and day < template.valid_from:
+                continue
+            if template.valid_until and day > template.valid_until:
+                continue
+            key = (template.doctor_id, day)
+            length = template.slot_minutes or default_length
+            window = (_minute(template.start_time), _minute(template.end_time))
+            for start, end in subtract([window], blocked[key]):
+                if end - start < length:
+                    continue
+                if (start, end) in taken[key]:
+                    existing += 1
+                    continue
+                clash = next(((s, e) for s, e in taken[key] if s < end and start < e), None)
+                if clash:
+                    conflicts.append(Conflict(template.doctor_id, day, _time(start), _time(end),
+                                              _time(clash[0]), _time(clash[1])))
+                    continue
+                taken[key].append((start, end))
+                rows.append({
+                    'doctor_id': template.doctor_id,
+                    'date': day,
+                    'start_time': _time(start),
+                    'end_time': _time(end),
+                    'is_available': True,
+                    'slot_minutes': template.slot_minutes,
+                    'template_id': template.id,
+                })
+        day += timedelta(days=1)
+    return rows, existing, conflicts
+
+
+def generate(connection, start_date=None, days=28, doctor_ids=None, dry_run=False):
+    """Materialize templates into Availability rows for `days` days from start_date"""
+    start_date = start_date or date.today()
+    end_date = start_date + timedelta(days=days - 1)
+    rows, existing, conflicts = plan(connection, start_date, end_date, doctor_ids)
+    if rows and not dry_run:
+        connection.execute(Availability.__table__.insert(), rows)
+        # Core inserts bypass the flush hooks that keep the next-slot index
+        # and the API version stamps current
+        doctor_ids = {row['doctor_id'] for row in rows}
+        next_slots.refresh(connection, doctor_ids)
+        versions.bump(connection, [('doctor', doctor_id) for doctor_id in doctor_ids])
+        slot_events.defer(slot_events.availability_changed(
+            (row['doctor_id'], row['date']) for row in rows))
+    return GenerationReport(len(rows), existing, conflicts)
+
+
+def apply_exception(exception):
+    """Cut an exception out of the doctor's existing windows on that date.
+
+    Manual windows (no template) are remembered on the exception as they
+    were, so `remove_exception()` can give them back.
+    """
+    blocked = [exception_span(exception)]
+    windows = Availability.query.filter_by(doctor_id=exception.doctor_id, date=exception.date).all()
+    for window in windows:
+        span = (_minute(window.start_time), _minute(window.end_time))
+        pieces = subtract([span], blocked)
+        if pieces == [span]:
+            continue
+        if window.template_id is None:
+            exception.cut_windows.append(ExceptionCutWindow(
+                start_time=window.start_time, end_time=window.end_time,
+                is_available=window.is_available, slot_minutes=window.slot_minutes,
+            ))
+        db.session.delete(window)
+        for start, end in pieces:
+            db.session.add(Availability(
+                doctor_id=window.doctor_id, date=window.date,
+                start_time=_time(start), end_time=_time(end),
+                is_available=window.is_available, slot_minutes=window.slot_minutes,
+                template_id=window.template_id,
+            ))
+
+
+def remove_exception(exception):
+    """Delete an exception and restore the manual windows it cut.
+
+    Each remembered window is merged with the manual windows now
+    overlapping it (the pieces of the split, or a window another removed
+    exception gave back) and written again minus the doctor's other
+    exceptions that day. Template windows are the caller's: regenerate
+    the day.
+    """
+    others = [exception_span(other) for other in AvailabilityException.query.filter(
+        AvailabilityException.doctor_id == exception.doctor_id,
+        AvailabilityException.date == exception.date,
+        AvailabilityException.id != exception.id)]
+    manual = Availability.query.filter_by(doctor_id=exception.doctor_id, date=exception.date,
+                                          template_id=None).all()
+    for original in exception.cut_windows:
+        start, end = _minute(original.start_time), _minute(original.end_time)
+        merged = True
+        while merged:
+            merged = False
+            for window in list(manual):
+                if _minute(window.start_time) < end and start < _minute(window.end_time):
+                    start, end = min(start, _minute(window.start_time)), max(end, _minute(window.end_time))
+                    manual.remove(window)
+                    db.session.delete(window)
+                    merged = True
+        for piece_start, piece_end in subtract([(start, end)], others):
+            window = Availability(
+                doctor_id=exception.doctor_id, date=exception.date,
+                start_time=_time(piece_start), end_time=_time(piece_end),
+                is_available=original.is_available, slot_minutes=original.slot_minutes,
+            )
+            db.session.add(window)
+            manual.append(window)
+    db.session.delete(exception)
+
+
+def remove_generated(doctor_id, template_id=None, day=None, from_date=None):
+    """Delete template-generated windows (of one template, on one day or from a date)"""
+    conditions = [Availability.doctor_id == doctor_id, Availability.template_id.isnot(None)]
+    if template_id is not None:
+        conditions.append(Availability.template_id == template_id)
+    if day is not None:
+        conditions.append(Availability.date == day)
+    if from_date is not None:
+        conditions.append(Availability.date >= from_date)
+    connection = db.session.connection()
+    days = connection.scalars(select(Availability.date).distinct().where(*conditions)).all()
+    deleted = connection.execute(delete(Availability).where(*conditions)).rowcount
+    next_slots.refresh(connection, [doctor_id])
+    versions.bump(connection, [('doctor', doctor_id)])
+    slot_events.defer(slot_events.availability_changed((doctor_id, d) for d in days))
+    return deleted
@@ -0,0 +1,98 @@
+"""Appointment booking backed by the active-slot unique index.
+
+Instead of checking for a Booked row and then inserting (which lets two
+workers book the same slot), the insert/update is attempted directly and
+the partial unique index uq_appointments_active_slot rejects the loser.
+Only writers touching the same doctor and slot ever contend.
+"""
+import time as _time
+from flask import current_app
+from sqlalchemy.exc import IntegrityError, OperationalError
+from app import db, slots
+from app.models import Appointment
+
+
+class SlotUnavailable(Exception):
+    """The requested slot is already booked; `alternatives` lists free times"""
+
+    def __init__(self, alternatives):
+        super().__init__('This time slot is already booked.')
+        self.alternatives = alternatives
+
+
+def _is_slot_conflict(error):
+    message = str(error.orig)
+    # PostgreSQL names the index, SQLite lists the indexed columns
+    return ('uq_appointments_active_slot' in message or
+            'appointments.appointment_time' in message)
+
+
+def _commit_with_retry(apply_change):
+    """Run apply_change() and commit, retrying transient lock errors.
+
+    Returns normally on success. A unique-index violation is not transient
+    and is re-raised as IntegrityError for the caller to turn into
+    SlotUnavailable.
+    """
+    retries = current_app.config.get('BOOKING_RETRIES', 3)
+    for attempt in range(retries + 1):
+        try:
+            result = apply_change()
+            db.session.commit()
+            return result
+        except IntegrityError:
+            db.session.rollback()
+            raise
+        except OperationalError:
+            # 'database is locked' on SQLite, serialization failures on PostgreSQL
+            db.session.rollback()
+            if attempt == retries:
+                raise
+            _time.sleep(0.05 * (2 ** attempt))
+
+
+def suggest_slots(doctor_id, day, after, count=3):
+    """Free slot times for a doctor on `day`, starting after `after`"""
+    free = slots.free_slots([doctor_id], day, day).get(doctor_id, {}).get(day, [])
+    return [slot_time for slot_time in free if slot_time > after][:count]
+
+
+def book_slot(patient_id, doctor_id, appointment_date, appointment_time, reason=None):
+    """Create a Booked appointment or raise SlotUnavailable"""
+    def insert():
+        appointment = Appointment(
+            patient_id=patient_id,
+            doctor_id=doctor_id,
+            appointment_date=appointment_date,
+            appointment_time=appointment_time,
+            reason=reason,
+            status='Booked'
+        )
+        db.session.add(appointment)
+        return appointment
+
+    try:
+        return _commit_with_retry(insert)
+    except IntegrityError as e:
+        if not _is_slot_conflict(e):
+            raise
+        raise SlotUnavailable(suggest_slots(doctor_id, appointment_date, appointment_time))
+
+
+def reschedule_slot(appointment, new_date, new_time):
+    """Move a Booked appointment to a new slot or raise SlotUnavailable"""
+    appointment_id, doctor_id = appointment.id, appointment.doctor_id
+
+    def update():
+        # Reload after a rollback so the change is applied to fresh state
+        current = db.session.get(Appointment, appointment_id)
+        current.appointment_date = new_date
+        current.appointment_time = new_time
+        return current
+
+    try:
+        return _commit_with_retry(update)
+    except IntegrityError as e:
+        if not _is_slot_conflict(e):
+            raise
+        raise SlotUnavailable(suggest_slots(doctor_id, new_date, new_time))
@@ -0,0 +1,202 @@
+"""Streaming CSV import of patients and doctors.
+
+The file is read row by row and processed in chunks of IMPORT_CHUNK_SIZE.
+Per chunk, the rows are validated, existing emails are found with one
+`SELECT ... WHERE email IN (...)`, passwords are hashed with
+PASSWORD_HASH_METHOD in a process pool, and users and profiles are
+inserted with two bulk INSERTs in one transaction. Memory stays bounded by the chunk size (plus the set of
+emails seen so far, to catch duplicates inside the file).
+
+Expected columns (header row required, extra columns ignored):
+
+    patients: email, password, name, phone, date_of_birth (YYYY-MM-DD),
+              address, medical_history
+    doctors:  email, password, name, phone, specialization (name or id),
+              experience, bio
+
+Rows that fail are skipped and reported with their line number; the rest
+of the chunk is still imported.
+"""
+import csv
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import islice, repeat
+from flask import current_app
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from werkzeug.security import generate_password_hash
+from app import counters, db, passwords, reference_data, search
+from app.models import Doctor, Patient, Specialization, User
+
+KINDS = ('patient', 'doctor')
+MAX_REPORTED_ERRORS = 1000
+
+RowError = namedtuple('RowError', 'line email message')
+
+
+class ImportReport:
+    def __init__(self, kind):
+        self.kind = kind
+        self.rows = 0
+        self.created = 0
+        self.error_count = 0
+        self.errors = []  # the first MAX_REPORTED_ERRORS RowErrors
+
+    def add_error(self, error, on_error=None):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(error)
+        if on_error is not None:
+            on_error(error)
+
+
+def _hash_password(password, method):
+    # Runs in the worker processes
+    return generate_password_hash(password, method)
+
+
+def _clean(row):
+    return {(key or '').strip().lower(): (value or '').strip() for key, value in row.items()}
+
+
+def _patient_profile(row):
+    date_of_birth = row.get('date_of_birth')
+    return {
+        'name': row['name'],
+        'phone': row.get('phone') or None,
+        'date_of_birth': datetime.strptime(date_of_birth, '%Y-%m-%d').date() if date_of_birth else None,
+        'address': row.get('address') or None,
+        'medical_history': row.get('medical_history') or None,
+    }
+
+
+def _doctor_profile(row, specializations):
+    value = row.get('specialization', '')
+    specialization_id = specializations.get(value.lower())
+    if specialization_id is None and value.isdigit() and int(value) in specializations.values():
+        specialization_id = int(value)
+    if specialization_id is None:
+        raise ValueError(f'unknown specialization "{value}"')
+    experience = row.get('experience')
+    return {
+        'name': row['name'],
+        'phone': row.get('phone') or None,
+        'specialization_id': specialization_id,
+        'experience': int(experience) if experience else 0,
+        'bio': row.get('bio') or None,
+        'is_active': True,
+    }
+
+
+def _validate(chunk, kind, seen, specializations, default_password):
+    """Split a chunk into (line, email, password, profile) rows and RowErrors"""
+    valid, errors = [], []
+    for line, raw in chunk:
+        row = _clean(raw)
+        email = row.get('email', '')
+        password = row.get('password') or default_password
+        try:
+            if not email or '@' not in email:
+                raise ValueError('missing or invalid email')
+            if not row.get('name'):
+                raise ValueError('missing name')
+            if not password:
+                raise ValueError('missing password')
+            if email in seen:
+                raise ValueError('email appears earlier in the file')
+            if kind == 'patient':
+                profile = _patient_profile(row)
+            else:
+                profile = _doctor_profile(row, specializations)
+        except ValueError as e:
+            errors.append(RowError(line, email, str(e)))
+            continue
+        seen.add(email)
+        valid.append((line, email, password, profile))
+    return valid, errors
+
+
+def _insert_chunk(connection, kind, rows, hashes):
+    """Insert users and profiles; returns the new profile ids"""
+    now = datetime.utcnow()
+    connection.execute(User.__table__.insert(), [
+        {'email': email, 'password_hash': password_hash, 'role': kind, 'created_at': now}
+        for (_, email, _, _), password_hash in zip(rows, hashes)
+    ])
+    user_ids = dict(connection.execute(
+        select(User.email, User.id).where(User.email.in_([email for _, email, _, _ in rows]))
+    ).all())
+
+    model = Patient if kind == 'patient' else Doctor
+    connection.execute(model.__table__.insert(), [
+        dict(profile, user_id=user_ids[email]) for _, email, _, profile in rows
+    ])
+    return list(connection.scalars(
+        select(model.id).where(model.user_id.in_(list(user_ids.values())))
+    ))
+
+
+def import_csv(stream, kind, default_password=None, chunk_size=None, workers=None, on_error=None):
+    """Import patients or doctors from a CSV text stream; returns an ImportReport"""
+    if kind not in KINDS:
+        raise ValueError(f'kind must be one of {KINDS}')
+    config = current_app.config
+    chunk_size = chunk_size or config.get('IMPORT_CHUNK_SIZE', 1000)
+    workers = workers or config.get('IMPORT_HASH_WORKERS')
+    hash_method = passwords.method()
+
+    report = ImportReport(kind)
+    specializations = {
+        name.lower(): spec_id
+        for spec_id, name in db.session.execute(select(Specialization.id, Specialization.name))
+    }
+    seen = set()
+    # Line numbers as shown in a spreadsheet: the header is line 1
+    rows = ((line, row) for line, row in enumerate(csv.DictReader(stream), start=2))
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            report.rows += len(chunk)
+
+            valid, errors = _validate(chunk, kind, seen, specializations, default_password)
+            for error in errors:
+                report.add_error(error, on_error)
+            if not valid:
+                continue
+
+            # One set-based uniqueness check per chunk
+            taken = set(db.session.scalars(
+                select(User.email).where(User.email.in_([email for _, email, _, _ in valid]))
+            ))
+            db.session.rollback()
+            for line, email, _, _ in valid:
+                if email in taken:
+                    report.add_error(RowError(line, email, 'email already registered'), on_error)
+            valid = [row for row in valid if row[1] not in taken]
+            if not valid:
+                continue
+
+            hashes = list(pool.map(_hash_password, [password for _, _, password, _ in valid],
+                                   repeat(hash_method),
+                                   chunksize=max(1, len(valid) // (4 * (workers or 4)))))
+            try:
+                with db.engine.begin() as connection:
+                    profile_ids = _insert_chunk(connection, kind, valid, hashes)
+                    # Core inserts skip the flush hooks; keep counters and search current
+                    counters.apply_deltas(connection, {('global', 0, kind + 's'): len(profile_ids)})
+                    search.refresh(connection, kind, profile_ids)
+            except IntegrityError:
+                # An email was registered concurrently; report the chunk rather than guess
+                for line, email, _, _ in valid:
+                    report.add_error(RowError(line, email, 'not imported: chunk hit a duplicate email, retry the file'),
+                                     on_error)
+                continue
+            report.created += len(profile_ids)
+
+    if kind == 'doctor' and report.created:
+        reference_data.invalidate()
+    return report
@@ -0,0 +1,77 @@
+"""Small in-process cache with TTL, size bound and versioned invalidation.
+
+Every entry remembers the cache version it was loaded under. `invalidate()`
+bumps the version, so entries loaded before the change are never served
+again, and a load that was already running when the change happened is not
+stored. Entries are also dropped after `ttl` seconds, which bounds how
+stale another worker process can be, and the least recently used entry is
+evicted once `max_entries` is reached.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class VersionedCache:
+
+    def __init__(self, name, ttl=300, max_entries=128):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.version = 0
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+        self._entries = OrderedDict()  # key -> (version, expires_at, value)
+        self._lock = threading.Lock()
+
+    def configure(self, ttl=None, max_entries=None):
+        with self._lock:
+            if ttl is not None:
+                self.ttl = ttl
+            if max_entries is not None:
+                self.max_entries = max_entries
+            self._entries.clear()
+
+    def get(self, key, loader):
+        """Cached value for `key`, calling loader() on a miss"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == self.version and entry[1] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+            version = self.version
+
+        value = loader()
+
+        with self._lock:
+            # Skip the store if the data changed while we were loading
+            if self.ttl > 0 and version == self.version:
+                self._entries[key] = (version, now + self.ttl, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return value
+
+    def invalidate(self):
+        """Forget every entry; call after changing the cached data"""
+        with self._lock:
+            self.version += 1
+            self.invalidations += 1
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'name': self.name,
+                'version': self.version,
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
@@ -0,0 +1,326 @@
+"""Maintenance commands, run with `flask --app run.py <command>`"""
+import click
+from flask.cli import with_appcontext
+from sqlalchemy.exc import SQLAlchemyError
+from app import db
+
+
+@click.command('create-indexes')
+@with_appcontext
+def create_indexes_command():
+    """Add the indexes declared on the models to an existing database."""
+    for table in db.metadata.sorted_tables:
+        for index in sorted(table.indexes, key=lambda ix: ix.name):
+            try:
+                index.create(db.engine, checkfirst=True)
+            except SQLAlchemyError as e:
+                raise click.ClickException(f"{index.name}: {getattr(e, 'orig', None) or e}")
+            click.echo(f'✓ {table.name}.{index.name}')
+
+
+@click.command('check-query-plans')
+@click.option('--verbose', is_flag=True, help='Print the full plan of every query.')
+@with_appcontext
+def check_query_plans_command(verbose):
+    """EXPLAIN the hot queries and fail if any of them scans a whole table."""
+    from app.query_plans import check_query_plans
+
+    failed = 0
+    for name, plan, scans in check_query_plans():
+        if scans:
+            failed += 1
+            click.echo(f'✗ {name}: ' + '; '.join(scans))
+        else:
+            click.echo(f'✓ {name}')
+        if verbose:
+            for line in plan:
+                click.echo(f'    {line}')
+
+    if failed:
+        raise click.ClickException(f'{failed} hot queries use a table scan')
+
+
+@click.command('rebuild-search-index')
+@with_appcontext
+def rebuild_search_index_command():
+    """Create the full-text search tables and re-index every doctor and patient."""
+    from app import search
+
+    with db.engine.begin() as connection:
+        backend = search.rebuild(connection)
+    click.echo(f'✓ Search index rebuilt ({backend})')
+
+
+@click.command('rebuild-counters')
+@with_appcontext
+def rebuild_counters_command():
+    """Recompute the dashboard counters from the appointment and profile tables."""
+    from app import counters
+
+    with db.engine.begin() as connection:
+        rows = counters.rebuild(connection)
+    click.echo(f'✓ {rows} counters rebuilt')
+
+
+@click.command('refresh-next-slots')
+@with_appcontext
+def refresh_next_slots_command():
+    """Recompute every doctor's next free slots (run periodically, e.g. hourly)."""
+    from app import next_slots
+
+    with db.engine.begin() as connection:
+        rows = next_slots.rebuild(connection)
+    click.echo(f'✓ {rows} next free slots stored')
+
+
+@click.command('rebuild-rosters')
+@with_appcontext
+def rebuild_rosters_command():
+    """Recompute every doctor's patient roster from the appointment tables."""
+    from app import roster
+
+    with db.engine.begin() as connection:
+        rows = roster.rebuild(connection)
+    click.echo(f'✓ {rows} roster rows rebuilt')
+
+
+@click.command('refresh-rosters')
+@with_appcontext
+def refresh_rosters_command():
+    """Recompute roster rows whose next appointment has passed (run daily, after midnight)."""
+    from app import roster
+
+    with db.engine.begin() as connection:
+        rows = roster.refresh_passed(connection)
+    click.echo(f'✓ {rows} roster rows with a passed appointment refreshed')
+
+
+@click.command('generate-availability')
+@click.option('--days', type=int, default=None,
+              help='Number of days to generate (default AVAILABILITY_GENERATE_DAYS).')
+@click.option('--start', 'start_date', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help='First day to generate (default today).')
+@click.option('--doctor', 'doctor_ids', type=int, multiple=True,
+              help='Only this doctor id (repeatable). Default: every doctor.')
+@click.option('--dry-run', is_flag=True, help='Report what would be created without writing.')
+@with_appcontext
+def generate_availability_command(days, start_date, doctor_ids, dry_run):
+    """Materialize weekly availability templates into availability windows."""
+    from flask import current_app
+    from app import availability_templates, slot_events
+
+    days = days or current_app.config.get('AVAILABILITY_GENERATE_DAYS', 28)
+    with db.engine.begin() as connection:
+        report = availability_templates.generate(
+            connection,
+            start_date=start_date.date() if start_date else None,
+            days=days,
+            doctor_ids=list(doctor_ids) or None,
+            dry_run=dry_run
+        )
+    # Committed outside the session; announce the new windows now
+    slot_events.publish_deferred()
+    for conflict in report.conflicts:
+        click.echo(f'✗ doctor {conflict.doctor_id} {conflict.date} '
+                   f'{conflict.start_time:%H:%M}-{conflict.end_time:%H:%M} overlaps '
+                   f'{conflict.existing_start:%H:%M}-{conflict.existing_end:%H:%M}')
+    verb = 'to create' if dry_run else 'created'
+    click.echo(f'✓ {report.created} windows {verb}, {report.existing} already present, '
+               f'{len(report.conflicts)} conflicts')
+
+
+@click.command('import-csv')
+@click.argument('kind', type=click.Choice(['patient', 'doctor']))
+@click.argument('csv_file', type=click.File('r', encoding='utf-8-sig'))
+@click.option('--default-password', default=None,
+              help='Password for rows without one (users should change it).')
+@click.option('--chunk-size', type=int, default=None, help='Rows per transaction (IMPORT_CHUNK_SIZE).')
+@click.option('--workers', type=int, default=None, help='Password hashing processes.')
+@click.option('--errors', 'errors_file', type=click.File('w'), default=None,
+              help='Write every rejected row (line, email, reason) to this CSV file.')
+@with_appcontext
+def import_csv_command(kind, csv_file, default_password, chunk_size, workers, errors_file):
+    """Bulk import patients or doctors from a CSV file."""
+    import csv
+    import time
+    from app.bulk_import import import_csv
+
+    on_error = None
+    if errors_file is not None:
+        writer = csv.writer(errors_file)
+        writer.writerow(['line', 'email', 'error'])
+        on_error = writer.writerow
+
+    started = time.perf_counter()
+    report = import_csv(csv_file, kind, default_password=default_password,
+                        chunk_size=chunk_size, workers=workers, on_error=on_error)
+    elapsed = time.perf_counter() - started
+
+    if errors_file is None:
+        for error in report.errors[:20]:
+            click.echo(f'✗ line {error.line} {error.email}: {error.message}')
+        if report.error_count > 20:
+            click.echo(f'  ... {report.error_count - 20} more (use --errors FILE for all)')
+    click.echo(f'✓ {report.created} of {report.rows} {kind}s imported in {elapsed:.1f}s, '
+               f'{report.error_count} rejected')
+
+
+@click.command('export-appointments')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']), default='csv', show_default=True)
+@click.option('--from', 'start_date', type=click.DateTime(['%Y-%m-%d']), help='First appointment date.')
+@click.option('--to', 'end_date', type=click.DateTime(['%Y-%m-%d']), help='Last appointment date.')
+@click.option('--doctor', 'doctor_id', type=int, help='Only this doctor id.')
+@click.option('--status', type=click.Choice(['Booked', 'Completed', 'Cancelled']))
+@click.option('--gzip', is_flag=True, help='Compress the output.')
+@click.option('--batch-size', type=int, help='Rows fetched per batch (default EXPORT_BATCH_SIZE).')
+@click.option('--output', '-o', type=click.File('wb'), default='-', help='Output file (default stdout).')
+@with_appcontext
+def export_appointments_command(fmt, start_date, end_date, doctor_id, status, gzip, batch_size, output):
+    """Export appointments with treatments and patient/doctor names."""
+    from app.export import stream
+
+    for chunk in stream(fmt, gzip=gzip, batch_size=batch_size,
+                        start_date=start_date.date() if start_date else None,
+                        end_date=end_date.date() if end_date else None,
+                        doctor_id=doctor_id, status=status):
+        output.write(chunk)
+
+
+
+@click.command('archive-appointments')
+@click.option('--older-than', 'days', type=int, default=None,
+              help='Archive closed appointments older than this many days (default ARCHIVE_AFTER_DAYS).')
+@click.option('--batch-size', type=int, default=None, help='Appointments per transaction (ARCHIVE_BATCH_SIZE).')
+@click.option('--pause', type=float, default=None, help='Seconds between batches (ARCHIVE_BATCH_PAUSE).')
+@click.option('--max-batches', type=int, default=None, help='Stop after this many batches; run again to resume.')
+@click.option('--dry-run', is_flag=True, help='Only count the appointments that would be archived.')
+@with_appcontext
+def archive_appointments_command(days, batch_size, pause, max_batches, dry_run):
+    """Move old Completed/Cancelled appointments and their treatments to the archive tables."""
+    from app import archive
+
+    before = archive.cutoff(days)
+    if dry_run:
+        click.echo(f'✓ {archive.pending(before)} appointments before {before} to archive')
+        return
+
+    def progress(appointments, treatments):
+        click.echo(f'  {appointments} appointments, {treatments} treatments archived')
+
+    report = archive.archive(before, batch_size=batch_size, pause=pause,
+                             max_batches=max_batches, on_batch=progress)
+    state = 'done' if report.finished else 'stopped early, run again to continue'
+    click.echo(f'✓ {report.appointments} appointments and {report.treatments} treatments '
+               f'before {before} archived in {report.batches} batches ({state})')
+
+
+
+@click.command('sync-replica')
+@with_appcontext
+def sync_replica_command():
+    """Copy the SQLite primary onto the SQLite replica (local stand-in for replication)."""
+    from app.replica import replica_engine
+
+    primary, replica = db.engine, replica_engine()
+    if replica is None:
+        raise click.ClickException('No replica configured (set REPLICA_DATABASE_URL)')
+    if primary.dialect.name != 'sqlite' or replica.dialect.name != 'sqlite':
+        raise click.ClickException('Only SQLite files can be copied; use the database\'s own replication')
+    source, target = primary.raw_connection(), replica.raw_connection()
+    try:
+        source.driver_connection.backup(target.driver_connection)
+    finally:
+        target.close()
+        source.close()
+    click.echo(f'✓ {primary.url.database} copied to {replica.url.database}')
+
+
+@click.command('seed')
+@click.option('--specializations', type=int, default=8, show_default=True)
+@click.option('--doctors', type=int, default=5, show_default=True)
+@click.option('--patients', type=int, default=10, show_default=True)
+@click.option('--appointments', type=int, default=40, show_default=True)
+@click.option('--history-days', type=int, default=365, show_default=True,
+              help='Days of past appointments before today.')
+@click.option('--future-days', type=int, default=14, show_default=True,
+              help='Days of availability and booked appointments from today.')
+@click.option('--seed', type=int, default=42, show_default=True, help='Same seed, same rows.')
+@click.option('--today', type=click.DateTime(['%Y-%m-%d']), default=None,
+              help='Date the data is generated around (default today); pass it again to resume a run.')
+@click.option('--batch-size', type=int, default=None, help='Ids per transaction (SEED_BATCH_SIZE).')
+@with_appcontext
+def seed_command(specializations, doctors, patients, appointments, history_days, future_days, seed,
+                 today, batch_size):
+    """Create the admin and generate doctors, patients and appointments (resumable)."""
+    import time
+    from app.seeding import ADMIN_EMAIL, PASSWORDS, PHASES, SeedPlan, email, seed as run_seed
+
+    db.create_all()
+    plan = SeedPlan(specializations=specializations, doctors=doctors, patients=patients,
+                    appointments=appointments, history_days=history_days, future_days=future_days,
+                    seed=seed, today=today.date() if today else None)
+    started = time.perf_counter()
+    last = {'phase': None, 'echoed': 0.0, 'started': started, 'done': 0}
+    row_phases = {phase for phase, *_ in PHASES}
+
+    def progress(phase, done, total):
+        now = time.perf_counter()
+        if phase != last['phase']:
+            last.update(phase=phase, started=now, done=done)
+        elif done < total and now - last['echoed'] < 2:
+            return
+        last['echoed'] = now
+        rate = (done - last['done']) / (now - last['started']) if now > last['started'] else 0
+        click.echo(f'  {phase}: {done:,}/{total:,}' + (f' ({rate:,.0f} rows/s)' if rate and phase in row_phases else ''))
+
+    try:
+        report = run_seed(plan, batch_size=batch_size, on_progress=progress)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    elapsed = time.perf_counter() - started
+
+    inserted = ', '.join(f'{count:,} {phase}' for phase, count in report.inserted.items() if count)
+    click.echo(f'✓ {inserted or "nothing new"} written in {elapsed:.1f}s')
+    if report.admin_created:
+        click.echo(f'✓ Admin: {ADMIN_EMAIL} / {PASSWORDS["admin"]}')
+    if doctors:
+        click.echo(f'✓ Doctors: {email("doctor", 1)} ... {email("doctor", doctors)} / {PASSWORDS["doctor"]}')
+    if patients:
+        click.echo(f'✓ Patients: {email("patient", 1)} ... {email("patient", patients)} / {PASSWORDS["patient"]}')
+
+
+@click.command('precompile-templates')
+@with_appcontext
+def precompile_templates_command():
+    """Compile every template into the bytecode cache (run at build/deploy time)."""
+    from app import templating
+
+    try:
+        results = templating.precompile()
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    failed = [result for result in results if result.error]
+    for result in failed:
+        click.echo(f'✗ {result.name}: {result.error}')
+    total_ms = sum(result.ms for result in results)
+    click.echo(f'✓ {len(results) - len(failed)} templates compiled into '
+               f'{templating.cache_directory()} in {total_ms:.0f} ms')
+    if failed:
+        raise click.ClickException(f'{len(failed)} templates failed to compile')
+
+
+def init_app(app):
+    app.cli.add_command(create_indexes_command)
+    app.cli.add_command(check_query_plans_command)
+    app.cli.add_command(rebuild_search_index_command)
+    app.cli.add_command(rebuild_counters_command)
+    app.cli.add_command(refresh_next_slots_command)
+    app.cli.add_command(rebuild_rosters_command)
+    app.cli.add_command(refresh_rosters_command)
+    app.cli.add_command(generate_availability_command)
+    app.cli.add_command(import_csv_command)
+    app.cli.add_command(export_appointments_command)
+    app.cli.add_command(archive_appointments_command)
+    app.cli.add_command(sync_replica_command)
+    app.cli.add_command(seed_command)
+    app.cli.add_command(precompile_templates_command)
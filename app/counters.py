@@ -0,0 +1,168 @@
+"""Incrementally maintained dashboard counters.
+
+Rows in the `counters` table are keyed by (scope, scope_id, name):
+
+    ('global', 0, 'doctors')               number of doctors
+    ('global', 0, 'patients')              number of patients
+    (<scope>, <id>, 'appointments')        all appointments
+    (<scope>, <id>, 'status:<status>')     appointments per status
+
+where <scope> is 'global' (id 0), 'doctor' or 'patient'. An after_flush hook
+turns appointment/doctor/patient inserts, status changes and deletes into
++/- deltas and applies them with an upsert in the same transaction, so a
+dashboard is a single primary-key range read. `rebuild()` recomputes
+everything from the source tables.
+"""
+from collections import Counter as Deltas, defaultdict
+from sqlalchemy import event, func, inspect, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from app import db
+from app.history import keep_previous
+from app.models import Appointment, ArchivedAppointment, Counter, Doctor, Patient
+
+_UPSERT_DIALECTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+# Appointment attributes that decide which counters a row belongs to
+_TRACKED = ('doctor_id', 'patient_id', 'status')
+
+
+def _appointment_keys(doctor_id, patient_id, status):
+    status_name = f'status:{status}'
+    return [
+        ('global', 0, 'appointments'), ('global', 0, status_name),
+        ('doctor', doctor_id, 'appointments'), ('doctor', doctor_id, status_name),
+        ('patient', patient_id, 'appointments'), ('patient', patient_id, status_name),
+    ]
+
+
+def _old_value(state, key):
+    history = state.attrs[key].history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(state.object, key)
+
+
+def _collect_deltas(session):
+    deltas = Deltas()
+
+    for obj in session.new:
+        if isinstance(obj, Appointment):
+            for key in _appointment_keys(obj.doctor_id, obj.patient_id, obj.status or 'Booked'):
+                deltas[key] += 1
+        elif isinstance(obj, Doctor):
+            deltas[('global', 0, 'doctors')] += 1
+        elif isinstance(obj, Patient):
+            deltas[('global', 0, 'patients')] += 1
+
+    for obj in session.dirty:
+        if not isinstance(obj, Appointment):
+            continue
+        state = inspect(obj)
+        if not any(state.attrs[key].history.has_changes()
+                   for key in _TRACKED):
+            continue
+        old = [_old_value(state, key) for key in _TRACKED]
+        for key in _appointment_keys(*old):
+            deltas[key] -= 1
+        for key in _appointment_keys(obj.doctor_id, obj.patient_id, obj.status):
+            deltas[key] += 1
+
+    for obj in session.deleted:
+        if isinstance(obj, Appointment):
+            state = inspect(obj)
+            old = [_old_value(state, key) for key in _TRACKED]
+            for key in _appointment_keys(*old):
+                deltas[key] -= 1
+        elif isinstance(obj, Doctor):
+            deltas[('global', 0, 'doctors')] -= 1
+        elif isinstance(obj, Patient):
+            deltas[('global', 0, 'patients')] -= 1
+
+    return {key: delta for key, delta in deltas.items() if delta}
+
+
+def apply_deltas(connection, deltas):
+    """Add {(scope, scope_id, name): delta} to the counters on `connection`"""
+    if not deltas:
+        return
+    # Sorted so concurrent transactions lock counter rows in the same order
+    rows = [
+        {'scope': scope, 'scope_id': scope_id, 'name': name, 'value': delta}
+        for (scope, scope_id, name), delta in sorted(deltas.items())
+    ]
+    table = Counter.__table__
+
+    upsert = _UPSERT_DIALECTS.get(connection.dialect.name)
+    if upsert is not None:
+        statement = upsert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=['scope', 'scope_id', 'name'],
+            set_={'value': table.c.value + statement.excluded.value}
+        )
+        connection.execute(statement, rows)
+        return
+
+    for row in rows:
+        result = connection.execute(
+            update(table)
+            .where(table.c.scope == row['scope'], table.c.scope_id == row['scope_id'],
+                   table.c.name == row['name'])
+            .values(value=table.c.value + row['value'])
+        )
+        if result.rowcount == 0:
+            connection.execute(table.insert().values(**row))
+
+
+def snapshot(scope='global', scope_id=0):
+    """All counters of one scope as a dict that defaults to 0"""
+    rows = db.session.execute(
+        select(Counter.name, Counter.value)
+        .where(Counter.scope == scope, Counter.scope_id == scope_id)
+    )
+    values = defaultdict(int)
+    values.update({name: value for name, value in rows})
+    return values
+
+
+def rebuild(connection):
+    """Recompute every counter from the source tables"""
+    deltas = Deltas()
+    deltas[('global', 0, 'doctors')] = connection.execute(
+        select(func.count()).select_from(Doctor.__table__)).scalar()
+    deltas[('global', 0, 'patients')] = connection.execute(
+        select(func.count()).select_from(Patient.__table__)).scalar()
+
+    # Archived appointments still count (app/archive.py)
+    for appointments in (Appointment.__table__, ArchivedAppointment.__table__):
+        grouped = connection.execute(
+            select(appointments.c.doctor_id, appointments.c.patient_id,
+                   func.coalesce(appointments.c.status, 'Booked'), func.count())
+            .group_by(appointments.c.doctor_id, appointments.c.patient_id, appointments.c.status)
+        )
+        for doctor_id, patient_id, status, count in grouped:
+            for key in _appointment_keys(doctor_id, patient_id, status):
+                deltas[key] += count
+
+    connection.execute(Counter.__table__.delete())
+    if deltas:
+        connection.execute(Counter.__table__.insert(), [
+            {'scope': scope, 'scope_id': scope_id, 'name': name, 'value': value}
+            for (scope, scope_id, name), value in sorted(deltas.items())
+        ])
+    return len(deltas)
+
+
+def _update_after_flush(session, flush_context):
+    deltas = _collect_deltas(session)
+    if deltas:
+        apply_deltas(session.connection(), deltas)
+
+
+def init_app(app):
+    """Apply counter deltas in the same transaction as every flush"""
+    if not event.contains(Session, 'after_flush', _update_after_flush):
+        event.listen(Session, 'after_flush', _update_after_flush)
+    # Load the previous value on assignment even when the instance was expired
+    # by a commit, so the delta can be taken off the right counters
+    keep_previous(Appointment, _TRACKED)
@@ -0,0 +1,95 @@
+"""Per-backend database engine tuning.
+
+`configure(app)` runs before Flask-SQLAlchemy creates its engines and turns
+the DATABASE_*/SQLITE_* settings of the config class into
+SQLALCHEMY_ENGINE_OPTIONS for the backend each URI points at:
+
+    sqlite        connect-time PRAGMAs: WAL journal (readers and the writer
+                  stop blocking each other), busy_timeout (a writer waits
+                  for the lock instead of failing with "database is
+                  locked"), synchronous=NORMAL and a larger page cache
+    postgresql,   pool size and overflow, a checkout timeout, recycling
+    mysql         before server/proxy idle timeouts and a pre-ping so a
+                  dropped connection is replaced instead of failing a
+                  request
+
+Options set explicitly in SQLALCHEMY_ENGINE_OPTIONS, or in a dict entry of
+SQLALCHEMY_BINDS, win over the profile. DATABASE_TUNING = False leaves the
+SQLAlchemy and driver defaults (benchmarks/engine_throughput.py compares).
+"""
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from app import db
+
+_POOLED_BACKENDS = ('postgresql', 'mysql', 'mariadb')
+
+
+def _backend(uri):
+    return make_url(uri).get_backend_name()
+
+
+def pragmas(config, uri):
+    """[(name, value), ...] to run on every new SQLite connection to `uri`"""
+    if not config.get('DATABASE_TUNING', True) or _backend(uri) != 'sqlite':
+        return []
+    database = make_url(uri).database
+    in_memory = not database or database == ':memory:' or database.startswith('file::memory:')
+    values = [
+        # An in-memory database has no journal file to switch
+        ('journal_mode', None if in_memory else config.get('SQLITE_JOURNAL_MODE')),
+        ('busy_timeout', config.get('SQLITE_BUSY_TIMEOUT')),
+        ('synchronous', config.get('SQLITE_SYNCHRONOUS')),
+        ('cache_size', config.get('SQLITE_CACHE_SIZE')),
+    ]
+    return [(name, value) for name, value in values if value is not None]
+
+
+def engine_options(config, uri):
+    """Engine options of the tuning profile for `uri`"""
+    if not config.get('DATABASE_TUNING', True) or _backend(uri) not in _POOLED_BACKENDS:
+        return {}
+    options = {
+        'pool_size': config.get('DATABASE_POOL_SIZE'),
+        'max_overflow': config.get('DATABASE_MAX_OVERFLOW'),
+        'pool_timeout': config.get('DATABASE_POOL_TIMEOUT'),
+        'pool_recycle': config.get('DATABASE_POOL_RECYCLE'),
+        'pool_pre_ping': config.get('DATABASE_POOL_PRE_PING'),
+    }
+    return {name: value for name, value in options.items() if value is not None}
+
+
+def configure(app):
+    """Fill in SQLALCHEMY_ENGINE_OPTIONS and bind options; call before db.init_app"""
+    config = app.config
+    explicit = config.get('SQLALCHEMY_ENGINE_OPTIONS') or {}
+    uri = config.get('SQLALCHEMY_DATABASE_URI')
+    if uri:
+        config['SQLALCHEMY_ENGINE_OPTIONS'] = {**engine_options(config, uri), **explicit}
+
+    binds = {}
+    for key, bind in (config.get('SQLALCHEMY_BINDS') or {}).items():
+        bind = dict(bind) if isinstance(bind, dict) else {'url': bind}
+        binds[key] = {**engine_options(config, bind['url']), **explicit, **bind}
+    if binds:
+        config['SQLALCHEMY_BINDS'] = binds
+
+
+def _pragma_listener(settings):
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in settings:
+                cursor.execute(f'PRAGMA {name} = {value}')
+        finally:
+            cursor.close()
+    return set_pragmas
+
+
+def init_app(app):
+    """Run the SQLite PRAGMAs on every new connection of the app's engines"""
+    with app.app_context():
+        engines = dict(db.engines)
+    for engine in engines.values():
+        settings = pragmas(app.config, engine.url)
+        if settings:
+            event.listen(engine, 'connect', _pragma_listener(settings))
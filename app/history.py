@@ -0,0 +1,22 @@
+"""Previous column values for the flush hooks.
+
+The dashboard counters and the slot events compare an attribute's new value
+with the one it replaces. After a commit expires an instance, assigning to
+an attribute does not load the old value, so the flush would see no
+previous value. `keep_previous()` registers one shared no-op 'set'
+listener with active_history=True on the given columns. It is registered
+once per column however many subsystems ask for it.
+"""
+from sqlalchemy import event
+
+
+def _keep_history(target, value, oldvalue, initiator):
+    pass
+
+
+def keep_previous(model, attributes):
+    """Load the old value of `model.<attribute>` before every assignment"""
+    for attribute in attributes:
+        column = getattr(model, attribute)
+        if not event.contains(column, 'set', _keep_history):
+            event.listen(column, 'set', _keep_history, active_history=True)
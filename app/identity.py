@@ -0,0 +1,125 @@
+"""The logged-in user and their role profile, resolved once per request.
+
+Flask-Login calls `load_user` once per request (it keeps the result for
+the rest of the request). It loads the user together with their admin,
+doctor or patient profile in one query, so `current_profile()` and
+`current_user.doctor` / `.patient` cost nothing afterwards.
+
+With IDENTITY_CACHE_TTL > 0 the user and profile are also kept in process
+as plain column snapshots. A cached identity is rebuilt as ORM objects and
+attached to the request's session without any SQL, so the profile can be
+updated and committed as usual. Commits that touch users or profiles clear
+the cache. Other worker processes may keep serving the old snapshot for up
+to IDENTITY_CACHE_TTL seconds, so keep the TTL short.
+"""
+from flask import current_app, g
+from flask_login import current_user
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session, joinedload, make_transient_to_detached
+from app import db, login_manager
+from app.cache import VersionedCache
+from app.models import Admin, Doctor, Patient, User
+
+PROFILES = {'admin': Admin, 'doctor': Doctor, 'patient': Patient}
+_IDENTITY_MODELS = (User,) + tuple(PROFILES.values())
+
+cache = VersionedCache('identity', ttl=0)
+
+
+def _key(user_id):
+    return (current_app.config['SQLALCHEMY_DATABASE_URI'], user_id)
+
+
+def _columns(obj):
+    if obj is None:
+        return None
+    return {attr.key: getattr(obj, attr.key) for attr in inspect(obj).mapper.column_attrs}
+
+
+def _query(user_id):
+    return db.session.scalars(
+        select(User).where(User.id == user_id)
+        .options(*(joinedload(getattr(User, role)) for role in PROFILES))
+    ).first()
+
+
+def _snapshot(user_id):
+    user = _query(user_id)
+    if user is None:
+        return None
+    return _columns(user), user.role, _columns(getattr(user, user.role, None))
+
+
+def _attach(snapshot):
+    """Rebuild a cached identity as persistent objects without querying"""
+    user_columns, role, profile_columns = snapshot
+    session = db.session()
+    existing = session.identity_map.get(session.identity_key(User, user_columns['id']))
+    if existing is not None:
+        return existing
+    user = User(**user_columns)
+    for name, model in PROFILES.items():
+        profile = model(**profile_columns) if name == role and profile_columns else None
+        setattr(user, name, profile)
+        if profile is not None:
+            make_transient_to_detached(profile)
+    make_transient_to_detached(user)
+    session.add(user)
+    return user
+
+
+def load_user(user_id):
+    """Flask-Login user loader: the user with their profile, in one query"""
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+    if cache.ttl <= 0:
+        return _query(user_id)
+    snapshot = cache.get(_key(user_id), lambda: _snapshot(user_id))
+    return _attach(snapshot) if snapshot is not None else None
+
+
+def current_profile():
+    """The Admin, Doctor or Patient row of the logged-in user, or None"""
+    if 'identity_profile' not in g:
+        profile = None
+        if current_user.is_authenticated and current_user.role in PROFILES:
+            profile = getattr(current_user, current_user.role)
+        g.identity_profile = profile
+    return g.identity_profile
+
+
+def invalidate():
+    """Forget every cached identity; call after changing users or profiles"""
+    cache.invalidate()
+
+
+def _note_changes(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, _IDENTITY_MODELS):
+            session.info['identity_changed'] = True
+            return
+
+
+def _invalidate_after_commit(session):
+    # After commit, not flush: a load in between would cache the old rows
+    if session.info.pop('identity_changed', False):
+        cache.invalidate()
+
+
+def _forget_after_rollback(session, previous_transaction):
+    if not previous_transaction.nested:
+        session.info.pop('identity_changed', None)
+
+
+def init_app(app):
+    """Register the user loader and keep the identity cache in sync with commits"""
+    cache.configure(ttl=app.config.get('IDENTITY_CACHE_TTL', 0),
+                    max_entries=app.config.get('IDENTITY_CACHE_MAX_ENTRIES', 10000))
+    login_manager.user_loader(load_user)
+    for name, listener in (('after_flush', _note_changes),
+                           ('after_commit', _invalidate_after_commit),
+                           ('after_soft_rollback', _forget_after_rollback)):
+        if not event.contains(Session, name, listener):
+            event.listen(Session, name, listener)
@@ -0,0 +1,467 @@
+"""Request metrics in the Prometheus text format at /metrics.
+
+Every request is recorded under its endpoint and method. The following
+are kept:
+
+    http_requests_total                    by status code
+    http_request_duration_seconds          histogram, until the response is
+                                           handed to the server (streamed
+                                           bodies are not included)
+    http_response_size_bytes               histogram (streamed bodies count 0)
+    http_request_sql_statements            histogram of statements per request
+    http_request_sql_seconds_total         time spent executing them
+    http_request_template_seconds_total    time in render_template, including
+                                           the lazy loads it triggers
+
+Also exported: the password hashing pool, the in-process caches, live slot
+streams and the read replica, as seen by this process.
+
+Recording takes a few dict updates under a lock per request. Each series
+lives in a fixed set of counters, so memory does not grow with traffic.
+Unmatched URLs share one endpoint label.
+
+With several worker processes, set METRICS_DIR to a directory they share.
+Every process then writes its totals there every METRICS_WRITE_INTERVAL
+seconds from a background thread, and /metrics adds them up. Otherwise a
+scrape only sees the process that answered it. When a process ends (at
+exit, or gunicorn's child_exit hook for a killed worker) its counters are
+folded into metrics-dead.json and its file is removed, so totals never go
+backwards. Gauges of a file not rewritten for STALE_INTERVALS intervals
+are ignored.
+
+/metrics answers to admins, to a `Bearer METRICS_TOKEN` Authorization
+header, and to the addresses in METRICS_ALLOWED_ADDRESSES.
+"""
+import atexit
+import hmac
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from flask import before_render_template, current_app, g, request, template_rendered
+from flask_login import current_user
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app import passwords, query_budget, reference_data
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+STATEMENT_BUCKETS = (0, 1, 2, 5, 10, 20, 30, 50, 100)
+UNMATCHED = '<unmatched>'
+DEAD_PROCESSES = 'dead'  # metrics-dead.json: counters of finished processes
+STALE_INTERVALS = 3  # a snapshot older than this many write intervals has no live gauges
+
+try:
+    import fcntl
+except ImportError:  # Windows: folds of exiting workers are not serialized
+    fcntl = None
+
+_writer_lock = threading.Lock()  # starting the writer thread
+_write_lock = threading.Lock()  # periodic writes against the final one at exit
+
+# name: (type, help); also the order of the exposition
+FAMILIES = {
+    'http_requests_total': ('counter', 'Requests by endpoint, method and status'),
+    'http_request_duration_seconds': ('histogram', 'Time until the response is returned'),
+    'http_response_size_bytes': ('histogram', 'Response body size (0 when streamed)'),
+    'http_request_sql_statements': ('histogram', 'SQL statements issued per request'),
+    'http_request_sql_seconds_total': ('counter', 'Time spent executing SQL statements'),
+    'http_request_template_seconds_total': ('counter', 'Time spent rendering templates'),
+    'password_hash_operations_total': ('counter', 'Password hashes and verifications'),
+    'password_hash_rejected_total': ('counter', 'Hashing calls refused with a 503'),
+    'password_hash_in_progress': ('gauge', 'Hashing calls running or waiting'),
+    'password_hash_queue_depth': ('gauge', 'Hashing calls waiting for a free thread'),
+    'password_hash_duration_seconds': ('histogram', 'Time a hashing call spent in the pool'),
+    'cache_lookups_total': ('counter', 'In-process cache lookups by result'),
+    'cache_entries': ('gauge', 'In-process cache entries'),
+    'slot_event_subscribers': ('gauge', 'Open live slot streams'),
+    'slot_events_published_total': ('counter', 'Slot events delivered to this process'),
+    'replica_reads_total': ('counter', 'ORM reads answered by the read replica'),
+    'replica_fallbacks_total': ('counter', 'Replica reads retried on the primary'),
+    'replica_available': ('gauge', 'Processes currently reading from the replica'),
+}
+
+
+def _bucket_samples(family, labels, bounds, counts, total):
+    samples, cumulative = [], 0
+    for bound, count in zip(bounds + (float('inf'),), counts):
+        cumulative += count
+        le = '+Inf' if bound == float('inf') else repr(bound)
+        samples.append((family, '_bucket', labels + (('le', le),), cumulative))
+    samples.append((family, '_sum', labels, total))
+    samples.append((family, '_count', labels, cumulative))
+    return samples
+
+
+class _Series:
+    __slots__ = ('statuses', 'latency', 'latency_sum', 'size', 'size_sum',
+                 'statements', 'statements_sum', 'sql_seconds', 'template_seconds')
+
+    def __init__(self):
+        self.statuses = {}
+        self.latency = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+        self.size = [0] * (len(SIZE_BUCKETS) + 1)
+        self.size_sum = 0
+        self.statements = [0] * (len(STATEMENT_BUCKETS) + 1)
+        self.statements_sum = 0
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+
+
+class RequestMetrics:
+    """Per endpoint/method counters of this process"""
+
+    def __init__(self):
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint, method, status, duration, size, statements, sql_seconds,
+                template_seconds):
+        with self._lock:
+            series = self._series.get((endpoint, method))
+            if series is None:
+                series = self._series[(endpoint, method)] = _Series()
+            series.statuses[status] = series.statuses.get(status, 0) + 1
+            series.latency[bisect_left(LATENCY_BUCKETS, duration)] += 1
+            series.latency_sum += duration
+            series.size[bisect_left(SIZE_BUCKETS, size)] += 1
+            series.size_sum += size
+            series.statements[bisect_left(STATEMENT_BUCKETS, statements)] += 1
+            series.statements_sum += statements
+            series.sql_seconds += sql_seconds
+            series.template_seconds += template_seconds
+
+    def samples(self):
+        """[(family, suffix, labels, value), ...]"""
+        samples = []
+        with self._lock:
+            for (endpoint, method), series in sorted(self._series.items()):
+                labels = (('endpoint', endpoint), ('method', method))
+                for status, count in sorted(series.statuses.items()):
+                    samples.append(('http_requests_total', '', labels + (('status', str(status)),),
+                                    count))
+                samples += _bucket_samples('http_request_duration_seconds', labels,
+                                           LATENCY_BUCKETS, series.latency, series.latency_sum)
+                samples += _bucket_samples('http_response_size_bytes', labels,
+                                           SIZE_BUCKETS, series.size, series.size_sum)
+                samples += _bucket_samples('http_request_sql_statements', labels,
+                                           STATEMENT_BUCKETS, series.statements, series.statements_sum)
+                samples.append(('http_request_sql_seconds_total', '', labels, series.sql_seconds))
+                samples.append(('http_request_template_seconds_total', '', labels,
+                                series.template_seconds))
+        return samples
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+
+request_metrics = RequestMetrics()
+
+
+def _process_samples(app):
+    """Samples of the other subsystems of this process; all of them add up across processes"""
+    samples = []
+    pool = passwords.stats()
+    for kind, key in (('hash', 'hashes'), ('verify', 'verifications')):
+        samples.append(('password_hash_operations_total', '', (('kind', kind),), pool[key]))
+    for reason in ('rejected', 'timeouts'):
+        samples.append(('password_hash_rejected_total', '', (('reason', reason),), pool[reason]))
+    samples.append(('password_hash_in_progress', '', (), pool['in_progress']))
+    samples.append(('password_hash_queue_depth', '', (), pool['queue_depth']))
+    buckets = pool['latency_buckets']
+    for bound, cumulative in buckets.items():
+        le = '+Inf' if bound == float('inf') else repr(bound)
+        samples.append(('password_hash_duration_seconds', '_bucket', (('le', le),), cumulative))
+    samples.append(('password_hash_duration_seconds', '_sum', (), pool['latency_seconds_sum']))
+    samples.append(('password_hash_duration_seconds', '_count', (), buckets[float('inf')]))
+
+    from app import identity
+    for cache_stats in (reference_data.stats(), identity.cache.stats()):
+        labels = (('cache', cache_stats['name']),)
+        for result, key in (('hit', 'hits'), ('miss', 'misses')):
+            samples.append(('cache_lookups_total', '', labels + (('result', result),), cache_stats[key]))
+        samples.append(('cache_entries', '', labels, cache_stats['entries']))
+
+    broker = app.extensions.get('slot_events')
+    if broker is not None:
+        broker_stats = broker.stats()
+        samples.append(('slot_event_subscribers', '', (), broker_stats['subscribers']))
+        samples.append(('slot_events_published_total', '', (), broker_stats['published']))
+
+    health = app.extensions.get('replica')
+    if health is not None:
+        replica_stats = health.stats()
+        samples.append(('replica_reads_total', '', (), replica_stats['reads']))
+        samples.append(('replica_fallbacks_total', '', (), replica_stats['fallbacks']))
+        samples.append(('replica_available', '', (), int(replica_stats['available'])))
+    return samples
+
+
+def snapshot(app):
+    return request_metrics.samples() + _process_samples(app)
+
+
+def _snapshot_path(directory, pid):
+    return os.path.join(directory, f'metrics-{pid}.json')
+
+
+def _dump(path, samples):
+    temporary = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temporary, 'w') as f:
+        json.dump([[family, suffix, list(map(list, labels)), value]
+                   for family, suffix, labels, value in samples], f)
+    os.replace(temporary, path)
+
+
+def _load(path):
+    with open(path) as f:
+        return [(family, suffix, tuple(map(tuple, labels)), value)
+                for family, suffix, labels, value in json.load(f)]
+
+
+def _is_gauge(family):
+    return FAMILIES.get(family, ('counter',))[0] == 'gauge'
+
+
+def write_snapshot(app):
+    """Store this process's totals in METRICS_DIR for the other workers to add up"""
+    directory = app.config.get('METRICS_DIR')
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    pid = os.getpid()
+    if app.extensions.get('metrics_snapshot_pid') != pid:
+        # A file under our pid is a dead process's that nobody folded; keep its counts
+        mark_process_dead(directory, pid)
+        app.extensions['metrics_snapshot_pid'] = pid
+    _dump(_snapshot_path(directory, pid), snapshot(app))
+
+
+def mark_process_dead(directory, pid):
+    """Fold the counters of a finished process into the dead-process totals and drop its file.
+
+    Called by the process itself at exit, by gunicorn's child_exit hook
+    (gunicorn.conf.py) for workers that could not, and before a process
+    first writes under a reused pid. Gauges are dropped with the file.
+    """
+    path = _snapshot_path(directory, pid)
+    if not os.path.exists(path):
+        return
+    with _aggregate_lock(directory):
+        try:
+            rows = _load(path)
+        except FileNotFoundError:
+            return  # folded by someone else meanwhile
+        except ValueError:
+            rows = []
+        aggregate = _snapshot_path(directory, DEAD_PROCESSES)
+        totals = {}
+        if os.path.exists(aggregate):
+            for family, suffix, labels, value in _load(aggregate):
+                totals[(family, suffix, labels)] = value
+        for family, suffix, labels, value in rows:
+            if not _is_gauge(family):
+                totals[(family, suffix, labels)] = totals.get((family, suffix, labels), 0) + value
+        _dump(aggregate, [key + (value,) for key, value in totals.items()])
+        os.remove(path)
+
+
+@contextmanager
+def _aggregate_lock(directory):
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(directory, 'metrics.lock'), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _read_snapshots(directory, stale_after):
+    own = os.path.basename(_snapshot_path(directory, os.getpid()))
+    now = time.time()
+    for name in sorted(os.listdir(directory)):
+        if not (name.startswith('metrics-') and name.endswith('.json')) or name == own:
+            continue
+        path = os.path.join(directory, name)
+        try:
+            fresh = now - os.path.getmtime(path) <= stale_after
+            rows = _load(path)
+        except (OSError, ValueError):
+            continue  # being replaced or folded right now
+        # A worker that stopped writing is gone (or hung): its counts stay, its gauges don't
+        yield [row for row in rows if fresh or not _is_gauge(row[0])]
+
+
+def collect(app):
+    """This process's samples plus those of the other workers, added up"""
+    totals = {}
+    sources = [snapshot(app)]
+    directory = app.config.get('METRICS_DIR')
+    if directory and os.path.isdir(directory):
+        stale_after = STALE_INTERVALS * app.config.get('METRICS_WRITE_INTERVAL', 5)
+        sources.extend(_read_snapshots(directory, stale_after))
+    for samples in sources:
+        for family, suffix, labels, value in samples:
+            key = (family, suffix, labels)
+            totals[key] = totals.get(key, 0) + value
+    return totals
+
+
+def _write_periodically(app, interval):
+    while True:
+        time.sleep(interval)
+        with _write_lock:
+            if app.extensions.get('metrics_closed') == os.getpid():
+                return
+            try:
+                write_snapshot(app)
+            except OSError:
+                continue  # the shared directory may be briefly unavailable
+
+
+def _ensure_writer(app):
+    # Threads don't survive a fork: every worker process starts its own
+    writer = app.extensions.get('metrics_writer')
+    if writer is not None and writer.is_alive() and writer.pid == os.getpid():
+        return
+    with _writer_lock:
+        writer = app.extensions.get('metrics_writer')
+        if writer is not None and writer.is_alive() and writer.pid == os.getpid():
+            return
+        write_snapshot(app)
+        writer = threading.Thread(target=_write_periodically,
+                                  args=(app, app.config.get('METRICS_WRITE_INTERVAL', 5)),
+                                  name='metrics-writer', daemon=True)
+        writer.pid = os.getpid()
+        writer.start()
+        app.extensions['metrics_writer'] = writer
+        atexit.register(_write_final, app)
+
+
+def _write_final(app):
+    """At exit: last totals, folded into the dead-process totals"""
+    if app.extensions['metrics_writer'].pid != os.getpid():
+        return
+    with _write_lock:
+        # The writer thread must not bring the file back once it is folded
+        app.extensions['metrics_closed'] = os.getpid()
+        try:
+            write_snapshot(app)
+            mark_process_dead(app.config['METRICS_DIR'], os.getpid())
+        except OSError:
+            pass  # child_exit in the gunicorn master folds it instead
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(value)
+
+
+def render(totals):
+    """Prometheus text exposition format (version 0.0.4)"""
+    by_family = {}
+    for (family, suffix, labels), value in totals.items():
+        by_family.setdefault(family, []).append((suffix, labels, value))
+    lines = []
+    for family, (kind, description) in FAMILIES.items():
+        samples = by_family.get(family)
+        if not samples:
+            continue
+        lines.append(f'# HELP {family} {description}')
+        lines.append(f'# TYPE {family} {kind}')
+        for suffix, labels, value in samples:
+            label_text = ','.join(f'{name}="{_escape(label)}"' for name, label in labels)
+            label_text = f'{{{label_text}}}' if label_text else ''
+            lines.append(f'{family}{suffix}{label_text} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def _allowed():
+    token = current_app.config.get('METRICS_TOKEN')
+    if token:
+        supplied = request.headers.get('Authorization', '')
+        if hmac.compare_digest(supplied.encode(), f'Bearer {token}'.encode()):
+            return True
+    if request.remote_addr in current_app.config.get('METRICS_ALLOWED_ADDRESSES', ()):
+        return True
+    return current_user.is_authenticated and current_user.role == 'admin'
+
+
+def metrics_view():
+    if not _allowed():
+        return {'error': 'Forbidden'}, 403
+    body = render(collect(current_app._get_current_object()))
+    return current_app.response_class(body, content_type='text/plain; version=0.0.4; charset=utf-8',
+                                      headers={'Cache-Control': 'no-store'})
+
+
+# Request hooks
+
+def _start_request():
+    g.metrics_started = time.perf_counter()
+    g.metrics_sql_seconds = 0.0
+    g.metrics_template_seconds = 0.0
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info['metrics_statement_started'] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop('metrics_statement_started', None)
+    if started is not None and 'metrics_started' in g:
+        g.metrics_sql_seconds += time.perf_counter() - started
+
+
+def _before_render(sender, template, context, **extra):
+    g.metrics_template_started = time.perf_counter()
+
+
+def _rendered(sender, template, context, **extra):
+    started = g.pop('metrics_template_started', None)
+    if started is not None and 'metrics_started' in g:
+        g.metrics_template_seconds += time.perf_counter() - started
+
+
+def _record(response):
+    started = g.pop('metrics_started', None)
+    if started is None:
+        return response
+    request_metrics.observe(
+        request.endpoint or UNMATCHED, request.method, response.status_code,
+        time.perf_counter() - started,
+        0 if response.is_streamed else (response.content_length or 0),
+        query_budget.statement_count(), g.metrics_sql_seconds, g.metrics_template_seconds,
+    )
+    app = current_app._get_current_object()
+    if app.config.get('METRICS_DIR'):
+        _ensure_writer(app)
+    return response
+
+
+def init_app(app):
+    """Record every request and serve the totals at /metrics"""
+    if not app.config.get('METRICS_ENABLED', True):
+        return
+    # Engine-level, so the replica bind is timed too
+    for name, listener in (('before_cursor_execute', _before_cursor_execute),
+                           ('after_cursor_execute', _after_cursor_execute)):
+        if not event.contains(Engine, name, listener):
+            event.listen(Engine, name, listener)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_rendered, app)
+    app.before_request(_start_request)
+    app.after_request(_record)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
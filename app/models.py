@@ -1,12 +1,8 @@
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
-from app import db, login_manager
+from app import db, passwords
 
-# User loader for Flask-Login
-@login_manager.user_loader
-def load_user(user_id):
-    return User.query.get(int(user_id))
+# The Flask-Login user loader lives in app/identity.py
 
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
@@ -22,13 +18,17 @@ class User(UserMixin, db.Model):
     patient = db.relationship('Patient', backref='user', uselist=False, cascade='all, delete-orphan')
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = passwords.hash_password(password)
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        """Verify `password`, re-hashing it if the hashing parameters changed"""
+        return passwords.check_and_upgrade(self, password)
 
 class Admin(db.Model):
     __tablename__ = 'admins'
+    __table_args__ = (
+        db.Index('ix_admins_user_id', 'user_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     name = db.Column(db.String(100), nullable=False)
@@ -44,6 +44,14 @@ class Specialization(db.Model):
 
 class Doctor(db.Model):
     __tablename__ = 'doctors'
+    __table_args__ = (
+        # Profile lookup for the logged-in doctor
+        db.Index('ix_doctors_user_id', 'user_id'),
+        # Directory by specialization, ordered by name
+        db.Index('ix_doctors_specialization_name', 'specialization_id', 'name'),
+        # Admin list keyset order
+        db.Index('ix_doctors_name_id', 'name', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     name = db.Column(db.String(100), nullable=False)
@@ -58,6 +66,12 @@ class Doctor(db.Model):
 
 class Patient(db.Model):
     __tablename__ = 'patients'
+    __table_args__ = (
+        # Profile lookup for the logged-in patient
+        db.Index('ix_patients_user_id', 'user_id'),
+        # Admin/doctor list keyset order
+        db.Index('ix_patients_name_id', 'name', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     name = db.Column(db.String(100), nullable=False)
@@ -70,15 +84,83 @@ class Patient(db.Model):
 
 class Availability(db.Model):
     __tablename__ = 'availability'
+    __table_args__ = (
+        # A doctor's windows for a date range, in display order
+        db.Index('ix_availability_doctor_date', 'doctor_id', 'date', 'start_time'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     doctor_id = db.Column(db.Integer, db.ForeignKey('doctors.id'), nullable=False)
     date = db.Column(db.Date, nullable=False)  # Date-based for next 7 days
     start_time = db.Column(db.Time, nullable=False)
     end_time = db.Column(db.Time, nullable=False)
     is_available = db.Column(db.Boolean, default=True)
+    slot_minutes = db.Column(db.Integer, nullable=True)  # None: APPOINTMENT_SLOT_MINUTES
+    template_id = db.Column(db.Integer, db.ForeignKey('availability_templates.id'), nullable=True)
+
+class AvailabilityTemplate(db.Model):
+    """Weekly recurring availability, materialized into Availability rows"""
+    __tablename__ = 'availability_templates'
+    __table_args__ = (
+        db.Index('ix_availability_templates_doctor_weekday', 'doctor_id', 'weekday'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctors.id'), nullable=False)
+    weekday = db.Column(db.Integer, nullable=False)  # 0 = Monday ... 6 = Sunday
+    start_time = db.Column(db.Time, nullable=False)
+    end_time = db.Column(db.Time, nullable=False)
+    slot_minutes = db.Column(db.Integer, nullable=True)  # None: APPOINTMENT_SLOT_MINUTES
+    valid_from = db.Column(db.Date, nullable=True)
+    valid_until = db.Column(db.Date, nullable=True)
+    is_active = db.Column(db.Boolean, default=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    doctor = db.relationship('Doctor', backref=db.backref('availability_templates', lazy=True,
+                                                          cascade='all, delete-orphan'))
+
+class AvailabilityException(db.Model):
+    """A day (or part of one) when recurring availability does not apply"""
+    __tablename__ = 'availability_exceptions'
+    __table_args__ = (
+        db.Index('ix_availability_exceptions_doctor_date', 'doctor_id', 'date'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctors.id'), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    start_time = db.Column(db.Time, nullable=True)  # both None: the whole day
+    end_time = db.Column(db.Time, nullable=True)
+    reason = db.Column(db.String(200))
+    
+    doctor = db.relationship('Doctor', backref=db.backref('availability_exceptions', lazy=True,
+                                                          cascade='all, delete-orphan'))
+    cut_windows = db.relationship('ExceptionCutWindow', lazy=True, cascade='all, delete-orphan')
+
+class ExceptionCutWindow(db.Model):
+    """A manual availability window as it was before an exception cut into it"""
+    __tablename__ = 'exception_cut_windows'
+    id = db.Column(db.Integer, primary_key=True)
+    exception_id = db.Column(db.Integer, db.ForeignKey('availability_exceptions.id'), nullable=False, index=True)
+    start_time = db.Column(db.Time, nullable=False)
+    end_time = db.Column(db.Time, nullable=False)
+    is_available = db.Column(db.Boolean, default=True)
+    slot_minutes = db.Column(db.Integer, nullable=True)
 
 class Appointment(db.Model):
     __tablename__ = 'appointments'
+    __table_args__ = (
+        # Slot-conflict checks and the doctor's own appointment list
+        db.Index('ix_appointments_doctor_slot', 'doctor_id', 'appointment_date', 'appointment_time', 'status'),
+        # The patient's appointment list and upcoming appointments
+        db.Index('ix_appointments_patient_date', 'patient_id', 'appointment_date', 'appointment_time'),
+        # Admin list keyset order
+        db.Index('ix_appointments_date_time', 'appointment_date', 'appointment_time'),
+        # At most one active (Booked) appointment per doctor and slot
+        db.Index('uq_appointments_active_slot', 'doctor_id', 'appointment_date', 'appointment_time',
+                 unique=True,
+                 sqlite_where=db.text("status = 'Booked'"),
+                 postgresql_where=db.text("status = 'Booked'")),
+        # Archived ids must never be handed out again
+        {'sqlite_autoincrement': True},
+    )
     id = db.Column(db.Integer, primary_key=True)
     patient_id = db.Column(db.Integer, db.ForeignKey('patients.id'), nullable=False)
     doctor_id = db.Column(db.Integer, db.ForeignKey('doctors.id'), nullable=False)
@@ -92,9 +174,116 @@ class Appointment(db.Model):
 
 class Treatment(db.Model):
     __tablename__ = 'treatments'
+    __table_args__ = (
+        db.Index('ix_treatments_appointment_id', 'appointment_id'),
+        {'sqlite_autoincrement': True},
+    )
     id = db.Column(db.Integer, primary_key=True)
     appointment_id = db.Column(db.Integer, db.ForeignKey('appointments.id'), nullable=False)
     diagnosis = db.Column(db.Text, nullable=False)
     prescription = db.Column(db.Text)
     notes = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class ArchivedAppointment(db.Model):
+    """Closed appointments moved out of `appointments` by app/archive.py (same ids)"""
+    __tablename__ = 'appointments_archive'
+    __table_args__ = (
+        db.Index('ix_appointments_archive_patient_date', 'patient_id', 'appointment_date'),
+        db.Index('ix_appointments_archive_doctor_date', 'doctor_id', 'appointment_date'),
+        # Admin appointment list keyset order
+        db.Index('ix_appointments_archive_date_time', 'appointment_date', 'appointment_time'),
+    )
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    patient_id = db.Column(db.Integer, db.ForeignKey('patients.id'), nullable=False)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctors.id'), nullable=False)
+    appointment_date = db.Column(db.Date, nullable=False)
+    reason = db.Column(db.Text, nullable=True)
+    appointment_time = db.Column(db.Time, nullable=False)
+    status = db.Column(db.String(20), nullable=False)  # 'Completed', 'Cancelled'
+    created_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Read-only, and shaped like Appointment's so the same templates render both
+    patient = db.relationship('Patient', viewonly=True)
+    doctor = db.relationship('Doctor', viewonly=True)
+    treatment = db.relationship('ArchivedTreatment', uselist=False, viewonly=True)
+
+class ArchivedTreatment(db.Model):
+    """Treatments of archived appointments"""
+    __tablename__ = 'treatments_archive'
+    __table_args__ = (
+        db.Index('ix_treatments_archive_appointment_id', 'appointment_id'),
+    )
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    appointment_id = db.Column(db.Integer, db.ForeignKey('appointments_archive.id'), nullable=False)
+    diagnosis = db.Column(db.Text, nullable=False)
+    prescription = db.Column(db.Text)
+    notes = db.Column(db.Text)
+    created_at = db.Column(db.DateTime)
+    
+    appointment = db.relationship('ArchivedAppointment', viewonly=True)
+
+class Counter(db.Model):
+    """Pre-aggregated dashboard counts, maintained by app/counters.py"""
+    __tablename__ = 'counters'
+    scope = db.Column(db.String(20), primary_key=True)  # 'global', 'doctor', 'patient'
+    scope_id = db.Column(db.Integer, primary_key=True, default=0)
+    name = db.Column(db.String(40), primary_key=True)  # 'appointments', 'status:Booked', 'doctors', ...
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+class EntityVersion(db.Model):
+    """Change stamps per doctor/patient for HTTP caching, maintained by app/versions.py"""
+    __tablename__ = 'entity_versions'
+    scope = db.Column(db.String(20), primary_key=True)  # 'doctor', 'patient'
+    scope_id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class SlotEvent(db.Model):
+    """Slot events in flight between worker processes, used by app/slot_events.py"""
+    __tablename__ = 'slot_events'
+    __table_args__ = (
+        db.Index('ix_slot_events_created_at', 'created_at'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    channel = db.Column(db.String(40), nullable=False)  # '<doctor_id>:<date>'
+    type = db.Column(db.String(30), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class NextFreeSlot(db.Model):
+    """First few free slots of every active doctor, maintained by app/next_slots.py"""
+    __tablename__ = 'next_free_slots'
+    __table_args__ = (
+        # Earliest slots across a specialization
+        db.Index('ix_next_free_slots_specialization', 'specialization_id', 'slot_date', 'slot_time'),
+    )
+    doctor_id = db.Column(db.Integer, primary_key=True)
+    slot_date = db.Column(db.Date, primary_key=True)
+    slot_time = db.Column(db.Time, primary_key=True)
+    specialization_id = db.Column(db.Integer, nullable=False)
+
+class DoctorPatient(db.Model):
+    """One row per doctor and patient who have appointments, maintained by app/roster.py"""
+    __tablename__ = 'doctor_patients'
+    __table_args__ = (
+        # One per sort order of the doctor's patient list (keyset pagination)
+        db.Index('ix_doctor_patients_name', 'doctor_id', 'patient_name', 'patient_id'),
+        db.Index('ix_doctor_patients_last_visit', 'doctor_id', 'last_visit', 'patient_id'),
+        db.Index('ix_doctor_patients_visit_count', 'doctor_id', 'visit_count', 'patient_id'),
+        db.Index('ix_doctor_patients_next', 'doctor_id', 'next_appointment_date', 'next_appointment_time',
+                 'patient_id'),
+    )
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctors.id'), primary_key=True)
+    patient_id = db.Column(db.Integer, db.ForeignKey('patients.id'), primary_key=True)
+    patient_name = db.Column(db.String(100), nullable=False)  # copy of patients.name, for sorting
+    first_visit = db.Column(db.Date)  # Completed appointments only
+    last_visit = db.Column(db.Date)
+    visit_count = db.Column(db.Integer, nullable=False, default=0)
+    appointment_count = db.Column(db.Integer, nullable=False, default=0)  # any status
+    next_appointment_id = db.Column(db.Integer)  # earliest Booked, today or later
+    next_appointment_date = db.Column(db.Date)
+    next_appointment_time = db.Column(db.Time)
+    
+    patient = db.relationship('Patient', viewonly=True)
@@ -0,0 +1,153 @@
+"""Precomputed earliest free slots per doctor.
+
+The `next_free_slots` table holds the first NEXT_FREE_SLOTS_PER_DOCTOR free
+slots of every active doctor within NEXT_FREE_SLOT_DAYS, tagged with the
+doctor's specialization. "Earliest available in Cardiology" is then one
+index range read on (specialization_id, slot_date, slot_time) instead of a
+walk over every doctor's calendar.
+
+An after_flush hook recomputes the rows of the doctors touched by
+availability, appointment and doctor changes, in the same transaction.
+Rows whose time has passed are refreshed when they are read; doctors whose
+availability only enters the horizon as days go by are picked up by
+`flask refresh-next-slots`, which is meant to run from cron.
+"""
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import and_, delete, event, inspect, or_, select
+from sqlalchemy.orm import Session
+from app import db, slots
+from app.models import Appointment, Availability, Doctor, NextFreeSlot
+
+
+def _settings():
+    config = current_app.config
+    return (config.get('NEXT_FREE_SLOTS_PER_DOCTOR', 5),
+            config.get('NEXT_FREE_SLOT_DAYS', 30))
+
+
+def refresh(connection, doctor_ids, now=None):
+    """Recompute the stored slots of `doctor_ids` on `connection`"""
+    doctor_ids = sorted(set(doctor_ids))
+    if not doctor_ids:
+        return 0
+    per_doctor, days = _settings()
+    now = now or datetime.now()
+    table = NextFreeSlot.__table__
+
+    doctors = {
+        doctor_id: specialization_id
+        for doctor_id, specialization_id in connection.execute(
+            select(Doctor.id, Doctor.specialization_id)
+            .where(Doctor.id.in_(doctor_ids), Doctor.is_active.isnot(False))
+        )
+    }
+    free = slots.free_slots(doctors, now.date(), now.date() + timedelta(days=days - 1),
+                            now=now, connection=connection)
+
+    rows = []
+    for doctor_id, by_day in free.items():
+        upcoming = [(day, slot_time) for day in sorted(by_day) for slot_time in by_day[day]]
+        rows.extend(
+            {'doctor_id': doctor_id, 'slot_date': day, 'slot_time': slot_time,
+             'specialization_id': doctors[doctor_id]}
+            for day, slot_time in upcoming[:per_doctor]
+        )
+
+    connection.execute(delete(table).where(table.c.doctor_id.in_(doctor_ids)))
+    if rows:
+        connection.execute(table.insert(), rows)
+    return len(rows)
+
+
+def rebuild(connection):
+    """Recompute the stored slots of every doctor"""
+    connection.execute(delete(NextFreeSlot.__table__))
+    doctor_ids = list(connection.scalars(select(Doctor.id)))
+    return refresh(connection, doctor_ids)
+
+
+def _is_past(now):
+    return or_(NextFreeSlot.slot_date < now.date(),
+               and_(NextFreeSlot.slot_date == now.date(), NextFreeSlot.slot_time <= now.time()))
+
+
+def first_upcoming(doctor_id, now=None):
+    """(date, time) of the doctor's earliest stored free slot not yet started, or None.
+
+    The doctor's free-slot list changes with the clock exactly when this
+    slot starts, so it can stand for "now" in a cache key.
+    """
+    now = now or datetime.now()
+    return db.session.execute(
+        select(NextFreeSlot.slot_date, NextFreeSlot.slot_time)
+        .where(NextFreeSlot.doctor_id == doctor_id, ~_is_past(now))
+        .order_by(NextFreeSlot.slot_date, NextFreeSlot.slot_time)
+        .limit(1)
+    ).first()
+
+
+def max_limit():
+    """The largest `limit` earliest() accepts: NEXT_FREE_SLOTS_PER_DOCTOR"""
+    return _settings()[0]
+
+
+def earliest(specialization_id, limit=None):
+    """The `limit` earliest free (doctor_id, date, time) in a specialization.
+
+    At most NEXT_FREE_SLOTS_PER_DOCTOR slots are stored per doctor; a
+    larger `limit` could miss a doctor's later slots, so it raises
+    ValueError. None asks for that many.
+    """
+    per_doctor = max_limit()
+    if limit is None:
+        limit = per_doctor
+    if not 1 <= limit <= per_doctor:
+        raise ValueError(f'limit must be between 1 and {per_doctor}')
+    now = datetime.now()
+
+    # Doctors with a slot that has started since their rows were computed
+    stale = db.session.scalars(
+        select(NextFreeSlot.doctor_id).distinct()
+        .where(NextFreeSlot.specialization_id == specialization_id, _is_past(now))
+    ).all()
+    if stale:
+        refresh(db.session.connection(), stale, now=now)
+        db.session.commit()
+
+    rows = db.session.execute(
+        select(NextFreeSlot.doctor_id, NextFreeSlot.slot_date, NextFreeSlot.slot_time)
+        .where(NextFreeSlot.specialization_id == specialization_id)
+        .order_by(NextFreeSlot.slot_date, NextFreeSlot.slot_time, NextFreeSlot.doctor_id)
+        .limit(limit)
+    )
+    return rows.all()
+
+
+def _previous(obj, key):
+    history = inspect(obj).attrs[key].history
+    return history.deleted[0] if history.deleted else None
+
+
+def _affected_doctors(session):
+    doctor_ids = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, (Availability, Appointment)):
+            doctor_ids.add(obj.doctor_id)
+            doctor_ids.add(_previous(obj, 'doctor_id'))
+        elif isinstance(obj, Doctor) and obj not in session.new:
+            doctor_ids.add(obj.id)
+    doctor_ids.discard(None)
+    return doctor_ids
+
+
+def _refresh_after_flush(session, flush_context):
+    doctor_ids = _affected_doctors(session)
+    if doctor_ids:
+        refresh(session.connection(), doctor_ids)
+
+
+def init_app(app):
+    """Refresh the stored slots of doctors touched by every flush"""
+    if not event.contains(Session, 'after_flush', _refresh_after_flush):
+        event.listen(Session, 'after_flush', _refresh_after_flush)
@@ -0,0 +1,143 @@
+"""Keyset (cursor) pagination for list views"""
+from datetime import date, time
+from flask import current_app, request, url_for
+from itsdangerous import BadSignature, URLSafeSerializer
+from sqlalchemy import literal, tuple_
+
+
+def _serializer():
+    return URLSafeSerializer(current_app.config['SECRET_KEY'], salt='keyset-page')
+
+
+def _dump_value(value):
+    if isinstance(value, (date, time)):
+        return value.isoformat()
+    return value
+
+
+def _load_value(column, value):
+    python_type = column.type.python_type
+    if python_type in (date, time) and value is not None:
+        return python_type.fromisoformat(value)
+    return value
+
+
+def encode_cursor(columns, item, direction):
+    """Build a signed page token from the sort key of an item"""
+    key = [_dump_value(getattr(item, column.key)) for column in columns]
+    return _serializer().dumps({'k': key, 'd': direction})
+
+
+def decode_cursor(columns, token):
+    """Return (key values, direction) or (None, 'next') for a missing/invalid token"""
+    if not token:
+        return None, 'next'
+    try:
+        payload = _serializer().loads(token)
+        values = [_load_value(column, value) for column, value in zip(columns, payload['k'])]
+    except (BadSignature, KeyError, TypeError, ValueError):
+        return None, 'next'
+    if len(values) != len(columns):
+        return None, 'next'
+    return values, payload.get('d', 'next')
+
+
+class KeysetPage:
+    """One page of rows plus the tokens for the pages around it"""
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None, is_first=True):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.is_first = is_first
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def _url(self, cursor):
+        # Keep the current search/status filters, only swap the cursor
+        args = request.args.to_dict()
+        args.pop('cursor', None)
+        args.update(request.view_args or {})
+        if cursor:
+            args['cursor'] = cursor
+        return url_for(request.endpoint, **args)
+
+    @property
+    def next_url(self):
+        return self._url(self.next_cursor) if self.next_cursor else None
+
+    @property
+    def prev_url(self):
+        return self._url(self.prev_cursor) if self.prev_cursor else None
+
+    @property
+    def first_url(self):
+        return None if self.is_first else self._url(None)
+
+
+def _seek(query, columns, key, reverse):
+    if key is not None:
+        row_key = tuple_(*columns)
+        bound = tuple_(*[literal(value, column.type) for column, value in zip(columns, key)])
+        query = query.filter(row_key < bound if reverse else row_key > bound)
+    return query.order_by(*[column.desc() if reverse else column.asc() for column in columns])
+
+
+def paginate_keyset(query, columns, descending=False, per_page=None, cursor=None):
+    """Return a KeysetPage for a query ordered by `columns`.
+
+    `columns` must end with a unique column (usually the primary key) so that
+    every row has a distinct sort key. Instead of OFFSET the query seeks past
+    the key of the last row shown, so deep pages cost the same as the first.
+    """
+    return paginate_keyset_union([(query, columns)], descending, per_page, cursor)
+
+
+def paginate_keyset_union(sources, descending=False, per_page=None, cursor=None):
+    """KeysetPage over several (query, columns) sources merged into one order.
+
+    Each source's `columns` are the same sort key (same names and types) on
+    its own table, and a key belongs to one source only (e.g. an appointment
+    id lives in either the hot or the archive table). Every source seeks to
+    the cursor and reads one page; the merged page is the first rows of those.
+    """
+    if per_page is None:
+        per_page = current_app.config.get('PAGE_SIZE', 25)
+    columns = sources[0][1]
+    if cursor is None:
+        cursor = request.args.get('cursor')
+
+    key, direction = decode_cursor(columns, cursor)
+    backwards = direction == 'prev'
+
+    # Walking backwards flips both the comparison and the sort order
+    reverse = descending != backwards
+    rows = []
+    for query, source_columns in sources:
+        rows.extend(_seek(query, source_columns, key, reverse).limit(per_page + 1).all())
+    if len(sources) > 1:
+        names = [column.key for column in columns]
+        rows.sort(key=lambda row: tuple(getattr(row, name) for name in names), reverse=reverse)
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    if not rows:
+        return KeysetPage([], is_first=key is None)
+
+    if backwards:
+        has_next, has_prev = True, has_more
+    else:
+        has_next, has_prev = has_more, key is not None
+
+    return KeysetPage(
+        rows,
+        next_cursor=encode_cursor(columns, rows[-1], 'next') if has_next else None,
+        prev_cursor=encode_cursor(columns, rows[0], 'prev') if has_prev else None,
+        is_first=key is None or not has_prev,
+    )
@@ -0,0 +1,207 @@
+"""Password hashing on a small bounded thread pool.
+
+Hashing is deliberately slow. `hash_password()` and `verify_password()`
+run it on at most PASSWORD_HASH_WORKERS threads per process (hashlib's
+scrypt and PBKDF2 release the GIL, so the threads really run in parallel
+with the rest of the app). At most PASSWORD_HASH_QUEUE calls may wait
+behind them; past that, `HashingBusy` is raised immediately and answered
+with a 503 and a Retry-After header. The request thread still waits for
+its hash, so this only bounds a login spike when a process serves several
+requests at once: with gthread workers that have more threads than
+PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE (gunicorn.conf.py checks
+this), logins can hold only that many threads and the rest keep serving
+other routes. Under sync workers the pool never sees more than one call.
+
+PASSWORD_HASH_METHOD is any werkzeug method string ('scrypt:32768:8:1',
+'pbkdf2:sha256:600000', ...) and can differ per environment. Hashes made
+with other parameters still verify; `check_and_upgrade()` re-hashes them
+with the current method on the next successful login.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash
+
+DEFAULT_METHOD = 'scrypt:32768:8:1'
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class HashingBusy(RuntimeError):
+    """The hashing queue is full (or a hash timed out); retry later"""
+
+
+class HashingPool:
+
+    def __init__(self, workers=2, max_queue=16, timeout=10.0):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._executor = None
+        self._pid = None
+        self._slots = None
+        self._lock = threading.Lock()
+        self.pending = self.max_pending = 0
+        self.completed = {'hash': 0, 'verify': 0}
+        self.rejected = self.timeouts = 0
+        self.latency_sum = 0.0
+        self.latency_buckets = [0] * (len(LATENCY_BUCKETS) + 1)  # last bucket: +Inf
+
+    def configure(self, workers=None, max_queue=None, timeout=None):
+        with self._lock:
+            if workers is not None:
+                self.workers = workers
+            if max_queue is not None:
+                self.max_queue = max_queue
+            if timeout is not None:
+                self.timeout = timeout
+            self._shutdown()
+
+    def _shutdown(self):
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=False)
+        self._executor = None
+
+    def _get_executor(self):
+        # Threads don't survive a fork: a forked worker builds its own pool
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                    thread_name_prefix='password-hash')
+                self._slots = threading.BoundedSemaphore(self.workers + self.max_queue)
+                self._pid = os.getpid()
+            return self._executor, self._slots
+
+    def _timed(self, kind, fn, args):
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.completed[kind] += 1
+                self.latency_sum += elapsed
+                self.latency_buckets[bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+
+    def _release(self, slots):
+        with self._lock:
+            self.pending -= 1
+        slots.release()
+
+    def run(self, kind, fn, *args):
+        """Run fn(*args) on the pool and wait for it, or raise HashingBusy"""
+        executor, slots = self._get_executor()
+        if not slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise HashingBusy('Too many password checks in progress')
+        with self._lock:
+            self.pending += 1
+            self.max_pending = max(self.max_pending, self.pending)
+        try:
+            future = executor.submit(self._timed, kind, fn, args)
+        except BaseException:
+            self._release(slots)
+            raise
+        future.add_done_callback(lambda _: self._release(slots))
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            with self._lock:
+                self.timeouts += 1
+            raise HashingBusy('Password hashing timed out') from None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'max_queue': self.max_queue,
+                'queue_depth': max(0, self.pending - self.workers),
+                'in_progress': self.pending,
+                'max_in_progress': self.max_pending,
+                'hashes': self.completed['hash'],
+                'verifications': self.completed['verify'],
+                'rejected': self.rejected,
+                'timeouts': self.timeouts,
+                'latency_seconds_sum': self.latency_sum,
+                'latency_buckets': dict(zip(LATENCY_BUCKETS + (float('inf'),),
+                                            self._cumulative(self.latency_buckets))),
+            }
+
+    @staticmethod
+    def _cumulative(counts):
+        total, result = 0, []
+        for count in counts:
+            total += count
+            result.append(total)
+        return result
+
+
+pool = HashingPool()
+_normalized_methods = {}
+
+
+def method():
+    """The configured werkzeug hashing method"""
+    return current_app.config.get('PASSWORD_HASH_METHOD') or DEFAULT_METHOD
+
+
+def _normalized(hash_method):
+    # 'pbkdf2:sha256' and 'pbkdf2:sha256:600000' produce the same prefix;
+    # let werkzeug fill in its defaults once instead of duplicating them
+    if hash_method not in _normalized_methods:
+        _normalized_methods[hash_method] = generate_password_hash('', hash_method).split('$', 1)[0]
+    return _normalized_methods[hash_method]
+
+
+def hash_password(password):
+    """Hash `password` with the configured method, off the request thread"""
+    return pool.run('hash', generate_password_hash, password, method())
+
+
+def verify_password(password_hash, password):
+    """Whether `password` matches `password_hash`, whatever method made it"""
+    if not password_hash or password is None:
+        return False
+    return pool.run('verify', check_password_hash, password_hash, password)
+
+
+def needs_rehash(password_hash):
+    """Whether `password_hash` was made with other parameters than the current method"""
+    return password_hash.split('$', 1)[0] != _normalized(method())
+
+
+def check_and_upgrade(user, password):
+    """Verify a login; on success re-hash with the current method if needed.
+
+    The caller commits (login does, to record the session anyway).
+    """
+    if not verify_password(user.password_hash, password):
+        return False
+    if needs_rehash(user.password_hash):
+        try:
+            user.password_hash = hash_password(password)
+        except HashingBusy:
+            pass  # the login is valid; upgrade on a quieter login
+    return True
+
+
+def stats():
+    return pool.stats()
+
+
+def _busy(error):
+    return {'error': 'Server busy, please retry shortly'}, 503, {'Retry-After': '1'}
+
+
+def init_app(app):
+    """Size the hashing pool from config and answer HashingBusy with a 503"""
+    pool.configure(
+        workers=app.config.get('PASSWORD_HASH_WORKERS', 2),
+        max_queue=app.config.get('PASSWORD_HASH_QUEUE', 16),
+        timeout=app.config.get('PASSWORD_HASH_TIMEOUT', 10.0),
+    )
+    app.register_error_handler(HashingBusy, _busy)
@@ -0,0 +1,323 @@
+"""On-demand request profiler and slow query log.
+
+An admin switches profiling on at /admin/profiling for a limited time
+(at most PROFILING_MAX_MINUTES). The switch is a small state file in
+PROFILING_DIR (instance/profiles by default), so every worker process
+follows it. While it is on:
+
+- a request is profiled when it carries a valid signed PROFILING_HEADER
+  (the admin page hands one out; it expires after
+  PROFILING_TOKEN_MAX_AGE) or when it is sampled at the chosen rate.
+  cProfile runs from before the view until the response is returned and
+  the stats are written to PROFILING_DIR as `.prof` files (open them with
+  pstats or snakeviz). Only the newest PROFILING_MAX_PROFILES are kept.
+  One profile runs per process at a time: cProfile hooks the whole
+  interpreter (a second profiler raises ValueError on Python 3.12+ and
+  would mix in other threads' calls before that), so a request that
+  arrives while another is being profiled is served unprofiled.
+- every statement slower than PROFILING_SLOW_QUERY_MS is logged with its
+  endpoint and query plan to `slow_queries.jsonl` there (and the app log).
+
+Switched off, the cost per request is an mtime check of the state file
+at most once a second.
+"""
+import cProfile
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+from io import StringIO
+from flask import current_app, g, has_request_context, request
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+STATE_FILE = 'state.json'
+SLOW_QUERY_LOG = 'slow_queries.jsonl'
+SLOW_QUERY_LOG_MAX_BYTES = 5 * 1024 * 1024
+
+Profile = namedtuple('Profile', 'name endpoint method elapsed_ms created_at size')
+_PROFILE_NAME = re.compile(r'^(\d+)-(\d+)-([A-Z]+)-([\w.]+)-(\d+)ms\.prof$')
+
+_state_lock = threading.Lock()
+_state_cache = {'checked': 0.0, 'mtime': None, 'state': {}}
+_profiler_lock = threading.Lock()  # held by the request being profiled
+
+
+def directory(app=None):
+    app = app or current_app
+    return app.config.get('PROFILING_DIR') or os.path.join(app.instance_path, 'profiles')
+
+
+# Switch
+
+def state():
+    """{'enabled', 'sample_rate', 'until', 'by'} as last saved; re-read at most once a second"""
+    now = time.monotonic()
+    with _state_lock:
+        if now - _state_cache['checked'] < 1.0:
+            return _state_cache['state']
+        _state_cache['checked'] = now
+    path = os.path.join(directory(), STATE_FILE)
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        mtime = None
+    with _state_lock:
+        if mtime != _state_cache['mtime']:
+            try:
+                with open(path) as f:
+                    _state_cache['state'] = json.load(f) if mtime is not None else {}
+            except (OSError, ValueError):
+                _state_cache['state'] = {}
+            _state_cache['mtime'] = mtime
+        return _state_cache['state']
+
+
+def active():
+    current = state()
+    return bool(current.get('enabled')) and current.get('until', 0) > time.time()
+
+
+def switch(enabled, sample_rate=0.0, minutes=None, by=None):
+    """Turn profiling on for `minutes` (capped at PROFILING_MAX_MINUTES), or off"""
+    limit = current_app.config.get('PROFILING_MAX_MINUTES', 60)
+    minutes = min(minutes or limit, limit)
+    current = {
+        'enabled': enabled,
+        'sample_rate': max(0.0, min(float(sample_rate or 0), 1.0)),
+        'until': time.time() + minutes * 60 if enabled else 0,
+        'by': by,
+    }
+    folder = directory()
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, STATE_FILE)
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(current, f)
+    os.replace(f'{path}.tmp', path)
+    with _state_lock:
+        _state_cache['checked'] = 0.0
+    return current
+
+
+def _serializer():
+    return URLSafeTimedSerializer(current_app.config['SECRET_KEY'], salt='profiling')
+
+
+def header_token(user_id):
+    """Value for PROFILING_HEADER that profiles the requests carrying it"""
+    return _serializer().dumps({'by': user_id})
+
+
+def _valid_token(token):
+    try:
+        _serializer().loads(token, max_age=current_app.config.get('PROFILING_TOKEN_MAX_AGE', 3600))
+    except BadSignature:
+        return False
+    return True
+
+
+# Profiles
+
+def _start_request():
+    g.profiling_active = active()
+    if not g.profiling_active:
+        return
+    token = request.headers.get(current_app.config.get('PROFILING_HEADER', 'X-Profile'))
+    if token is not None:
+        wanted = _valid_token(token)
+    else:
+        wanted = random.random() < state().get('sample_rate', 0)
+    if wanted and _profiler_lock.acquire(blocking=False):
+        profiler = cProfile.Profile()
+        g.profiler = (profiler, time.perf_counter())
+        try:
+            profiler.enable()
+        except ValueError:  # another tool's profiler is active
+            g.pop('profiler')
+            _profiler_lock.release()
+
+
+def _stop_profiler():
+    started = g.pop('profiler', None)
+    if started is None:
+        return None
+    try:
+        started[0].disable()
+    finally:
+        _profiler_lock.release()
+    return started
+
+
+def _finish_request(response):
+    started = _stop_profiler()
+    if started is None:
+        return response
+    profiler, start = started
+    elapsed_ms = int((time.perf_counter() - start) * 1000)
+    endpoint = re.sub(r'[^\w.]', '_', request.endpoint or 'unmatched')
+    name = f'{int(time.time() * 1000)}-{os.getpid()}-{request.method}-{endpoint}-{elapsed_ms}ms.prof'
+    folder = directory()
+    try:
+        os.makedirs(folder, exist_ok=True)
+        profiler.dump_stats(os.path.join(folder, name))
+        _prune(folder)
+    except OSError:
+        logger.exception('Could not write profile %s', name)
+        return response
+    response.headers['X-Profile-Name'] = name
+    return response
+
+
+def _abandon_request(exc):
+    # the view raised past after_request: drop the profile, free the lock
+    _stop_profiler()
+
+
+def _prune(folder):
+    keep = current_app.config.get('PROFILING_MAX_PROFILES', 200)
+    names = sorted(name for name in os.listdir(folder) if _PROFILE_NAME.match(name))
+    for name in names[:-keep] if keep else names:
+        try:
+            os.remove(os.path.join(folder, name))
+        except OSError:
+            pass
+
+
+def recent_profiles(limit=50):
+    """Newest first"""
+    folder = directory()
+    if not os.path.isdir(folder):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(folder), reverse=True):
+        match = _PROFILE_NAME.match(name)
+        if not match:
+            continue
+        stamp, _, method, endpoint, elapsed_ms = match.groups()
+        try:
+            size = os.path.getsize(os.path.join(folder, name))
+        except OSError:
+            continue
+        profiles.append(Profile(name, endpoint, method, int(elapsed_ms),
+                                datetime.fromtimestamp(int(stamp) / 1000), size))
+        if len(profiles) >= limit:
+            break
+    return profiles
+
+
+def profile_path(name):
+    """Path of a stored profile, or None for anything that isn't one"""
+    if not _PROFILE_NAME.match(name):
+        return None
+    path = os.path.join(directory(), name)
+    return path if os.path.isfile(path) else None
+
+
+def profile_report(name, sort='cumulative', limit=40):
+    """pstats text of a stored profile"""
+    path = profile_path(name)
+    if path is None:
+        return None
+    output = StringIO()
+    stats = pstats.Stats(path, stream=output)
+    stats.strip_dirs().sort_stats(sort).print_stats(limit)
+    return output.getvalue()
+
+
+# Slow queries
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info['profiling_statement_started'] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop('profiling_statement_started', None)
+    if started is None or not has_request_context() or not g.get('profiling_active'):
+        return
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    threshold = current_app.config.get('PROFILING_SLOW_QUERY_MS')
+    if threshold is None or elapsed_ms < threshold:
+        return
+    plan = None if executemany else _explain(conn, statement, parameters)
+    entry = {
+        'at': datetime.now().isoformat(timespec='seconds'),
+        'endpoint': request.endpoint,
+        'path': request.path,
+        'ms': round(elapsed_ms, 1),
+        'statement': statement,
+        'parameters': repr(parameters)[:500],
+        'plan': plan,
+    }
+    logger.warning('Slow query (%.0f ms) in %s: %s\n%s', elapsed_ms, request.endpoint, statement,
+                   '\n'.join(plan or []))
+    _append_slow_query(entry)
+
+
+def _explain(conn, statement, parameters):
+    """Query plan lines of a SELECT, run on the raw DBAPI connection (no events)"""
+    if not statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+        return None
+    prefix = {'sqlite': 'EXPLAIN QUERY PLAN ', 'postgresql': 'EXPLAIN '}.get(conn.dialect.name)
+    if prefix is None:
+        return None
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters)
+        rows = cursor.fetchall()
+    except Exception as e:
+        return [f'EXPLAIN failed: {e}']
+    finally:
+        cursor.close()
+    if conn.dialect.name == 'sqlite':
+        return [row[3] for row in rows]
+    return [row[0] for row in rows]
+
+
+def _append_slow_query(entry):
+    folder = directory()
+    try:
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, SLOW_QUERY_LOG)
+        if os.path.exists(path) and os.path.getsize(path) > SLOW_QUERY_LOG_MAX_BYTES:
+            os.replace(path, f'{path}.1')
+        with open(path, 'a') as f:
+            f.write(json.dumps(entry, default=str) + '\n')
+    except OSError:
+        logger.exception('Could not record slow query')
+
+
+def recent_slow_queries(limit=50):
+    """Newest first"""
+    path = os.path.join(directory(), SLOW_QUERY_LOG)
+    try:
+        with open(path) as f:
+            lines = f.readlines()[-limit:]
+    except OSError:
+        return []
+    entries = []
+    for line in reversed(lines):
+        try:
+            entries.append(json.loads(line))
+        except ValueError:
+            continue
+    return entries
+
+
+def init_app(app):
+    """Profile flagged requests and log slow statements while profiling is switched on"""
+    for name, listener in (('before_cursor_execute', _before_cursor_execute),
+                           ('after_cursor_execute', _after_cursor_execute)):
+        if not event.contains(Engine, name, listener):
+            event.listen(Engine, name, listener)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_abandon_request)
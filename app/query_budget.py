@@ -0,0 +1,61 @@
+"""Request-scoped SQL statement counter with a per-view budget"""
+import logging
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(RuntimeError):
+    """Raised when a view issues more SQL statements than its budget allows"""
+
+
+def query_budget(limit):
+    """Override the configured SQL statement budget for a single view.
+
+    Place it directly above the view function so that the attribute is
+    copied onto the wrappers added by login_required and the role decorators.
+    """
+    def decorator(f):
+        f.query_budget = limit
+        return f
+    return decorator
+
+
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.sql_statement_count = g.get('sql_statement_count', 0) + 1
+
+
+def statement_count():
+    """Number of SQL statements issued so far in the current request"""
+    return g.get('sql_statement_count', 0)
+
+
+def _reset_count():
+    g.sql_statement_count = 0
+
+
+def _check_budget(response):
+    budget = current_app.config.get('SQL_QUERY_BUDGET')
+    view = current_app.view_functions.get(request.endpoint)
+    budget = getattr(view, 'query_budget', budget)
+    if budget is None:
+        return response
+
+    count = statement_count()
+    if count > budget:
+        message = f'{request.endpoint} issued {count} SQL statements (budget {budget})'
+        if current_app.config.get('SQL_QUERY_BUDGET_ACTION') == 'raise':
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+    return response
+
+
+def init_app(app):
+    """Count statements on every engine and check the budget after each request"""
+    if not event.contains(Engine, 'before_cursor_execute', _count_statement):
+        event.listen(Engine, 'before_cursor_execute', _count_statement)
+    app.before_request(_reset_count)
+    app.after_request(_check_budget)
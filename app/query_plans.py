@@ -0,0 +1,166 @@
+"""EXPLAIN checks for the queries that run on every request"""
+import json
+from datetime import date, time, timedelta
+from sqlalchemy import func, select
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+from app import db
+from app.models import (Appointment, ArchivedAppointment, Availability, Doctor, DoctorPatient, NextFreeSlot,
+                        Patient, Treatment)
+
+
+class Explain(Executable, ClauseElement):
+    """EXPLAIN wrapper that keeps the wrapped statement's bind parameters"""
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+def _wrapped(element, compiler, **kw):
+    sql = compiler.process(element.statement, **kw)
+    # Plan rows are not the statement's rows; don't apply its column types to them
+    compiler._result_columns = []
+    return sql
+
+
+@compiles(Explain, 'sqlite')
+def _explain_sqlite(element, compiler, **kw):
+    return 'EXPLAIN QUERY PLAN ' + _wrapped(element, compiler, **kw)
+
+
+@compiles(Explain, 'postgresql')
+def _explain_postgresql(element, compiler, **kw):
+    return 'EXPLAIN (FORMAT JSON) ' + _wrapped(element, compiler, **kw)
+
+
+def hot_queries():
+    """(name, statement) pairs for the hot access paths, with sample parameters"""
+    today = date.today()
+    appointment_order = (
+        Appointment.appointment_date.desc(),
+        Appointment.appointment_time.desc(),
+        Appointment.id.desc(),
+    )
+    archived_order = (
+        ArchivedAppointment.appointment_date.desc(),
+        ArchivedAppointment.appointment_time.desc(),
+        ArchivedAppointment.id.desc(),
+    )
+    return [
+        ('doctor profile by user',
+         select(Doctor).where(Doctor.user_id == 1)),
+        ('patient profile by user',
+         select(Patient).where(Patient.user_id == 1)),
+        ('slot conflict check',
+         select(Appointment.id).where(
+             Appointment.doctor_id == 1,
+             Appointment.appointment_date == today,
+             Appointment.appointment_time == time(9, 0),
+             Appointment.status == 'Booked')),
+        ('doctor availability for the week',
+         select(Availability).where(
+             Availability.doctor_id == 1,
+             Availability.date >= today,
+             Availability.date <= today + timedelta(days=6)
+         ).order_by(Availability.date, Availability.start_time)),
+        ("doctor's appointments for today",
+         select(Appointment).where(
+             Appointment.doctor_id == 1,
+             Appointment.appointment_date == today)),
+        ("doctor's appointment list",
+         select(Appointment).where(Appointment.doctor_id == 1)
+         .order_by(*appointment_order).limit(26)),
+        ("patient's appointment list",
+         select(Appointment).where(Appointment.patient_id == 1)
+         .order_by(*appointment_order).limit(26)),
+        ("patient's upcoming appointments",
+         select(Appointment).where(
+             Appointment.patient_id == 1,
+             Appointment.status == 'Booked',
+             Appointment.appointment_date >= today
+         ).order_by(Appointment.appointment_date, Appointment.appointment_time).limit(5)),
+        ("patient's upcoming appointment count",
+         select(func.count()).select_from(Appointment).where(
+             Appointment.patient_id == 1,
+             Appointment.appointment_date >= today,
+             Appointment.status == 'Booked')),
+        ('patient treatment history',
+         select(Treatment).join(Appointment).where(
+             Appointment.patient_id == 1,
+             Appointment.status == 'Completed')),
+        ('admin appointment list',
+         select(Appointment).order_by(*appointment_order).limit(26)),
+        ("doctor's archived appointment list",
+         select(ArchivedAppointment).where(ArchivedAppointment.doctor_id == 1)
+         .order_by(*archived_order).limit(26)),
+        ("patient's archived appointment list",
+         select(ArchivedAppointment).where(ArchivedAppointment.patient_id == 1)
+         .order_by(*archived_order).limit(26)),
+        ('admin archived appointment list',
+         select(ArchivedAppointment).order_by(*archived_order).limit(26)),
+        ('admin patient list',
+         select(Patient).order_by(Patient.name, Patient.id).limit(26)),
+        ("doctor's patient roster by name",
+         select(DoctorPatient).where(DoctorPatient.doctor_id == 1)
+         .order_by(DoctorPatient.patient_name, DoctorPatient.patient_id).limit(26)),
+        ("doctor's patients by last visit",
+         select(DoctorPatient).where(DoctorPatient.doctor_id == 1, DoctorPatient.last_visit.isnot(None))
+         .order_by(DoctorPatient.last_visit.desc(), DoctorPatient.patient_id.desc()).limit(26)),
+        ("doctor's patients with a booked appointment",
+         select(DoctorPatient).where(DoctorPatient.doctor_id == 1, DoctorPatient.next_appointment_date.isnot(None))
+         .order_by(DoctorPatient.next_appointment_date, DoctorPatient.next_appointment_time,
+                   DoctorPatient.patient_id).limit(26)),
+        ('doctors by specialization',
+         select(Doctor).where(Doctor.specialization_id == 1).order_by(Doctor.name)),
+        ('earliest free slots in a specialization',
+         select(NextFreeSlot).where(NextFreeSlot.specialization_id == 1)
+         .order_by(NextFreeSlot.slot_date, NextFreeSlot.slot_time).limit(5)),
+    ]
+
+
+def _sqlite_scans(connection, statement):
+    rows = connection.execute(Explain(statement)).all()
+    plan = [row[3] for row in rows]
+    # 'SCAN t' (or 'SCAN TABLE t' on older SQLite) without an index is a full table scan
+    scans = [line for line in plan
+             if line.startswith('SCAN ') and ' USING ' not in line]
+    return plan, scans
+
+
+def _postgresql_scans(connection, statement):
+    # Small tables are always cheaper to scan; ask for the best index plan instead
+    connection.exec_driver_sql('SET LOCAL enable_seqscan = off')
+    document = connection.execute(Explain(statement)).scalar()
+    if isinstance(document, str):
+        document = json.loads(document)
+
+    plan, scans = [], []
+    nodes = [document[0]['Plan']]
+    while nodes:
+        node = nodes.pop()
+        line = f"{node['Node Type']} on {node.get('Relation Name', '-')}"
+        plan.append(line)
+        if node['Node Type'] == 'Seq Scan':
+            scans.append(line)
+        nodes.extend(node.get('Plans', []))
+    return plan, scans
+
+
+def check_query_plans():
+    """EXPLAIN every hot query and return a list of (name, plan, table scans)"""
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        inspect = _sqlite_scans
+    elif dialect == 'postgresql':
+        inspect = _postgresql_scans
+    else:
+        raise RuntimeError(f'Query plan checks are not supported on {dialect}')
+
+    results = []
+    with db.engine.connect() as connection:
+        for name, statement in hot_queries():
+            with connection.begin():
+                plan, scans = inspect(connection, statement)
+            results.append((name, plan, scans))
+    return results
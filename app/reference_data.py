@@ -0,0 +1,87 @@
+"""Cached specializations and doctor directory.
+
+The lists behind the patient search pages, the patient dashboard and the
+admin forms change only through the specialization and admin doctor CRUD
+views, which call `invalidate()` after committing. Entries are plain
+snapshots (namedtuples), never ORM instances, so they can be shared across
+requests and sessions safely.
+"""
+from collections import namedtuple
+from flask import current_app
+from sqlalchemy import func, select
+from app import db
+from app.cache import VersionedCache
+from app.models import Doctor, Specialization, User
+
+SpecializationEntry = namedtuple('SpecializationEntry', 'id name description doctor_count')
+DoctorEntry = namedtuple(
+    'DoctorEntry',
+    'id name email phone bio experience is_active specialization_id specialization'
+)
+
+cache = VersionedCache('reference_data')
+
+
+def _key(name):
+    # Apps with different databases in one process (tests) must not share entries
+    return (current_app.config['SQLALCHEMY_DATABASE_URI'], name)
+
+
+def _load_specializations():
+    doctor_count = (
+        select(func.count(Doctor.id))
+        .where(Doctor.specialization_id == Specialization.id)
+        .correlate(Specialization)
+        .scalar_subquery()
+    )
+    rows = db.session.execute(
+        select(Specialization.id, Specialization.name, Specialization.description, doctor_count)
+        .order_by(Specialization.name)
+    )
+    return tuple(SpecializationEntry(*row) for row in rows)
+
+
+def _load_doctors():
+    by_id = {spec.id: spec for spec in specializations()}
+    rows = db.session.execute(
+        select(Doctor.id, Doctor.name, User.email, Doctor.phone, Doctor.bio,
+               Doctor.experience, Doctor.is_active, Doctor.specialization_id)
+        .join(User, User.id == Doctor.user_id)
+        .order_by(Doctor.name, Doctor.id)
+    )
+    return tuple(
+        DoctorEntry(*row, specialization=by_id.get(row.specialization_id))
+        for row in rows
+    )
+
+
+def specializations():
+    """All specializations ordered by name, with their doctor counts"""
+    return cache.get(_key('specializations'), _load_specializations)
+
+
+def doctors():
+    """The doctor directory ordered by name"""
+    return cache.get(_key('doctors'), _load_doctors)
+
+
+def doctors_by_id():
+    return cache.get(_key('doctors_by_id'), lambda: {d.id: d for d in doctors()})
+
+
+def doctors_by_specialization(specialization_id):
+    return [d for d in doctors() if d.specialization_id == specialization_id]
+
+
+def invalidate():
+    """Drop cached reference data after a specialization or doctor change"""
+    cache.invalidate()
+
+
+def stats():
+    return cache.stats()
+
+
+def init_app(app):
+    cache.configure(ttl=app.config.get('REFERENCE_CACHE_TTL', 300),
+                    max_entries=app.config.get('REFERENCE_CACHE_MAX_ENTRIES', 128))
@@ -0,0 +1,157 @@
+"""Read-replica routing.
+
+With REPLICA_DATABASE_URL set, the `read` bind points at a read-only copy
+of the database and the ORM reads of GET/HEAD requests to the blueprints in
+REPLICA_BLUEPRINTS run there. Everything else stays on the primary:
+
+- flushes and everything the flush hooks run (they use the flush's
+  connection), Core writes, and SELECT ... FOR UPDATE
+- the rest of a request once it has flushed or committed
+  (read-after-write; a commit also covers Core writes made through
+  `db.session.connection()`, which never flush)
+- every request of a browser for REPLICA_STICKY_SECONDS after it wrote
+  something, so users see their own changes despite replication lag (the
+  deadline travels in the session cookie, so every worker honours it)
+- all requests while the replica is unavailable. A probe per process,
+  at most every REPLICA_CHECK_INTERVAL seconds, reads the users table and,
+  on PostgreSQL, checks the replay lag against REPLICA_MAX_LAG. A replica
+  read that fails is retried on the primary and takes the replica out
+  until the next probe.
+
+Locally two SQLite files work as primary and replica; `flask sync-replica`
+copies one onto the other.
+"""
+import threading
+import time
+from flask import current_app, g, has_request_context, request, session
+from sqlalchemy import event, select, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+from app import db
+from app.models import User
+
+BIND_KEY = 'read'
+_STICKY_KEY = '_primary_until'
+
+
+class ReplicaHealth:
+    """Whether the replica may be used, probed at most every `interval` seconds"""
+
+    def __init__(self, interval=5, max_lag=5):
+        self.interval = interval
+        self.max_lag = max_lag
+        self.available = True
+        self.reads = 0
+        self.fallbacks = 0
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    def check(self, engine):
+        with self._lock:
+            if time.monotonic() < self._next_check:
+                return self.available
+            self._next_check = time.monotonic() + self.interval
+        available = self._probe(engine)
+        with self._lock:
+            self.available = available
+        return available
+
+    def _probe(self, engine):
+        try:
+            with engine.connect() as connection:
+                connection.execute(select(User.id).limit(1)).all()
+                if connection.dialect.name == 'postgresql':
+                    lag = connection.scalar(text(
+                        'SELECT EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())'))
+                    # NULL: not a standby, or nothing replayed yet
+                    if lag is not None and lag > self.max_lag:
+                        return False
+        except DBAPIError:
+            return False
+        return True
+
+    def mark_down(self):
+        with self._lock:
+            self.available = False
+            self.fallbacks += 1
+            self._next_check = time.monotonic() + self.interval
+
+    def stats(self):
+        with self._lock:
+            return {'available': self.available, 'reads': self.reads, 'fallbacks': self.fallbacks}
+
+
+def replica_engine():
+    """The engine of the `read` bind, or None without a replica"""
+    return db.engines.get(BIND_KEY)
+
+
+def _health():
+    return current_app.extensions['replica']
+
+
+def _choose_engine():
+    g.use_replica = False
+    if request.method not in ('GET', 'HEAD'):
+        return
+    if request.blueprint not in current_app.config.get('REPLICA_BLUEPRINTS', ()):
+        return
+    if session.get(_STICKY_KEY, 0) > time.time():
+        return
+    g.use_replica = _health().check(replica_engine())
+
+
+def _remember_write(response):
+    if g.get('wrote'):
+        session[_STICKY_KEY] = time.time() + current_app.config.get('REPLICA_STICKY_SECONDS', 10)
+    return response
+
+
+def _route_read(state):
+    if not (has_request_context() and g.get('use_replica')):
+        return None
+    if not state.is_select or getattr(state.statement, '_for_update_arg', None) is not None:
+        return None
+    if state.bind_arguments.get('bind') is not None:
+        return None
+    health = _health()
+    try:
+        result = state.invoke_statement(bind_arguments={'bind': replica_engine()})
+    except DBAPIError:
+        # Down, or missing tables: read this and the next requests from the primary
+        health.mark_down()
+        g.use_replica = False
+        return state.invoke_statement()
+    health.reads += 1
+    return result
+
+
+def _mark_written():
+    if has_request_context():
+        g.use_replica = False
+        g.wrote = True
+
+
+def _primary_after_flush(db_session, flush_context):
+    _mark_written()
+
+
+def _primary_after_commit(db_session):
+    _mark_written()
+
+
+def init_app(app):
+    """Route the reads of read-only views to the `read` bind, if configured"""
+    if BIND_KEY not in (app.config.get('SQLALCHEMY_BINDS') or {}):
+        return
+    app.extensions['replica'] = ReplicaHealth(
+        interval=app.config.get('REPLICA_CHECK_INTERVAL', 5),
+        max_lag=app.config.get('REPLICA_MAX_LAG', 5),
+    )
+    for name, listener in (('do_orm_execute', _route_read),
+                           ('after_flush', _primary_after_flush),
+                           ('after_commit', _primary_after_commit)):
+        if not event.contains(Session, name, listener):
+            event.listen(Session, name, listener)
+    app.before_request(_choose_engine)
+    app.after_request(_remember_write)
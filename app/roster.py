@@ -0,0 +1,214 @@
+"""Precomputed patient roster per doctor.
+
+The `doctor_patients` table has a row for every doctor and patient with
+at least one appointment together (either tier, see app/archive.py):
+first and last visit and visit count (Completed appointments), the number
+of appointments, and the earliest Booked appointment dated today or later
+(a past one that was never completed or cancelled is not "next"). The
+patient's name is copied in so every sort order of the doctor's patient
+list is one index range read on (doctor_id, <sort key>, patient_id).
+
+An after_flush hook keeps the rows current in the same transaction. It
+recomputes the doctor/patient pairs whose appointments were inserted,
+deleted or changed in a column the summary reads (booking, completion,
+cancellation, rescheduling). It also copies changed patient columns
+(`_PATIENT_COPIES`) into the patient's rows. Archiving moves rows between
+tiers and changes nothing here.
+
+A next appointment that passes without being completed or cancelled stays
+stored until the row is recomputed. The list stops showing it right away
+(`roster_query()` only counts dates from today on), and
+`flask refresh-rosters`, run daily after midnight, recomputes those rows
+(`refresh_passed()`), so the patient's later booking shows up again.
+Bulk loads that bypass the ORM call `rebuild()` (`flask rebuild-rosters`).
+"""
+from datetime import date
+from sqlalchemy import and_, case, delete, event, func, inspect, literal, select, union_all, update
+from sqlalchemy.orm import Session, joinedload
+from app.history import keep_previous
+from app.models import Appointment, ArchivedAppointment, DoctorPatient, Patient, User
+
+# sort name -> (keyset columns, descending, rows shown)
+SORTS = {
+    'name': ((DoctorPatient.patient_name, DoctorPatient.patient_id), False, None),
+    'last_visit': ((DoctorPatient.last_visit, DoctorPatient.patient_id), True,
+                   DoctorPatient.last_visit.isnot(None)),
+    'visits': ((DoctorPatient.visit_count, DoctorPatient.patient_id), True, None),
+    'next_appointment': ((DoctorPatient.next_appointment_date, DoctorPatient.next_appointment_time,
+                          DoctorPatient.patient_id), False, DoctorPatient.next_appointment_date.isnot(None)),
+}
+
+REBUILD_CHUNK = 500  # doctors per statement in rebuild()
+
+# Appointment columns _summaries() reads; changing any of them moves a row
+_APPOINTMENT_INPUTS = ('doctor_id', 'patient_id', 'appointment_date', 'appointment_time', 'status')
+# Patient attribute -> roster column holding a copy of it
+_PATIENT_COPIES = {'name': 'patient_name'}
+
+
+def _summaries(connection, doctor_ids, patient_ids=None):
+    """{(doctor_id, patient_id): row} recomputed from the appointment tables"""
+    today = date.today()
+    tiers = []
+    for table in (Appointment.__table__, ArchivedAppointment.__table__):
+        condition = table.c.doctor_id.in_(doctor_ids)
+        if patient_ids is not None:
+            condition = and_(condition, table.c.patient_id.in_(patient_ids))
+        tiers.append(select(table.c.doctor_id, table.c.patient_id, table.c.appointment_date,
+                            func.coalesce(table.c.status, literal('Booked')).label('status'))
+                     .where(condition))
+    appointments = union_all(*tiers).subquery()
+    completed = appointments.c.status == 'Completed'
+    rows = connection.execute(
+        select(appointments.c.doctor_id, appointments.c.patient_id, Patient.name,
+               func.min(case((completed, appointments.c.appointment_date))),
+               func.max(case((completed, appointments.c.appointment_date))),
+               func.sum(case((completed, 1), else_=0)),
+               func.count())
+        .join(Patient, Patient.id == appointments.c.patient_id)
+        .group_by(appointments.c.doctor_id, appointments.c.patient_id, Patient.name)
+    )
+    summaries = {
+        (doctor_id, patient_id): {
+            'doctor_id': doctor_id, 'patient_id': patient_id, 'patient_name': name,
+            'first_visit': first_visit, 'last_visit': last_visit, 'visit_count': visits or 0,
+            'appointment_count': count, 'next_appointment_id': None,
+            'next_appointment_date': None, 'next_appointment_time': None,
+        }
+        for doctor_id, patient_id, name, first_visit, last_visit, visits, count in rows
+    }
+
+    # Only the live table has Booked appointments
+    table = Appointment.__table__
+    condition = and_(table.c.doctor_id.in_(doctor_ids), table.c.status == 'Booked',
+                     table.c.appointment_date >= today)
+    if patient_ids is not None:
+        condition = and_(condition, table.c.patient_id.in_(patient_ids))
+    booked = connection.execute(
+        select(table.c.doctor_id, table.c.patient_id, table.c.id,
+               table.c.appointment_date, table.c.appointment_time)
+        .where(condition)
+        .order_by(table.c.appointment_date.desc(), table.c.appointment_time.desc())
+    )
+    # Latest first, so the earliest one per pair is written last
+    for doctor_id, patient_id, appointment_id, appointment_date, appointment_time in booked:
+        summary = summaries.get((doctor_id, patient_id))
+        if summary is not None:
+            summary.update(next_appointment_id=appointment_id, next_appointment_date=appointment_date,
+                           next_appointment_time=appointment_time)
+    return summaries
+
+
+def refresh(connection, pairs):
+    """Recompute the roster rows of (doctor_id, patient_id) `pairs` on `connection`"""
+    if not pairs:
+        return 0
+    doctor_ids = sorted({doctor_id for doctor_id, _ in pairs})
+    patient_ids = sorted({patient_id for _, patient_id in pairs})
+    # Every pair of these doctors and patients is recomputed; a flush touches one or two
+    rows = list(_summaries(connection, doctor_ids, patient_ids).values())
+
+    table = DoctorPatient.__table__
+    connection.execute(delete(table).where(table.c.doctor_id.in_(doctor_ids),
+                                           table.c.patient_id.in_(patient_ids)))
+    if rows:
+        connection.execute(table.insert(), rows)
+    return len(rows)
+
+
+def rebuild(connection):
+    """Recompute every roster row"""
+    table = DoctorPatient.__table__
+    connection.execute(delete(table))
+    doctor_ids = sorted(set(connection.scalars(
+        union_all(select(Appointment.doctor_id).distinct(), select(ArchivedAppointment.doctor_id).distinct())
+    )))
+    count = 0
+    for start in range(0, len(doctor_ids), REBUILD_CHUNK):
+        rows = list(_summaries(connection, doctor_ids[start:start + REBUILD_CHUNK]).values())
+        if rows:
+            connection.execute(table.insert(), rows)
+        count += len(rows)
+    return count
+
+
+def refresh_passed(connection):
+    """Recompute the rows whose next appointment is dated before today"""
+    stale = connection.execute(
+        select(DoctorPatient.doctor_id, DoctorPatient.patient_id)
+        .where(DoctorPatient.next_appointment_date < date.today())
+    ).all()
+    by_doctor = {}
+    for doctor_id, patient_id in stale:
+        by_doctor.setdefault(doctor_id, []).append((doctor_id, patient_id))
+    # Per doctor, as refresh() recomputes every doctor x patient combination it is given
+    for pairs in by_doctor.values():
+        refresh(connection, pairs)
+    return len(stale)
+
+
+def roster_query(doctor_id, sort='name', search=None, upcoming=False):
+    """(query, keyset columns, descending) for a doctor's patient list"""
+    columns, descending, shown = SORTS.get(sort) or SORTS['name']
+    query = (DoctorPatient.query
+             .options(joinedload(DoctorPatient.patient).joinedload(Patient.user).load_only(User.email))
+             .filter(DoctorPatient.doctor_id == doctor_id))
+    if shown is not None:
+        query = query.filter(shown)
+    if upcoming or sort == 'next_appointment':
+        # Skip next appointments that passed since the row was last recomputed
+        query = query.filter(DoctorPatient.next_appointment_date >= date.today())
+    if search:
+        query = query.filter(func.lower(DoctorPatient.patient_name).contains(search.lower(), autoescape=True))
+    return query, list(columns), descending
+
+
+def _previous(state, key):
+    history = state.attrs[key].history
+    return history.deleted[0] if history.deleted else None
+
+
+def _changed(state, key):
+    return state.attrs[key].history.has_changes()
+
+
+def _touched(session):
+    """(pairs to recompute, {patient_id: {roster column: new value}})"""
+    pairs, copied = set(), {}
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Appointment):
+            state = inspect(obj)
+            if obj in session.dirty and not any(_changed(state, key) for key in _APPOINTMENT_INPUTS):
+                continue
+            pairs.add((obj.doctor_id, obj.patient_id))
+            previous = (_previous(state, 'doctor_id') or obj.doctor_id,
+                        _previous(state, 'patient_id') or obj.patient_id)
+            pairs.add(previous)
+        elif isinstance(obj, Patient) and obj in session.dirty:
+            state = inspect(obj)
+            values = {column: getattr(obj, key) for key, column in _PATIENT_COPIES.items()
+                      if _changed(state, key)}
+            if values:
+                copied[obj.id] = values
+    pairs = {(doctor_id, patient_id) for doctor_id, patient_id in pairs
+             if doctor_id is not None and patient_id is not None}
+    return pairs, copied
+
+
+def _refresh_after_flush(session, flush_context):
+    pairs, copied = _touched(session)
+    if not (pairs or copied):
+        return
+    connection = session.connection()
+    refresh(connection, pairs)
+    table = DoctorPatient.__table__
+    for patient_id, values in copied.items():
+        connection.execute(update(table).where(table.c.patient_id == patient_id).values(**values))
+
+
+def init_app(app):
+    """Keep the doctor/patient roster in step with appointment and patient changes"""
+    if not event.contains(Session, 'after_flush', _refresh_after_flush):
+        event.listen(Session, 'after_flush', _refresh_after_flush)
+    # A reassigned appointment also recomputes the pair it left
+    keep_previous(Appointment, ('doctor_id', 'patient_id'))
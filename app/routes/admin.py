@@ -1,10 +1,15 @@
 # app/routes/admin.py
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import (Blueprint, render_template, redirect, url_for, flash, request, Response, stream_with_context,
+                   abort, current_app, send_file)
 from flask_login import login_required, current_user
 from functools import wraps
-from app import db
-from app.models import User, Admin, Doctor, Patient, Appointment, Specialization
+from app import archive, counters, db, export, profiling, reference_data, search as search_index
+from app.pagination import paginate_keyset
+from app.models import User, Doctor, Patient, Appointment
+from sqlalchemy.orm import joinedload
 from datetime import datetime
+from io import TextIOWrapper
+import csv
 
 bp = Blueprint('admin', __name__, url_prefix='/admin')
 
@@ -14,23 +19,27 @@ def admin_required(f):
         if not current_user.is_authenticated or current_user.role != 'admin':
             flash('You need admin privileges to access this page.', 'danger')
             return redirect(url_for('home.home'))
+        return f(*args, **kwargs)
     return decorated_function
 
+def _parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date() if value else None
+
 @bp.route('/dashboard')
 @login_required
 @admin_required
 def dashboard():
-    total_doctors = Doctor.query.count()
-    total_patients = Patient.query.count()
-    total_appointments = Appointment.query.count()
-    pending_appointments = Appointment.query.filter_by(status='Booked').count()
-    recent_appointments = Appointment.query.order_by(Appointment.appointment_date.desc()).limit(5).all()
+    counts = counters.snapshot()
+    recent_appointments = Appointment.query.options(
+        joinedload(Appointment.patient),
+        joinedload(Appointment.doctor)
+    ).order_by(Appointment.appointment_date.desc()).limit(5).all()
     
     return render_template('admin/dashboard.html',
-                         total_doctors=total_doctors,
-                         total_patients=total_patients,
-                         total_appointments=total_appointments,
-                         pending_appointments=pending_appointments,
+                         total_doctors=counts['doctors'],
+                         total_patients=counts['patients'],
+                         total_appointments=counts['appointments'],
+                         pending_appointments=counts['status:Booked'],
                          recent_appointments=recent_appointments)
 
 @bp.route('/doctors')
@@ -38,22 +47,23 @@ def dashboard():
 @admin_required
 def doctors():
     search = request.args.get('search', '')
+    # Email and specialization are rendered per row, so load them up front
+    query = Doctor.query.options(
+        joinedload(Doctor.user),
+        joinedload(Doctor.specialization)
+    )
     if search:
-        doctors = Doctor.query.join(Specialization).filter(
-            (Doctor.name.contains(search)) |
-            (Doctor.phone.contains(search)) |
-            (Specialization.name.contains(search))
-        ).all()
-    else:
-        doctors = Doctor.query.all()
+        # Name, phone, email, specialization and bio via the full-text index
+        query = query.filter(Doctor.id.in_(search_index.doctor_ids(search)))
+    page = paginate_keyset(query, [Doctor.name, Doctor.id])
     
-    return render_template('admin/doctors.html', doctors=doctors, search=search)
+    return render_template('admin/doctors.html', doctors=page.items, page=page, search=search)
 
 @bp.route('/doctor/add', methods=['GET', 'POST'])
 @login_required
 @admin_required
 def add_doctor():
-    specializations = Specialization.query.all()
+    specializations = reference_data.specializations()
     
     if request.method == 'POST':
         name = request.form.get('name')
@@ -68,12 +78,8 @@ def add_doctor():
             flash('Email already registered!', 'danger')
             return redirect(url_for('admin.add_doctor'))
         
-        from werkzeug.security import generate_password_hash
-        new_user = User(
-            email=email,
-            password_hash=generate_password_hash(password),
-            role='doctor'
-        )
+        new_user = User(email=email, role='doctor')
+        new_user.set_password(password)
         db.session.add(new_user)
         db.session.flush()
         
@@ -86,6 +92,7 @@ def add_doctor():
         )
         db.session.add(new_doctor)
         db.session.commit()
+        reference_data.invalidate()
         
         flash(f'Doctor {name} added successfully!', 'success')
         return redirect(url_for('admin.doctors'))
@@ -97,7 +104,7 @@ def add_doctor():
 @admin_required
 def edit_doctor(id):
     doctor = Doctor.query.get_or_404(id)
-    specializations = Specialization.query.all()
+    specializations = reference_data.specializations()
     
     if request.method == 'POST':
         doctor.name = request.form.get('name')
@@ -115,6 +122,7 @@ def edit_doctor(id):
             doctor.user.email = new_email
         
         db.session.commit()
+        reference_data.invalidate()
         flash(f'Doctor {doctor.name} updated successfully!', 'success')
         return redirect(url_for('admin.doctors'))
     
@@ -130,6 +138,7 @@ def delete_doctor(id):
     db.session.delete(doctor)
     db.session.delete(user)
     db.session.commit()
+    reference_data.invalidate()
     
     flash(f'Doctor {doctor.name} deleted successfully!', 'success')
     return redirect(url_for('admin.doctors'))
@@ -140,16 +149,13 @@ def delete_doctor(id):
 def patients():
     search = request.args.get('search', '')
     
+    query = Patient.query.options(joinedload(Patient.user))
     if search:
-        patients = Patient.query.join(User).filter(
-            (Patient.name.contains(search)) |
-            (Patient.phone.contains(search)) |
-            (User.email.contains(search))
-        ).all()
-    else:
-        patients = Patient.query.all()
+        # Name, phone and email via the full-text index
+        query = query.filter(Patient.id.in_(search_index.patient_ids(search)))
+    page = paginate_keyset(query, [Patient.name, Patient.id])
     
-    return render_template('admin/patients.html', patients=patients, search=search)
+    return render_template('admin/patients.html', patients=page.items, page=page, search=search)
 
 @bp.route('/patient/add', methods=['GET', 'POST'])
 @login_required
@@ -169,12 +175,8 @@ def add_patient():
             flash('Email already registered!', 'danger')
             return redirect(url_for('admin.add_patient'))
         
-        from werkzeug.security import generate_password_hash
-        new_user = User(
-            email=email,
-            password_hash=generate_password_hash(password),
-            role='patient'
-        )
+        new_user = User(email=email, role='patient')
+        new_user.set_password(password)
         db.session.add(new_user)
         db.session.flush()
         
@@ -236,6 +238,33 @@ def delete_patient(id):
     flash(f'Patient {patient.name} deleted successfully!', 'success')
     return redirect(url_for('admin.patients'))
 
+@bp.route('/import', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def bulk_import():
+    """Upload a CSV of patients or doctors"""
+    from app.bulk_import import KINDS, import_csv
+    
+    report = None
+    if request.method == 'POST':
+        kind = request.form.get('kind')
+        upload = request.files.get('file')
+        if kind not in KINDS or not upload or not upload.filename:
+            flash('Choose what to import and a CSV file.', 'danger')
+            return redirect(url_for('admin.bulk_import'))
+        
+        stream = TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+        try:
+            report = import_csv(stream, kind,
+                                default_password=request.form.get('default_password') or None)
+        except (UnicodeDecodeError, csv.Error) as e:
+            flash(f'Could not read the file: {e}', 'danger')
+            return redirect(url_for('admin.bulk_import'))
+        flash(f'{report.created} of {report.rows} {kind}s imported, {report.error_count} rejected.',
+              'success' if not report.error_count else 'warning')
+    
+    return render_template('admin/import.html', report=report)
+
 @bp.route('/appointments')
 @login_required
 @admin_required
@@ -243,11 +272,99 @@ def appointments():
     search = request.args.get('search', '')
     
     if search:
-        appointments = Appointment.query.join(Patient).join(Doctor).filter(
-            (Patient.name.contains(search)) |
-            (Doctor.name.contains(search))
-        ).all()
-    else:
-        appointments = Appointment.query.all()
-    
-    return render_template('admin/appointments.html', appointments=appointments, search=search)
+        # Appointments whose patient or doctor matches the full-text index
+        patient_ids = search_index.patient_ids(search)
+        doctor_ids = search_index.doctor_ids(search)
+    
+    def build(model):
+        query = model.query.options(
+            joinedload(model.patient),
+            joinedload(model.doctor)
+        )
+        if search:
+            query = query.filter(model.patient_id.in_(patient_ids) | model.doctor_id.in_(doctor_ids))
+        return query
+    # Old closed appointments live in the archive tables
+    page = archive.appointment_page(build)
+    
+    return render_template('admin/appointments.html', appointments=page.items, page=page, search=search,
+                           doctors=reference_data.doctors(), statuses=export.STATUSES)
+
+@bp.route('/appointments/export')
+@login_required
+@admin_required
+def export_appointments():
+    """Download appointments with treatments as CSV or NDJSON, streamed"""
+    fmt = request.args.get('format', 'csv')
+    gzip = request.args.get('gzip') in ('1', 'on', 'true')
+    status = request.args.get('status') or None
+    try:
+        start_date = _parse_date(request.args.get('from'))
+        end_date = _parse_date(request.args.get('to'))
+        doctor_id = int(request.args['doctor_id']) if request.args.get('doctor_id') else None
+    except ValueError:
+        flash('Invalid export filters.', 'danger')
+        return redirect(url_for('admin.appointments'))
+    if fmt not in export.FORMATS or (status and status not in export.STATUSES):
+        flash('Invalid export format or status.', 'danger')
+        return redirect(url_for('admin.appointments'))
+    
+    chunks = export.stream(fmt, gzip=gzip, start_date=start_date, end_date=end_date,
+                           doctor_id=doctor_id, status=status)
+    name = export.filename(fmt, gzip, start_date, end_date)
+    return Response(
+        stream_with_context(chunks),
+        mimetype='application/gzip' if gzip else export.FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename="{name}"'}
+    )
+
+@bp.route('/profiling', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def profiling_overview():
+    """Switch the request profiler on or off; list recent profiles and slow queries"""
+    if request.method == 'POST':
+        if request.form.get('action') == 'enable':
+            try:
+                sample_rate = float(request.form.get('sample_rate') or 0)
+                minutes = int(request.form.get('minutes') or 0) or None
+            except ValueError:
+                flash('Invalid sample rate or duration.', 'danger')
+                return redirect(url_for('admin.profiling_overview'))
+            profiling.switch(True, sample_rate=sample_rate, minutes=minutes, by=current_user.id)
+            flash('Profiling switched on.', 'success')
+        else:
+            profiling.switch(False, by=current_user.id)
+            flash('Profiling switched off.', 'info')
+        return redirect(url_for('admin.profiling_overview'))
+    
+    state = profiling.state()
+    return render_template('admin/profiling.html',
+                           active=profiling.active(),
+                           state=state,
+                           until=datetime.fromtimestamp(state['until']) if state.get('until') else None,
+                           header=current_app.config.get('PROFILING_HEADER', 'X-Profile'),
+                           token=profiling.header_token(current_user.id),
+                           profiles=profiling.recent_profiles(),
+                           slow_queries=profiling.recent_slow_queries())
+
+@bp.route('/profiling/<name>')
+@login_required
+@admin_required
+def profile_detail(name):
+    sort = request.args.get('sort', 'cumulative')
+    if sort not in ('cumulative', 'tottime', 'calls'):
+        sort = 'cumulative'
+    report = profiling.profile_report(name, sort=sort)
+    if report is None:
+        abort(404)
+    return render_template('admin/profile_detail.html', name=name, report=report, sort=sort)
+
+@bp.route('/profiling/<name>/download')
+@login_required
+@admin_required
+def download_profile(name):
+    path = profiling.profile_path(name)
+    if path is None:
+        abort(404)
+    return send_file(path, mimetype='application/octet-stream', as_attachment=True, download_name=name)
@@ -0,0 +1,235 @@
+"""JSON API (v1) for the mobile app and kiosk screens.
+
+Responses carry an ETag and Last-Modified built from the version stamp of
+the doctor or patient they describe (app/versions.py). The stamp is read
+before anything else, so a poll with a matching If-None-Match (or a recent
+enough If-Modified-Since, for responses that depend on nothing else) gets
+a 304 after a single primary-key read.
+
+`?fields=a,b` trims every item to the listed fields.
+"""
+import hashlib
+from datetime import datetime, timedelta, timezone
+from functools import wraps
+from flask import Blueprint, current_app, g, jsonify, request
+from flask_login import current_user
+from sqlalchemy.orm import joinedload
+from app import archive, next_slots, slots, versions
+from app.identity import current_profile
+from app.models import Availability, Doctor
+
+bp = Blueprint('api', __name__, url_prefix='/api/v1')
+
+APPOINTMENT_FIELDS = ('id', 'date', 'time', 'status', 'reason',
+                      'doctor_id', 'doctor_name', 'patient_id', 'patient_name')
+DOCTOR_FIELDS = ('id', 'name', 'specialization_id', 'specialization', 'experience', 'bio', 'phone',
+                 'is_active')
+MAX_DAYS = 31
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+@bp.errorhandler(ApiError)
+def _api_error(error):
+    return jsonify(error=error.message), error.status
+
+
+def api_login_required(role=None):
+    """Like login_required/role decorators, but answering 401/403 in JSON"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not current_user.is_authenticated:
+                raise ApiError('Authentication required', 401)
+            if role is not None and (current_user.role != role or current_profile() is None):
+                raise ApiError(f'Only {role}s can use this endpoint', 403)
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+
+def _fields(allowed):
+    requested = request.args.get('fields')
+    if not requested:
+        return allowed
+    fields = tuple(name.strip() for name in requested.split(',') if name.strip())
+    unknown = sorted(set(fields) - set(allowed))
+    if unknown:
+        raise ApiError(f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+
+def _select(item, fields):
+    return {name: item[name] for name in fields}
+
+
+def _parse_date(value, default):
+    if not value:
+        return default
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise ApiError(f'Invalid date "{value}", expected YYYY-MM-DD')
+
+
+def not_modified(scope, scope_id, extra=''):
+    """Check the request's validators against a stamp; True means answer 304.
+
+    The ETag covers the stamp, the URL with its query string and `extra`
+    (anything else the response depends on, like the date or the clock),
+    and is attached to the response by `_add_validators`. Last-Modified
+    only describes the stamp, so it is left out when there is an `extra`.
+    """
+    version, updated_at = versions.get(scope, scope_id)
+    digest = hashlib.sha1(f'{request.full_path}|{extra}'.encode()).hexdigest()[:12]
+    etag = f'{scope}-{scope_id}-{version}-{digest}'
+    last_modified = None
+    if updated_at and not extra:
+        last_modified = updated_at.replace(microsecond=0, tzinfo=timezone.utc)
+    g.api_validators = (etag, last_modified)
+
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if request.if_modified_since and last_modified:
+        return last_modified <= request.if_modified_since
+    return False
+
+
+def _not_modified_response():
+    return current_app.response_class(status=304)
+
+
+@bp.after_request
+def _add_validators(response):
+    validators = g.pop('api_validators', None)
+    if validators and response.status_code in (200, 304):
+        etag, last_modified = validators
+        response.set_etag(etag)
+        if last_modified:
+            response.last_modified = last_modified
+        # Private data; always revalidate, which is what makes polling cheap
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def serialize_appointment(appointment):
+    return {
+        'id': appointment.id,
+        'date': appointment.appointment_date.isoformat(),
+        'time': appointment.appointment_time.strftime('%H:%M'),
+        'status': appointment.status,
+        'reason': appointment.reason,
+        'doctor_id': appointment.doctor_id,
+        'doctor_name': appointment.doctor.name,
+        'patient_id': appointment.patient_id,
+        'patient_name': appointment.patient.name,
+    }
+
+
+def serialize_doctor(doctor):
+    return {
+        'id': doctor.id,
+        'name': doctor.name,
+        'specialization_id': doctor.specialization_id,
+        'specialization': doctor.specialization.name if doctor.specialization else None,
+        'experience': doctor.experience,
+        'bio': doctor.bio,
+        'phone': doctor.phone,
+        'is_active': doctor.is_active,
+    }
+
+
+@bp.route('/me/appointments')
+@api_login_required('patient')
+def my_appointments():
+    """The patient's appointments, newest first, keyset-paginated"""
+    patient = current_profile()
+    fields = _fields(APPOINTMENT_FIELDS)
+    status = request.args.get('status')
+    if not_modified('patient', patient.id):
+        return _not_modified_response()
+
+    def build(model):
+        query = model.query.options(
+            joinedload(model.doctor), joinedload(model.patient)
+        ).filter(model.patient_id == patient.id)
+        if status:
+            query = query.filter(model.status == status)
+        return query
+    page = archive.appointment_page(
+        build,
+        per_page=min(request.args.get('limit', type=int) or current_app.config.get('PAGE_SIZE', 25), 100)
+    )
+    return jsonify(
+        items=[_select(serialize_appointment(a), fields) for a in page.items],
+        next_cursor=page.next_cursor,
+    )
+
+
+@bp.route('/doctor/appointments')
+@api_login_required('doctor')
+def doctor_appointments():
+    """The doctor's appointments on one day (today by default)"""
+    doctor = current_profile()
+    fields = _fields(APPOINTMENT_FIELDS)
+    day = _parse_date(request.args.get('date'), datetime.now().date())
+    # The default day rolls over at midnight without any write
+    if not_modified('doctor', doctor.id, extra=day.isoformat()):
+        return _not_modified_response()
+
+    appointments = archive.doctor_day(doctor.id, day)
+    return jsonify(date=day.isoformat(),
+                   items=[_select(serialize_appointment(a), fields) for a in appointments])
+
+
+@bp.route('/doctors/<int:doctor_id>')
+@api_login_required()
+def doctor_detail(doctor_id):
+    fields = _fields(DOCTOR_FIELDS)
+    if not_modified('doctor', doctor_id):
+        return _not_modified_response()
+    doctor = Doctor.query.options(joinedload(Doctor.specialization)).get(doctor_id)
+    if doctor is None:
+        raise ApiError('Doctor not found', 404)
+    return jsonify(_select(serialize_doctor(doctor), fields))
+
+
+@bp.route('/doctors/<int:doctor_id>/availability')
+@api_login_required()
+def doctor_availability(doctor_id):
+    """Availability windows and free slots from `from` (today) for `days` days"""
+    start_date = _parse_date(request.args.get('from'), datetime.now().date())
+    days = request.args.get('days', type=int) or current_app.config.get('BOOKING_WINDOW_DAYS', 7)
+    if not 1 <= days <= MAX_DAYS:
+        raise ApiError(f'days must be between 1 and {MAX_DAYS}')
+    # Free slots drop out once they start (windows have their own lengths and
+    # start times): the answer changes with the clock when the earliest one starts
+    length = slots.slot_minutes()
+    now = datetime.now()
+    upcoming = next_slots.first_upcoming(doctor_id, now)
+    if not_modified('doctor', doctor_id, extra=f'{start_date}|{now.date()}|{upcoming}'):
+        return _not_modified_response()
+
+    end_date = start_date + timedelta(days=days - 1)
+    windows = Availability.query.filter(
+        Availability.doctor_id == doctor_id,
+        Availability.date.between(start_date, end_date),
+        Availability.is_available.is_(True)
+    ).order_by(Availability.date, Availability.start_time).all()
+    free = slots.free_slots([doctor_id], start_date, end_date, now=now).get(doctor_id, {})
+    return jsonify(
+        doctor_id=doctor_id,
+        windows=[{
+            'date': window.date.isoformat(),
+            'start': window.start_time.strftime('%H:%M'),
+            'end': window.end_time.strftime('%H:%M'),
+            'slot_minutes': window.slot_minutes or length,
+        } for window in windows],
+        free_slots={day.isoformat(): [t.strftime('%H:%M') for t in times]
+                    for day, times in sorted(free.items())},
+    )
@@ -1,6 +1,5 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request
 from flask_login import login_user, logout_user, login_required, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
 from app import db
 from app.models import User, Patient
 from app.forms import LoginForm, PatientRegisterForm
@@ -12,7 +11,8 @@ bp = Blueprint('auth', __name__, url_prefix='/auth')
 def login():
     # If user is already logged in, redirect to their dashboard
     if current_user.is_authenticated:
-            return redirect(url_for('home.home'))    
+        return redirect(url_for('home.home'))
+    
     form = LoginForm()
     
     # When form is submitted and valid
@@ -21,12 +21,15 @@ def login():
         user = User.query.filter_by(email=form.email.data).first()
         
         # Check if user exists and password is correct
-    if user and user.check_password(form.password.data):            login_user(user)
-                # Log the user in
+        if user and user.check_password(form.password.data):
+            # Persist the hash if check_password upgraded it
+            db.session.commit()
+            # Log the user in
+            login_user(user)
             flash('Login successful!', 'success')
             # Redirect to page they were trying to access, or home
             next_page = request.args.get('next')
-        return redirect(next_page) if next_page else redirect(url_for('home.home'))
+            return redirect(next_page) if next_page else redirect(url_for('home.home'))
     
     return render_template('auth/login.html', form=form)
 
@@ -34,19 +37,14 @@ def login():
 def register():
     # If already logged in, redirect to home
     if current_user.is_authenticated:
-            return redirect(url_for('home.home'))    
+        return redirect(url_for('home.home'))
+    
     form = PatientRegisterForm()
     
     if form.validate_on_submit():
-        # Create new user account
-        hashed_password = generate_password_hash(form.password.data)
-        
         # Create User record
-        new_user = User(
-            email=form.email.data,
-            password=hashed_password,
-            role='patient'
-        )
+        new_user = User(email=form.email.data, role='patient')
+        new_user.set_password(form.password.data)
         db.session.add(new_user)
         db.session.flush()  # Get the user.id without committing
         
@@ -71,4 +69,4 @@ def register():
 def logout():
     logout_user()
     flash('You have been logged out.', 'info')
-    return redirect(url_for('home.index'))
+    return redirect(url_for('home.home'))
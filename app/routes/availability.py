@@ -1,51 +1,62 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash
+from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app
 from flask_login import login_required, current_user
-from app import db
-from app.models import Doctor, Availability, User
+from app import db, availability_templates as templates
+from app.identity import current_profile
+from app.models import Availability, AvailabilityException, AvailabilityTemplate
 from datetime import datetime, timedelta
 from functools import wraps
 
 bp = Blueprint('availability', __name__, url_prefix='/doctor')
 
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
 def doctor_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if not current_user.is_authenticated or current_user.role != 'doctor':
+        if not current_user.is_authenticated or current_user.role != 'doctor' or current_profile() is None:
             flash('Access denied', 'danger')
             return redirect(url_for('home.home'))
+        return f(*args, **kwargs)
     return decorated_function
 
+def _parse_time(value):
+    return datetime.strptime(value or '', '%H:%M').time()
+
+def _parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date() if value else None
+
 @bp.route('/availability', methods=['GET', 'POST'])
 @login_required
 @doctor_required
 def manage_availability():
-    doctor = Doctor.query.filter_by(user_id=current_user.id).first()
+    doctor = current_profile()
     if not doctor:
         flash('Doctor profile not found', 'danger')
-            return redirect(url_for('home.home'))    
+        return redirect(url_for('home.home'))
+    
+    window_days = current_app.config.get('AVAILABILITY_GENERATE_DAYS', 28)
+    today = datetime.now().date()
+    last_day = today + timedelta(days=window_days - 1)
+    
     if request.method == 'POST':
         date = request.form.get('date')
-        start_time = request.form.get('start_time')
-        end_time = request.form.get('end_time')
         
         try:
             date_obj = datetime.strptime(date, '%Y-%m-%d').date()
-            # Check if date is within next 7 days
-            today = datetime.now().date()
-            if date_obj < today or date_obj > today + timedelta(days=6):
-                flash('Please select a date within the next 7 days', 'danger')
+            start_time = _parse_time(request.form.get('start_time'))
+            end_time = _parse_time(request.form.get('end_time'))
+            if date_obj < today or date_obj > last_day:
+                flash(f'Please select a date within the next {window_days} days', 'danger')
+                return redirect(url_for('availability.manage_availability'))
+            if end_time <= start_time:
+                flash('End time must be after start time', 'danger')
                 return redirect(url_for('availability.manage_availability'))
             
-            # Check if slot already exists
-            existing = Availability.query.filter_by(
-                doctor_id=doctor.id,
-                date=date_obj,
-                start_time=start_time,
-                end_time=end_time
-            ).first()
-            
-            if existing:
-                flash('This slot already exists', 'warning')
+            # Windows of one doctor must not overlap
+            overlap = templates.find_availability_overlap(doctor.id, date_obj, start_time, end_time)
+            if overlap:
+                flash(f'This slot overlaps {overlap.start_time.strftime("%H:%M")}-'
+                      f'{overlap.end_time.strftime("%H:%M")} on that day', 'warning')
                 return redirect(url_for('availability.manage_availability'))
             
             availability = Availability(
@@ -60,28 +71,164 @@ def manage_availability():
             flash('Availability slot added successfully', 'success')
         except ValueError:
             flash('Invalid date or time format', 'danger')
-        except Exception as e:
+        except Exception:
             db.session.rollback()
             flash('Error adding availability slot', 'danger')
         
         return redirect(url_for('availability.manage_availability'))
     
-    # Get availability for next 7 days
-    today = datetime.now().date()
-    week_end = today + timedelta(days=6)
     availabilities = Availability.query.filter_by(doctor_id=doctor.id).filter(
         Availability.date >= today,
-        Availability.date <= week_end
+        Availability.date <= last_day
     ).order_by(Availability.date, Availability.start_time).all()
+    weekly = AvailabilityTemplate.query.filter_by(doctor_id=doctor.id).order_by(
+        AvailabilityTemplate.weekday, AvailabilityTemplate.start_time
+    ).all()
+    exceptions = AvailabilityException.query.filter(
+        AvailabilityException.doctor_id == doctor.id,
+        AvailabilityException.date >= today
+    ).order_by(AvailabilityException.date, AvailabilityException.start_time).all()
     
-    return render_template('doctor/availability.html', availabilities=availabilities, doctor=doctor)
+    return render_template('doctor/availability.html',
+                         availabilities=availabilities,
+                         templates=weekly,
+                         exceptions=exceptions,
+                         weekdays=WEEKDAYS,
+                         window_days=window_days,
+                         doctor=doctor)
+
+@bp.route('/availability/templates', methods=['POST'])
+@login_required
+@doctor_required
+def add_template():
+    doctor = current_profile()
+    try:
+        weekday = int(request.form.get('weekday'))
+        start_time = _parse_time(request.form.get('start_time'))
+        end_time = _parse_time(request.form.get('end_time'))
+        slot_minutes = request.form.get('slot_minutes', type=int)
+        valid_from = _parse_date(request.form.get('valid_from'))
+        valid_until = _parse_date(request.form.get('valid_until'))
+    except (TypeError, ValueError):
+        flash('Invalid weekday, date or time', 'danger')
+        return redirect(url_for('availability.manage_availability'))
+    
+    if weekday not in range(7) or end_time <= start_time:
+        flash('Choose a weekday and an end time after the start time', 'danger')
+        return redirect(url_for('availability.manage_availability'))
+    if slot_minutes is not None and slot_minutes <= 0:
+        flash('Slot length must be a positive number of minutes', 'danger')
+        return redirect(url_for('availability.manage_availability'))
+    if valid_from and valid_until and valid_until < valid_from:
+        flash('"Valid until" must not be before "valid from"', 'danger')
+        return redirect(url_for('availability.manage_availability'))
+    
+    overlap = templates.find_template_overlap(doctor.id, weekday, start_time, end_time,
+                                              valid_from, valid_until)
+    if overlap:
+        flash(f'This overlaps your {WEEKDAYS[overlap.weekday]} '
+              f'{overlap.start_time.strftime("%H:%M")}-{overlap.end_time.strftime("%H:%M")} template', 'warning')
+        return redirect(url_for('availability.manage_availability'))
+    
+    db.session.add(AvailabilityTemplate(
+        doctor_id=doctor.id, weekday=weekday, start_time=start_time, end_time=end_time,
+        slot_minutes=slot_minutes, valid_from=valid_from, valid_until=valid_until
+    ))
+    db.session.commit()
+    flash('Weekly template added. Generate availability to apply it.', 'success')
+    return redirect(url_for('availability.manage_availability'))
+
+@bp.route('/availability/templates/<int:id>/delete', methods=['POST'])
+@login_required
+@doctor_required
+def delete_template(id):
+    template = AvailabilityTemplate.query.get_or_404(id)
+    doctor = current_profile()
+    if template.doctor_id != doctor.id:
+        flash('Access denied', 'danger')
+        return redirect(url_for('home.home'))
+    
+    # Future windows generated from it go too; booked appointments are kept
+    removed = templates.remove_generated(doctor.id, template_id=template.id,
+                                         from_date=datetime.now().date())
+    Availability.query.filter_by(template_id=template.id).update({'template_id': None})
+    db.session.delete(template)
+    db.session.commit()
+    flash(f'Template deleted ({removed} upcoming windows removed)', 'success')
+    return redirect(url_for('availability.manage_availability'))
+
+@bp.route('/availability/exceptions', methods=['POST'])
+@login_required
+@doctor_required
+def add_exception():
+    doctor = current_profile()
+    try:
+        day = _parse_date(request.form.get('date'))
+        start_value, end_value = request.form.get('start_time'), request.form.get('end_time')
+        start_time = _parse_time(start_value) if start_value else None
+        end_time = _parse_time(end_value) if end_value else None
+    except ValueError:
+        flash('Invalid date or time format', 'danger')
+        return redirect(url_for('availability.manage_availability'))
+    
+    if day is None or (start_time is None) != (end_time is None) or \
+            (start_time and end_time <= start_time):
+        flash('Give a date, and either both times or neither (whole day)', 'danger')
+        return redirect(url_for('availability.manage_availability'))
+    
+    exception = AvailabilityException(doctor_id=doctor.id, date=day, start_time=start_time,
+                                      end_time=end_time, reason=request.form.get('reason'))
+    db.session.add(exception)
+    templates.apply_exception(exception)
+    db.session.commit()
+    flash('Exception added; availability on that day was updated', 'success')
+    return redirect(url_for('availability.manage_availability'))
+
+@bp.route('/availability/exceptions/<int:id>/delete', methods=['POST'])
+@login_required
+@doctor_required
+def delete_exception(id):
+    exception = AvailabilityException.query.get_or_404(id)
+    doctor = current_profile()
+    if exception.doctor_id != doctor.id:
+        flash('Access denied', 'danger')
+        return redirect(url_for('home.home'))
+    
+    # Give back the manual hours it cut, then regenerate the day from the templates
+    day = exception.date
+    templates.remove_exception(exception)
+    db.session.flush()
+    templates.remove_generated(doctor.id, day=day)
+    templates.generate(db.session.connection(), start_date=day, days=1, doctor_ids=[doctor.id])
+    db.session.commit()
+    flash('Exception removed', 'success')
+    return redirect(url_for('availability.manage_availability'))
+
+@bp.route('/availability/generate', methods=['POST'])
+@login_required
+@doctor_required
+def generate_availability():
+    doctor = current_profile()
+    report = templates.generate(
+        db.session.connection(),
+        days=current_app.config.get('AVAILABILITY_GENERATE_DAYS', 28),
+        doctor_ids=[doctor.id]
+    )
+    db.session.commit()
+    flash(f'{report.created} availability windows created, {report.existing} already present', 'success')
+    for conflict in report.conflicts[:5]:
+        flash(f'Skipped {conflict.date} {conflict.start_time.strftime("%H:%M")}-'
+              f'{conflict.end_time.strftime("%H:%M")}: overlaps '
+              f'{conflict.existing_start.strftime("%H:%M")}-{conflict.existing_end.strftime("%H:%M")}',
+              'warning')
+    return redirect(url_for('availability.manage_availability'))
 
 @bp.route('/availability/<int:id>/delete', methods=['POST'])
 @login_required
 @doctor_required
 def delete_availability(id):
     availability = Availability.query.get_or_404(id)
-    doctor = Doctor.query.filter_by(user_id=current_user.id).first()
+    doctor = current_profile()
     
     if availability.doctor_id != doctor.id:
         flash('Access denied', 'danger')
@@ -91,7 +238,7 @@ def delete_availability(id):
         db.session.delete(availability)
         db.session.commit()
         flash('Availability slot deleted', 'success')
-    except Exception as e:
+    except Exception:
         db.session.rollback()
         flash('Error deleting availability slot', 'danger')
     
@@ -1,9 +1,12 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import Blueprint, render_template, redirect, url_for, flash, request, abort
 from flask_login import login_required, current_user
 from functools import wraps
-from app import db
-from app.models import Doctor, Appointment, Treatment, Patient
-from datetime import datetime
+from app import archive, counters, db, roster
+from app.identity import current_profile
+from app.pagination import paginate_keyset
+from app.models import Appointment, Treatment
+from sqlalchemy.orm import joinedload
+from datetime import date, datetime
 
 # Create doctor blueprint
 bp = Blueprint('doctor', __name__, url_prefix='/doctor')
@@ -12,9 +15,10 @@ bp = Blueprint('doctor', __name__, url_prefix='/doctor')
 def doctor_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if not current_user.is_authenticated or current_user.role != 'doctor':
+        if not current_user.is_authenticated or current_user.role != 'doctor' or current_profile() is None:
             flash('You need doctor privileges to access this page.', 'danger')
             return redirect(url_for('home.home'))
+        return f(*args, **kwargs)
     return decorated_function
 
 @bp.route('/dashboard')
@@ -22,49 +26,58 @@ def doctor_required(f):
 @doctor_required
 def dashboard():
     # Get doctor profile
-    doctor = Doctor.query.filter_by(user_id=current_user.id).first()
+    doctor = current_profile()
     
     # Get appointment statistics
-    total_appointments = Appointment.query.filter_by(doctor_id=doctor.id).count()
-    pending_appointments = Appointment.query.filter_by(doctor_id=doctor.id, status='Booked').count()
-    completed_appointments = Appointment.query.filter_by(doctor_id=doctor.id, status='Completed').count()
+    counts = counters.snapshot('doctor', doctor.id)
+    stats = {
+        'total': counts['appointments'],
+        'pending': counts['status:Booked'],
+        'completed': counts['status:Completed']
+    }
     
     # Get today's appointments
     today = datetime.now().date()
-    todays_appointments = Appointment.query.filter(
+    todays_appointments = Appointment.query.options(
+        joinedload(Appointment.patient)
+    ).filter(
         Appointment.doctor_id == doctor.id,
-        db.func.date(Appointment.appointment_date) == today
+        Appointment.appointment_date == today
     ).all()
     
     return render_template('doctor/dashboard.html',
                          doctor=doctor,
-                         total_appointments=total_appointments,
-                         pending_appointments=pending_appointments,
-                         completed_appointments=completed_appointments,
-                         todays_appointments=todays_appointments)
+                         stats=stats,
+                         today_appointments=todays_appointments)
 
 @bp.route('/appointments')
 @login_required
 @doctor_required
 def appointments():
-    doctor = Doctor.query.filter_by(user_id=current_user.id).first()
+    doctor = current_profile()
     
     # Filter by status if provided
     status_filter = request.args.get('status', 'all')
     
-    if status_filter == 'all':
-        appointments = Appointment.query.filter_by(doctor_id=doctor.id).order_by(Appointment.appointment_date.desc()).all()
-    else:
-        appointments = Appointment.query.filter_by(doctor_id=doctor.id, status=status_filter).order_by(Appointment.appointment_date.desc()).all()
+    def build(model):
+        query = model.query.options(joinedload(model.patient)).filter_by(doctor_id=doctor.id)
+        if status_filter != 'all':
+            query = query.filter_by(status=status_filter)
+        return query
+    # Old closed appointments live in the archive tables
+    page = archive.appointment_page(build)
     
-    return render_template('doctor/appointments.html', appointments=appointments, status_filter=status_filter)
+    return render_template('doctor/appointments.html', appointments=page.items, page=page, status_filter=status_filter)
 
 @bp.route('/appointment/<int:id>')
 @login_required
 @doctor_required
 def appointment_detail(id):
-    doctor = Doctor.query.filter_by(user_id=current_user.id).first()
-    appointment = Appointment.query.get_or_404(id)
+    doctor = current_profile()
+    # Closed appointments may have been moved to the archive tables
+    appointment = archive.find_appointment(id)
+    if appointment is None:
+        abort(404)
     
     # Verify this appointment belongs to this doctor
     if appointment.doctor_id != doctor.id:
@@ -72,10 +85,7 @@ def appointment_detail(id):
         return redirect(url_for('doctor.appointments'))
     
     # Get patient's treatment history
-    patient_history = Treatment.query.join(Appointment).filter(
-        Appointment.patient_id == appointment.patient_id,
-        Appointment.status == 'Completed'
-    ).order_by(Treatment.created_at.desc()).all()
+    patient_history = archive.treatment_history(appointment.patient_id, order_by_treatment=True)
     
     return render_template('doctor/appointment_detail.html', 
                          appointment=appointment,
@@ -85,7 +95,7 @@ def appointment_detail(id):
 @login_required
 @doctor_required
 def complete_appointment(id):
-    doctor = Doctor.query.filter_by(user_id=current_user.id).first()
+    doctor = current_profile()
     appointment = Appointment.query.get_or_404(id)
     
     # Verify this appointment belongs to this doctor
@@ -116,14 +126,14 @@ def complete_appointment(id):
     db.session.add(treatment)
     db.session.commit()
     
-    flash(f'Appointment marked as completed and treatment recorded.', 'success')
+    flash('Appointment marked as completed and treatment recorded.', 'success')
     return redirect(url_for('doctor.appointments'))
 
 @bp.route('/appointment/<int:id>/cancel', methods=['POST'])
 @login_required
 @doctor_required
 def cancel_appointment(id):
-    doctor = Doctor.query.filter_by(user_id=current_user.id).first()
+    doctor = current_profile()
     appointment = Appointment.query.get_or_404(id)
     
     if appointment.doctor_id != doctor.id:
@@ -138,60 +148,21 @@ def cancel_appointment(id):
     flash(f'Appointment cancelled: {reason}', 'info')
     return redirect(url_for('doctor.appointments'))
 
-@bp.route('/availability', methods=['GET', 'POST'])
-@login_required
-@doctor_required
-def availability():
-    from app.models import Availability
-    doctor = Doctor.query.filter_by(user_id=current_user.id).first()
-    
-    if request.method == 'POST':
-        date = request.form.get('date')
-        start_time = request.form.get('start_time')
-        end_time = request.form.get('end_time')
-        
-        availability = Availability(
-            doctor_id=doctor.id,
-            date=date,
-            start_time=datetime.strptime(start_time, '%H:%M').time() if start_time else None,
-            end_time=datetime.strptime(end_time, '%H:%M').time() if end_time else None
-        )
-        db.session.add(availability)
-        db.session.commit()
-        
-        flash('Availability added successfully!', 'success')
-        return redirect(url_for('doctor.availability'))
-    
-    availabilities = Availability.query.filter_by(doctor_id=doctor.id).all()
-    return render_template('doctor/availability.html', availabilities=availabilities)
-
-@bp.route('/availability/delete/<int:id>')
-@login_required
-@doctor_required
-def delete_availability(id):
-    from app.models import Availability
-    doctor = Doctor.query.filter_by(user_id=current_user.id).first()
-    availability = Availability.query.get_or_404(id)
-    
-    if availability.doctor_id != doctor.id:
-        flash('Unauthorized action.', 'danger')
-        return redirect(url_for('doctor.availability'))
-    
-    db.session.delete(availability)
-    db.session.commit()
-    
-    flash('Availability deleted.', 'success')
-    return redirect(url_for('doctor.availability'))
-
 @bp.route('/patients')
 @login_required
 @doctor_required
 def patients():
-    doctor = Doctor.query.filter_by(user_id=current_user.id).first()
+    doctor = current_profile()
+    
+    sort = request.args.get('sort', 'name')
+    if sort not in roster.SORTS:
+        sort = 'name'
+    search = request.args.get('search', '').strip()
+    upcoming = request.args.get('upcoming') == '1'
     
-    # Get unique patients who have appointments with this doctor
-    patients = db.session.query(Patient).join(Appointment).filter(
-        Appointment.doctor_id == doctor.id
-    ).distinct().all()
+    # One index range read on the precomputed roster
+    query, columns, descending = roster.roster_query(doctor.id, sort, search, upcoming)
+    page = paginate_keyset(query, columns, descending=descending)
     
-    return render_template('doctor/patients.html', patients=patients)
+    return render_template('doctor/patients.html', entries=page.items, page=page,
+                           sort=sort, search=search, upcoming=upcoming, today=date.today())
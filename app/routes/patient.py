@@ -1,8 +1,12 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, Response, current_app
 from flask_login import login_required, current_user
-from app.models import Doctor, Appointment, Patient, Treatment, Availability, Specialization
-from app import db
-from datetime import datetime, date, time, timedelta
+from app.models import Doctor, Appointment
+from app import archive, counters, db, next_slots, reference_data, search, slot_events, slots
+from app.identity import current_profile
+from app.booking import SlotUnavailable, book_slot, reschedule_slot, suggest_slots
+from sqlalchemy import func, select
+from sqlalchemy.orm import joinedload
+from datetime import datetime, date, timedelta
 from functools import wraps
 
 # Create patient blueprint
@@ -14,30 +18,37 @@ def patient_required(f):
     def decorated_function(*args, **kwargs):
         if not current_user.is_authenticated:
             return redirect(url_for('auth.login'))
-                if current_user.role != 'patient':
-                                flash('Access denied. Patients only.', 'danger')
+        if current_user.role != 'patient' or current_profile() is None:
+            flash('Access denied. Patients only.', 'danger')
             return redirect(url_for('home.home'))
+        return f(*args, **kwargs)
+    return decorated_function
+
+def _slot_taken_message(alternatives):
+    message = 'This time slot is no longer available. Please choose another time.'
+    if alternatives:
+        times = ', '.join(t.strftime('%I:%M %p') for t in alternatives)
+        message += f' Next free times that day: {times}.'
+    return message
+
+def _parse_slot(value):
+    """'YYYY-MM-DDTHH:MM' from the slot picker -> (date, time)"""
+    moment = datetime.strptime(value or '', '%Y-%m-%dT%H:%M')
+    return moment.date(), moment.time()
 
 @bp.route('/dashboard')
 @login_required
 @patient_required
 def dashboard():
     # Get patient's appointments statistics
-    patient = Patient.query.filter_by(user_id=current_user.id).first()
-    
-    total_appointments = Appointment.query.filter_by(patient_id=patient.id).count()
-    upcoming_appointments = Appointment.query.filter_by(
-        patient_id=patient.id,
-        status='Booked'
-    ).filter(Appointment.appointment_date >= date.today()).count()
+    patient = current_profile()
     
-    completed_appointments = Appointment.query.filter_by(
-        patient_id=patient.id,
-        status='Completed'
-    ).count()
+    counts = counters.snapshot('patient', patient.id)
     
     # Get upcoming appointments
-    upcoming = Appointment.query.filter_by(
+    upcoming = Appointment.query.options(
+        joinedload(Appointment.doctor).joinedload(Doctor.specialization)
+    ).filter_by(
         patient_id=patient.id,
         status='Booked'
     ).filter(Appointment.appointment_date >= date.today()).order_by(
@@ -45,12 +56,21 @@ def dashboard():
         Appointment.appointment_time
     ).limit(5).all()
 
-        # Get all specializations
+    # Get all specializations
+    specializations = reference_data.specializations()
     
     stats = {
-        'total': total_appointments,
-        'upcoming': upcoming_appointments,
-        'completed': completed_appointments
+        'total': counts['appointments'],
+        # The Booked counter also holds past appointments the doctor has not
+        # closed yet; count today's and later on the patient/date index instead
+        'upcoming': db.session.scalar(
+            select(func.count()).select_from(Appointment).where(
+                Appointment.patient_id == patient.id,
+                Appointment.appointment_date >= date.today(),
+                Appointment.status == 'Booked'
+            )
+        ),
+        'completed': counts['status:Completed']
     }
     
     return render_template('patient/dashboard.html', stats=stats, upcoming=upcoming, specializations=specializations)
@@ -63,18 +83,20 @@ def search_doctors():
     search_query = request.args.get('search', '')
     specialization = request.args.get('specialization', '')
     
-    # Build query
-    query = Doctor.query
-    
+    # Doctors come from the cached directory
     if search_query:
-        query = query.filter(Doctor.name.contains(search_query))
-    
-    if specialization:
-        query = query.join(Specialization).filter(Specialization.id == int(specialization))    
-    doctors = query.all()
+        # Ranked full-text match on name, specialization and bio, within the specialization
+        directory = reference_data.doctors_by_id()
+        ranked = search.ranked_doctor_ids(search_query,
+                                          specialization_id=int(specialization) if specialization else None)
+        doctors = [directory[doctor_id] for doctor_id in ranked if doctor_id in directory]
+    else:
+        doctors = list(reference_data.doctors())
+        if specialization:
+            doctors = [doctor for doctor in doctors if doctor.specialization_id == int(specialization)]
     
     # Get all unique specializations for filter dropdown
-        specializations = Specialization.query.all()
+    specializations = reference_data.specializations()
     
     return render_template('patient/search_doctors.html', 
                          doctors=doctors, 
@@ -87,83 +109,65 @@ def search_doctors():
 @patient_required
 def book_appointment(doctor_id):
     doctor = Doctor.query.get_or_404(doctor_id)
-    patient = Patient.query.filter_by(user_id=current_user.id).first()
+    patient = current_profile()
     
     if request.method == 'POST':
-        appointment_date_str = request.form.get('appointment_date')
-        appointment_time_str = request.form.get('appointment_time')
         reason = request.form.get('reason')
         
         try:
-            # Parse date and time
-            appointment_date = datetime.strptime(appointment_date_str, '%Y-%m-%d').date()
-            appointment_time = datetime.strptime(appointment_time_str, '%H:%M').time()
-            
-            # Validate date is not in the past
-            if appointment_date < date.today():
-                flash('Cannot book appointment in the past.', 'danger')
-                return redirect(url_for('patient.book_appointment', doctor_id=doctor_id))
-            
-            # Check if same date and time is already booked with this doctor
-            existing = Appointment.query.filter_by(
-                doctor_id=doctor_id,
-                appointment_date=appointment_date,
-                appointment_time=appointment_time,
-                status='Booked'
-            ).first()
-            
-            if existing:
-                flash('This time slot is already booked. Please choose another time.', 'danger')
-                return redirect(url_for('patient.book_appointment', doctor_id=doctor_id))
-            
-            # Create new appointment
-            appointment = Appointment(
-                patient_id=patient.id,
-                doctor_id=doctor_id,
-                appointment_date=appointment_date,
-                appointment_time=appointment_time,
-                reason=reason if reason else None,
-                status='Booked'
-            )
-            
-            db.session.add(appointment)
-            db.session.commit()
-            
-            flash(f'Appointment booked successfully with Dr. {doctor.name} on {appointment_date.strftime("%d %b %Y")} at {appointment_time.strftime("%I:%M %p")}.', 'success')
-            return redirect(url_for('patient.appointments'))
-            
-        except ValueError as e:
-            flash('Invalid date or time format.', 'danger')
+            appointment_date, appointment_time = _parse_slot(request.form.get('slot'))
+        except ValueError:
+            flash('Please choose one of the available slots.', 'danger')
+            return redirect(url_for('patient.book_appointment', doctor_id=doctor_id))
+        
+        # Only free slots (inside availability, not booked, not past) can be taken
+        if not slots.is_free(doctor_id, appointment_date, appointment_time):
+            flash(_slot_taken_message(suggest_slots(doctor_id, appointment_date, appointment_time)), 'danger')
             return redirect(url_for('patient.book_appointment', doctor_id=doctor_id))
+        
+        # The unique index on active slots rejects double bookings
+        try:
+            book_slot(patient.id, doctor_id, appointment_date, appointment_time,
+                      reason=reason if reason else None)
+        except SlotUnavailable as e:
+            flash(_slot_taken_message(e.alternatives), 'danger')
+            return redirect(url_for('patient.book_appointment', doctor_id=doctor_id))
+        
+        flash(f'Appointment booked successfully with Dr. {doctor.name} on {appointment_date.strftime("%d %b %Y")} at {appointment_time.strftime("%I:%M %p")}.', 'success')
+        return redirect(url_for('patient.appointments'))
     
-    return render_template('patient/book_appointment.html', doctor=doctor)
+    return render_template('patient/book_appointment.html',
+                         doctor=doctor,
+                         free_slots=slots.doctor_free_slots(doctor_id),
+                         selected_slot=request.args.get('slot'))
 
 @bp.route('/appointments')
 @login_required
 @patient_required
 def appointments():
-    patient = Patient.query.filter_by(user_id=current_user.id).first()
+    patient = current_profile()
     
     # Get filter parameter
     status_filter = request.args.get('status')
     
-    query = Appointment.query.filter_by(patient_id=patient.id)
-    
-    if status_filter:
-        query = query.filter_by(status=status_filter)
+    def build(model):
+        query = model.query.options(
+            joinedload(model.doctor).joinedload(Doctor.specialization)
+        ).filter_by(patient_id=patient.id)
+        if status_filter:
+            query = query.filter_by(status=status_filter)
+        return query
     
-    appointments = query.order_by(
-        Appointment.appointment_date.desc(),
-        Appointment.appointment_time.desc()
-    ).all()
+    # Old closed appointments live in the archive tables
+    page = archive.appointment_page(build)
     
-    return render_template('patient/appointments.html', appointments=appointments)
+    return render_template('patient/appointments.html', appointments=page.items, page=page)
 
 @bp.route('/appointment/<int:id>/cancel', methods=['POST'])
 @login_required
 @patient_required
 def cancel_appointment(id):
-    patient = Patient.query.filter_by(user_id=current_user.id).first()
+    patient = current_profile()
     appointment = Appointment.query.get_or_404(id)
     
     # Verify this appointment belongs to current patient
@@ -186,7 +190,7 @@ def cancel_appointment(id):
 @login_required
 @patient_required
 def reschedule_appointment(id):
-    patient = Patient.query.filter_by(user_id=current_user.id).first()
+    patient = current_profile()
     appointment = Appointment.query.get_or_404(id)
     
     # Verify this appointment belongs to current patient
@@ -200,58 +204,46 @@ def reschedule_appointment(id):
         return redirect(url_for('patient.appointments'))
     
     if request.method == 'POST':
-        new_date_str = request.form.get('appointment_date')
-        new_time_str = request.form.get('appointment_time')
-        
         try:
-            new_date = datetime.strptime(new_date_str, '%Y-%m-%d').date()
-            new_time = datetime.strptime(new_time_str, '%H:%M').time()
-            
-            # Validate date is not in the past
-            if new_date < date.today():
-                flash('Cannot reschedule to a past date.', 'danger')
-                return redirect(url_for('patient.reschedule_appointment', id=id))
-            
-            # Check if new slot is available
-            existing = Appointment.query.filter_by(
-                doctor_id=appointment.doctor_id,
-                appointment_date=new_date,
-                appointment_time=new_time,
-                status='Booked'
-            ).filter(Appointment.id != id).first()
-            
-            if existing:
-                flash('This time slot is already booked. Please choose another time.', 'danger')
-                return redirect(url_for('patient.reschedule_appointment', id=id))
-            
-            # Update appointment
-            appointment.appointment_date = new_date
-            appointment.appointment_time = new_time
-            db.session.commit()
-            
-            flash('Appointment rescheduled successfully.', 'success')
-            return redirect(url_for('patient.appointments'))
-            
+            new_date, new_time = _parse_slot(request.form.get('slot'))
         except ValueError:
-            flash('Invalid date or time format.', 'danger')
+            flash('Please choose one of the available slots.', 'danger')
+            return redirect(url_for('patient.reschedule_appointment', id=id))
+        
+        # The appointment's own slot counts as free while moving it
+        if not slots.is_free(appointment.doctor_id, new_date, new_time,
+                             exclude_appointment_id=appointment.id):
+            flash(_slot_taken_message(suggest_slots(appointment.doctor_id, new_date, new_time)), 'danger')
+            return redirect(url_for('patient.reschedule_appointment', id=id))
+        
+        # Move the appointment; the unique index rejects a taken slot
+        try:
+            reschedule_slot(appointment, new_date, new_time)
+        except SlotUnavailable as e:
+            flash(_slot_taken_message(e.alternatives), 'danger')
             return redirect(url_for('patient.reschedule_appointment', id=id))
+        
+        flash('Appointment rescheduled successfully.', 'success')
+        return redirect(url_for('patient.appointments'))
     
+    current_slot = f"{appointment.appointment_date.isoformat()}T{appointment.appointment_time.strftime('%H:%M')}"
     return render_template('patient/book_appointment.html', 
                          doctor=appointment.doctor, 
                          appointment=appointment,
+                         free_slots=slots.doctor_free_slots(appointment.doctor_id,
+                                                            exclude_appointment_id=appointment.id),
+                         selected_slot=current_slot,
                          reschedule=True)
 
 @bp.route('/history')
 @login_required
 @patient_required
 def history():
-    patient = Patient.query.filter_by(user_id=current_user.id).first()
+    patient = current_profile()
     
     # Get all completed appointments with treatments
-    treatments = Treatment.query.join(Appointment).filter(
-        Appointment.patient_id == patient.id,
-        Appointment.status == 'Completed'
-    ).order_by(Appointment.appointment_date.desc()).all()
+    # including those moved to the archive tables
+    treatments = archive.treatment_history(patient.id)
     
     return render_template('patient/history.html', treatments=treatments)
 
@@ -259,7 +251,7 @@ def history():
 @login_required
 @patient_required
 def profile():
-    patient = Patient.query.filter_by(user_id=current_user.id).first()
+    patient = current_profile()
     
     if request.method == 'POST':
         # Update patient information
@@ -281,25 +273,20 @@ def profile():
 @login_required
 @patient_required
 def view_doctor(doctor_id):
-    """View doctor profile and available slots"""
+    """View doctor profile and free slots"""
     doctor = Doctor.query.get_or_404(doctor_id)
     
-    # Get doctor availability for next 7 days
-    today = date.today()
-    week_end = today + timedelta(days=6)
-    availabilities = Availability.query.filter_by(doctor_id=doctor_id, is_available=True).filter(
-        Availability.date >= today,
-        Availability.date <= week_end
-    ).order_by(Availability.date, Availability.start_time).all()
+    # Availability windows minus booked appointments, for the booking window
+    free_slots = slots.doctor_free_slots(doctor_id)
     
-    return render_template('patient/doctor_profile.html', doctor=doctor, availabilities=availabilities)
+    return render_template('patient/doctor_profile.html', doctor=doctor, free_slots=free_slots)
 
 @bp.route('/search', methods=['GET', 'POST'])
 @login_required
 @patient_required
 def search_by_specialization():
     """Search doctors by specialization"""
-    specializations = Specialization.query.all()
+    specializations = reference_data.specializations()
     doctors = []
     selected_spec_id = None
     
@@ -307,13 +294,87 @@ def search_by_specialization():
         spec_id = request.form.get('specialization_id')
         if spec_id:
             selected_spec_id = int(spec_id)
-            doctors = Doctor.query.filter_by(specialization_id=selected_spec_id).all()
+            doctors = reference_data.doctors_by_specialization(selected_spec_id)
     elif request.args.get('spec_id'):
         spec_id = request.args.get('spec_id')
         selected_spec_id = int(spec_id)
-        doctors = Doctor.query.filter_by(specialization_id=selected_spec_id).all()
+        doctors = reference_data.doctors_by_specialization(selected_spec_id)
     
     return render_template('patient/search_results.html', 
                          specializations=specializations, 
                          doctors=doctors, 
                          selected_spec_id=selected_spec_id)
+
+def _earliest_slots(specialization_id, limit):
+    """(doctor entry, date, time) for the earliest free slots in a specialization"""
+    directory = reference_data.doctors_by_id()
+    return [
+        (directory[doctor_id], slot_date, slot_time)
+        for doctor_id, slot_date, slot_time in next_slots.earliest(specialization_id, limit)
+        if doctor_id in directory
+    ]
+
+@bp.route('/earliest-available')
+@login_required
+@patient_required
+def earliest_available():
+    """First free slots across all doctors of a specialization"""
+    specializations = reference_data.specializations()
+    spec_id = request.args.get('specialization_id', type=int)
+    limit = request.args.get('limit', next_slots.max_limit(), type=int)
+    if not 1 <= limit <= next_slots.max_limit():
+        limit = max(1, min(limit, next_slots.max_limit()))
+        flash(f'Showing up to {limit} slots (between 1 and {next_slots.max_limit()} can be listed)', 'info')
+    results = _earliest_slots(spec_id, limit) if spec_id else []
+    
+    return render_template('patient/earliest_available.html',
+                         specializations=specializations,
+                         selected_spec_id=spec_id,
+                         results=results)
+
+@bp.route('/earliest-available.json')
+@login_required
+@patient_required
+def earliest_available_json():
+    spec_id = request.args.get('specialization_id', type=int)
+    if not spec_id:
+        return jsonify({'error': 'specialization_id is required'}), 400
+    limit = request.args.get('limit', next_slots.max_limit(), type=int)
+    if not 1 <= limit <= next_slots.max_limit():
+        return jsonify({'error': f'limit must be between 1 and {next_slots.max_limit()}'}), 400
+    results = _earliest_slots(spec_id, limit)
+    return jsonify([
+        {
+            'doctor_id': doctor.id,
+            'doctor_name': doctor.name,
+            'date': slot_date.isoformat(),
+            'time': slot_time.strftime('%H:%M'),
+            'book_url': url_for('patient.book_appointment', doctor_id=doctor.id,
+                                slot=f"{slot_date.isoformat()}T{slot_time.strftime('%H:%M')}")
+        }
+        for doctor, slot_date, slot_time in results
+    ])
+
+@bp.route('/doctor/<int:doctor_id>/slot-events')
+@login_required
+@patient_required
+def slot_event_stream(doctor_id):
+    """Server-sent slot-taken/slot-freed events for the booking window"""
+    config = current_app.config
+    start = date.today()
+    channels = [slot_events.channel(doctor_id, start + timedelta(days=offset))
+                for offset in range(config.get('BOOKING_WINDOW_DAYS', 7))]
+    broker = slot_events.get_broker()
+    try:
+        subscription = broker.subscribe(channels)
+    except slot_events.SubscribersFull:
+        return jsonify({'error': 'Too many live updates open, please retry shortly'}), 503, {'Retry-After': '10'}
+    
+    # The stream runs after the request ends and holds no database connection
+    return Response(
+        slot_events.stream(broker, subscription,
+                           heartbeat=config.get('SLOT_EVENTS_HEARTBEAT', 15),
+                           lifetime=config.get('SLOT_EVENTS_STREAM_SECONDS', 300)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
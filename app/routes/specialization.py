@@ -1,6 +1,7 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash
 from flask_login import login_required, current_user
 from functools import wraps
+from app import reference_data
 from app.models import Specialization, db
 
 bp = Blueprint('specialization', __name__, url_prefix='/admin')
@@ -20,7 +21,8 @@ def admin_required(f):
 @login_required
 @admin_required
 def specializations():
-    specs = Specialization.query.all()
+    # Cached list with doctor counts
+    specs = reference_data.specializations()
     return render_template('admin/specializations.html', specializations=specs)
 
 # Add new specialization
@@ -44,6 +46,7 @@ def add_specialization():
         spec = Specialization(name=name, description=description)
         db.session.add(spec)
         db.session.commit()
+        reference_data.invalidate()
         flash(f'Specialization "{name}" added successfully!', 'success')
         return redirect(url_for('specialization.specializations'))
     
@@ -72,6 +75,7 @@ def edit_specialization(id):
         spec.name = name
         spec.description = description
         db.session.commit()
+        reference_data.invalidate()
         flash(f'Specialization "{name}" updated successfully!', 'success')
         return redirect(url_for('specialization.specializations'))
     
@@ -91,5 +95,6 @@ def delete_specialization(id):
     name = spec.name
     db.session.delete(spec)
     db.session.commit()
+    reference_data.invalidate()
     flash(f'Specialization "{name}" deleted successfully!', 'success')
     return redirect(url_for('specialization.specializations'))
@@ -0,0 +1,346 @@
+"""Full-text search over doctors and patients.
+
+Search documents live in side tables keyed by the profile id:
+SQLite uses FTS5 virtual tables, PostgreSQL uses tsvector columns with a
+GIN index. Any other backend falls back to LIKE. The documents are
+refreshed in the same transaction as the change, from an after_flush hook,
+with set-based INSERT ... SELECT statements.
+
+Queries are split into words and every word is matched as a prefix, so
+"car jo" finds "Dr. John Carter". Ranked results put name matches first,
+then phone/email, then specialization/bio.
+"""
+import logging
+import re
+import time
+from sqlalchemy import bindparam, event, inspect, or_, select, text, Integer
+from sqlalchemy.orm import Session
+from app import db
+from app.models import Doctor, Patient, Specialization, User
+
+logger = logging.getLogger(__name__)
+
+MAX_TERMS = 8
+
+# Document columns, shared by every backend
+_DOCTOR_DOCUMENT = """
+    SELECT d.id AS id,
+           d.name AS name,
+           COALESCE(d.phone, '') || ' ' || u.email AS contact,
+           COALESCE(s.name, '') || ' ' || COALESCE(d.bio, '') AS extra
+    FROM doctors d
+    JOIN users u ON u.id = d.user_id
+    LEFT JOIN specializations s ON s.id = d.specialization_id
+"""
+
+_PATIENT_DOCUMENT = """
+    SELECT p.id AS id,
+           p.name AS name,
+           COALESCE(p.phone, '') || ' ' || u.email AS contact,
+           '' AS extra
+    FROM patients p
+    JOIN users u ON u.id = p.user_id
+"""
+
+_DOCUMENTS = {'doctor': _DOCTOR_DOCUMENT, 'patient': _PATIENT_DOCUMENT}
+
+
+def _terms(query):
+    return re.findall(r'\w+', query.lower())[:MAX_TERMS]
+
+
+def _in_specialization(id_column, specialization_id):
+    """Condition limiting ranked doctor ids to a specialization, before the LIMIT"""
+    if specialization_id is None:
+        return ''
+    return f'AND {id_column} IN (SELECT id FROM doctors WHERE specialization_id = :specialization_id) '
+
+
+class _SqliteBackend:
+    name = 'fts5'
+
+    def create(self, connection):
+        for kind in _DOCUMENTS:
+            connection.exec_driver_sql(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {kind}_search "
+                f"USING fts5(name, contact, extra, "
+                f"tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+            )
+
+    def exists(self, connection):
+        return inspect(connection).has_table('doctor_search')
+
+    def delete(self, connection, kind, ids):
+        connection.execute(
+            text(f'DELETE FROM {kind}_search WHERE rowid IN :ids')
+            .bindparams(bindparam('ids', expanding=True)),
+            {'ids': list(ids)}
+        )
+
+    def insert(self, connection, kind, where='', params=None):
+        connection.execute(
+            text(f'INSERT INTO {kind}_search (rowid, name, contact, extra) '
+                 f'SELECT id, name, contact, extra FROM ({_DOCUMENTS[kind]} {where})'),
+            params or {}
+        )
+
+    def clear(self, connection, kind):
+        connection.exec_driver_sql(f'DELETE FROM {kind}_search')
+
+    def optimize(self, connection, kind):
+        connection.exec_driver_sql(f"INSERT INTO {kind}_search ({kind}_search) VALUES ('optimize')")
+
+    def _match(self, terms):
+        return ' '.join(f'"{term}"*' for term in terms)
+
+    def matching_ids(self, kind, terms):
+        return text(
+            f'SELECT rowid AS id FROM {kind}_search WHERE {kind}_search MATCH :match'
+        ).bindparams(match=self._match(terms)).columns(id=Integer)
+
+    def ranked_ids(self, kind, terms, limit, specialization_id=None):
+        rows = db.session.execute(
+            text(f'SELECT rowid FROM {kind}_search WHERE {kind}_search MATCH :match '
+                 f'{_in_specialization("rowid", specialization_id)}'
+                 f'ORDER BY bm25({kind}_search, 10.0, 5.0, 1.0) LIMIT :limit'),
+            {'match': self._match(terms), 'limit': limit, 'specialization_id': specialization_id}
+        )
+        return [row[0] for row in rows]
+
+
+class _PostgresBackend:
+    name = 'tsvector'
+
+    def create(self, connection):
+        for kind in _DOCUMENTS:
+            connection.exec_driver_sql(
+                f'CREATE TABLE IF NOT EXISTS {kind}_search ('
+                f'  id integer PRIMARY KEY,'
+                f'  document tsvector NOT NULL)'
+            )
+            connection.exec_driver_sql(
+                f'CREATE INDEX IF NOT EXISTS ix_{kind}_search_document '
+                f'ON {kind}_search USING gin (document)'
+            )
+
+    def exists(self, connection):
+        return inspect(connection).has_table('doctor_search')
+
+    def delete(self, connection, kind, ids):
+        connection.execute(
+            text(f'DELETE FROM {kind}_search WHERE id IN :ids')
+            .bindparams(bindparam('ids', expanding=True)),
+            {'ids': list(ids)}
+        )
+
+    def insert(self, connection, kind, where='', params=None):
+        connection.execute(
+            text(f"INSERT INTO {kind}_search (id, document) "
+                 f"SELECT id, setweight(to_tsvector('simple', name), 'A') || "
+                 f"setweight(to_tsvector('simple', contact), 'B') || "
+                 f"setweight(to_tsvector('simple', extra), 'C') "
+                 f"FROM ({_DOCUMENTS[kind]} {where}) AS documents"),
+            params or {}
+        )
+
+    def clear(self, connection, kind):
+        connection.exec_driver_sql(f'TRUNCATE {kind}_search')
+
+    def optimize(self, connection, kind):
+        pass
+
+    def _tsquery(self, terms):
+        return ' & '.join(f'{term}:*' for term in terms)
+
+    def matching_ids(self, kind, terms):
+        return text(
+            f"SELECT id FROM {kind}_search "
+            f"WHERE document @@ to_tsquery('simple', :tsquery)"
+        ).bindparams(tsquery=self._tsquery(terms)).columns(id=Integer)
+
+    def ranked_ids(self, kind, terms, limit, specialization_id=None):
+        rows = db.session.execute(
+            text(f"SELECT id FROM {kind}_search, to_tsquery('simple', :tsquery) AS q "
+                 f"WHERE document @@ q {_in_specialization('id', specialization_id)}"
+                 f"ORDER BY ts_rank(document, q) DESC LIMIT :limit"),
+            {'tsquery': self._tsquery(terms), 'limit': limit, 'specialization_id': specialization_id}
+        )
+        return [row[0] for row in rows]
+
+
+class _LikeBackend:
+    """Fallback for databases without a full-text engine"""
+    name = 'like'
+
+    def create(self, connection):
+        pass
+
+    def exists(self, connection):
+        return False
+
+    def matching_ids(self, kind, terms):
+        if kind == 'doctor':
+            statement = select(Doctor.id).join(Doctor.user).outerjoin(Doctor.specialization)
+            columns = (Doctor.name, Doctor.phone, User.email, Specialization.name, Doctor.bio)
+        else:
+            statement = select(Patient.id).join(Patient.user)
+            columns = (Patient.name, Patient.phone, User.email)
+        for term in terms:
+            statement = statement.where(or_(*[column.contains(term) for column in columns]))
+        return statement
+
+    def ranked_ids(self, kind, terms, limit, specialization_id=None):
+        statement = self.matching_ids(kind, terms)
+        if specialization_id is not None:
+            statement = statement.where(Doctor.specialization_id == specialization_id)
+        return list(db.session.scalars(statement.limit(limit)))
+
+
+_BACKENDS = {'sqlite': _SqliteBackend(), 'postgresql': _PostgresBackend()}
+_LIKE = _LikeBackend()
+
+# Whether each engine (by url) has the search tables: True, or the time a check found none
+_ready = {}
+RECHECK_SECONDS = 30  # reads look again for missing tables this often
+
+
+def _backend(connection):
+    return _BACKENDS.get(connection.dialect.name, _LIKE)
+
+
+def _is_ready(connection, writing=False):
+    """Whether the search tables exist. Found tables are remembered for good;
+    missing ones are looked for again by every write (so no change is lost
+    once another process creates them) and by reads every RECHECK_SECONDS.
+    """
+    key = str(connection.engine.url)
+    checked = _ready.get(key)
+    if checked is True:
+        return True
+    if checked is not None and not writing and time.monotonic() - checked < RECHECK_SECONDS:
+        return False
+    if _backend(connection).exists(connection):
+        _ready[key] = True
+        return True
+    if checked is None or time.monotonic() - checked >= RECHECK_SECONDS:
+        if connection.dialect.name in _BACKENDS:
+            logger.warning('Search tables are missing, run `flask rebuild-search-index`')
+        _ready[key] = time.monotonic()
+    return False
+
+
+def _active_backend(terms):
+    if not terms:
+        return _LIKE
+    connection = db.session.connection()
+    return _backend(connection) if _is_ready(connection) else _LIKE
+
+
+def doctor_ids(query):
+    """Selectable of doctor ids matching every word of `query` (use with .in_())"""
+    terms = _terms(query)
+    return _active_backend(terms).matching_ids('doctor', terms)
+
+
+def patient_ids(query):
+    """Selectable of patient ids matching every word of `query` (use with .in_())"""
+    terms = _terms(query)
+    return _active_backend(terms).matching_ids('patient', terms)
+
+
+def ranked_doctor_ids(query, limit=100, specialization_id=None):
+    """Doctor ids matching `query`, best match first, optionally in one specialization"""
+    terms = _terms(query)
+    if not terms:
+        return []
+    return _active_backend(terms).ranked_ids('doctor', terms, limit, specialization_id)
+
+
+def refresh(connection, kind, ids=(), deleted=(), where_ids=None):
+    """Re-index the given profiles on `connection`.
+
+    `ids` are profile ids to rebuild, `deleted` are ids whose document should
+    only be dropped. `where_ids` maps extra columns (user_id, specialization_id)
+    to ids, for changes to rows the document is built from.
+    """
+    backend = _backend(connection)
+    if backend is _LIKE or not _is_ready(connection, writing=True):
+        return
+
+    table = 'doctors' if kind == 'doctor' else 'patients'
+    clauses = ['id IN :ids']
+    params = {'ids': list(ids)}
+    for column, values in (where_ids or {}).items():
+        clauses.append(f'{column} IN :{column}')
+        params[column] = list(values)
+
+    statement = text(f"SELECT id FROM {table} WHERE {' OR '.join(clauses)}").bindparams(
+        *[bindparam(name, expanding=True) for name in params]
+    )
+    affected = {row[0] for row in connection.execute(statement, params)}
+    if affected or deleted:
+        backend.delete(connection, kind, affected | set(deleted))
+    if affected:
+        # Ids come from the database, so they can be inlined; chunk to keep statements short
+        prefix = 'd' if kind == 'doctor' else 'p'
+        ordered = sorted(affected)
+        for start in range(0, len(ordered), 500):
+            chunk = ', '.join(str(int(i)) for i in ordered[start:start + 500])
+            backend.insert(connection, kind, where=f'WHERE {prefix}.id IN ({chunk})')
+
+
+def rebuild(connection):
+    """Create the search tables if needed and re-index every profile"""
+    backend = _backend(connection)
+    backend.create(connection)
+    _ready.pop(str(connection.engine.url), None)
+    if backend is _LIKE:
+        return backend.name
+    for kind in _DOCUMENTS:
+        backend.clear(connection, kind)
+        backend.insert(connection, kind)
+        backend.optimize(connection, kind)
+    return backend.name
+
+
+def _sync_after_flush(session, flush_context):
+    changed = {'doctor': set(), 'patient': set()}
+    deleted = {'doctor': set(), 'patient': set()}
+    user_ids, specialization_ids = set(), set()
+
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Doctor):
+            changed['doctor'].add(obj.id)
+        elif isinstance(obj, Patient):
+            changed['patient'].add(obj.id)
+        elif isinstance(obj, User) and obj in session.dirty:
+            user_ids.add(obj.id)
+        elif isinstance(obj, Specialization) and obj in session.dirty:
+            specialization_ids.add(obj.id)
+    for obj in session.deleted:
+        if isinstance(obj, Doctor):
+            deleted['doctor'].add(obj.id)
+        elif isinstance(obj, Patient):
+            deleted['patient'].add(obj.id)
+
+    if not (any(changed.values()) or any(deleted.values()) or user_ids or specialization_ids):
+        return
+
+    connection = session.connection()
+    refresh(connection, 'doctor', changed['doctor'], deleted['doctor'],
+            {'user_id': user_ids, 'specialization_id': specialization_ids})
+    refresh(connection, 'patient', changed['patient'], deleted['patient'],
+            {'user_id': user_ids})
+
+
+def _create_tables(metadata, connection, **kw):
+    _backend(connection).create(connection)
+    _ready.pop(str(connection.engine.url), None)
+
+
+def init_app(app):
+    """Keep the search documents in sync and create them with db.create_all()"""
+    if not event.contains(Session, 'after_flush', _sync_after_flush):
+        event.listen(Session, 'after_flush', _sync_after_flush)
+    if not event.contains(db.metadata, 'after_create', _create_tables):
+        event.listen(db.metadata, 'after_create', _create_tables)
@@ -0,0 +1,331 @@
+"""Deterministic bulk data generator (flask seed, seed.py).
+
+Creates the admin account and any number of specializations, doctors,
+patients, availability windows and appointments with treatments. The rows
+depend only on the plan: each block of BLOCK ids draws from its own random
+generator seeded with (seed, table, block), so any range of rows can be
+regenerated on its own, in any process.
+
+Rows go in with Core executemany inserts, `batch_size` ids per
+transaction. Passwords are hashed once per role (every doctor shares
+PASSWORDS['doctor'], ...), not once per user.
+
+Progress is the highest id in each table. A run that was interrupted and
+is started again with the same options regenerates the last row it finds,
+checks that it matches, and continues after it; with other options it
+stops instead of mixing two datasets. The derived tables (counters,
+search index, next free slots, rosters) are rebuilt once at the end.
+
+Ids are fixed: user 1 is the admin, doctor i is user 1 + i, patient j is
+user 1 + doctors + j, and a treatment has the id of its appointment.
+Appointments take distinct (doctor, weekday, time) slots within the
+availability hours, so booked slots never collide.
+"""
+import random
+from collections import OrderedDict
+from datetime import date, datetime, time, timedelta
+from math import gcd
+from flask import current_app
+from sqlalchemy import func, inspect, select
+from werkzeug.security import generate_password_hash
+from app import counters, db, next_slots, passwords, reference_data, roster, search
+from app.models import Admin, Appointment, Availability, Doctor, Patient, Specialization, Treatment, User
+
+BLOCK = 1000
+ADMIN_EMAIL = 'admin@hospital.com'
+PASSWORDS = {'admin': 'admin123', 'doctor': 'doctor123', 'patient': 'patient123'}
+DAY_START, DAY_END = time(9), time(17)
+
+SPECIALIZATIONS = ('General Medicine', 'Cardiology', 'Dermatology', 'Neurology', 'Orthopedics',
+                   'Pediatrics', 'Psychiatry', 'Radiology', 'Gynecology', 'Oncology',
+                   'Ophthalmology', 'ENT')
+FIRST_NAMES = ('Aarav', 'Priya', 'Rohan', 'Ananya', 'Vikram', 'Meera', 'Arjun', 'Kavya', 'Sanjay',
+               'Divya', 'Rahul', 'Isha', 'Karan', 'Neha', 'Aditya', 'Pooja', 'Nikhil', 'Sneha')
+LAST_NAMES = ('Sharma', 'Patel', 'Reddy', 'Iyer', 'Gupta', 'Nair', 'Singh', 'Khan', 'Das', 'Menon',
+              'Joshi', 'Rao', 'Verma', 'Bose', 'Kapoor', 'Mehta')
+REASONS = ('Follow-up', 'Chest pain', 'Skin rash', 'Headache', 'Knee pain', 'Fever', 'Anxiety',
+           'Back pain', 'Breathlessness', 'Routine check-up')
+DIAGNOSES = ('Hypertension', 'Migraine', 'Eczema', 'Fracture', 'Influenza', 'Generalized anxiety',
+             'Lumbar strain', 'Asthma', 'Type 2 diabetes', 'No abnormality found')
+
+
+def email(role, number):
+    """Login of the `number`-th (1-based) generated doctor or patient"""
+    return f'{role}{number}@hospital.com'
+
+
+class SeedPlan:
+    """What to generate; everything else follows from these values"""
+
+    def __init__(self, specializations=8, doctors=5, patients=10, appointments=40,
+                 history_days=365, future_days=14, seed=42, today=None, slot_minutes=None):
+        self.specializations = specializations
+        self.doctors = doctors
+        self.patients = patients
+        self.appointments = appointments
+        self.history_days = history_days
+        self.future_days = future_days
+        self.seed = seed
+        self.today = today or date.today()
+        self.slot_minutes = slot_minutes or current_app.config.get('APPOINTMENT_SLOT_MINUTES', 30)
+        self.created_at = datetime.combine(self.today - timedelta(days=history_days + 30), time(8))
+
+        start = self.today - timedelta(days=history_days)
+        days = (start + timedelta(days=offset) for offset in range(history_days + future_days))
+        self.workdays = [day for day in days if day.weekday() < 5]
+        self.upcoming = [day for day in self.workdays if day >= self.today]
+        self.times = []
+        moment = datetime.combine(self.today, DAY_START)
+        while moment.time() < DAY_END:
+            self.times.append(moment.time())
+            moment += timedelta(minutes=self.slot_minutes)
+
+        # Appointment n takes slot (offset + n * stride) % capacity: a
+        # permutation of all slots, spread over doctors and days
+        self.capacity = doctors * len(self.workdays) * len(self.times)
+        self.offset = random.Random(f'{seed}:offset').randrange(self.capacity) if self.capacity else 0
+        self.stride = int(self.capacity * 0.6180339887) | 1
+        while self.capacity and gcd(self.stride, self.capacity) != 1:
+            self.stride += 2
+
+    def validate(self):
+        if self.doctors and not self.specializations:
+            raise ValueError('doctors need at least one specialization')
+        if self.appointments and not (self.doctors and self.patients):
+            raise ValueError('appointments need doctors and patients')
+        if self.appointments > self.capacity:
+            raise ValueError(f'{self.appointments} appointments do not fit in the {self.capacity} slots of '
+                             f'{self.doctors} doctors over {len(self.workdays)} weekdays; '
+                             'add doctors or history days')
+
+
+class SeedReport:
+    def __init__(self):
+        self.admin_created = False
+        self.inserted = OrderedDict()  # phase -> rows written by this run
+        self.existing = OrderedDict()  # phase -> rows found from an earlier run
+
+
+# Rows per id; each returns [(table, row), ...]
+
+def _name(rng):
+    return f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+
+
+def _specialization(plan, number, rng):
+    if number <= len(SPECIALIZATIONS):
+        name = SPECIALIZATIONS[number - 1]
+    else:
+        name = f'Specialty {number}'
+    return [(Specialization.__table__, {'id': number, 'name': name, 'description': f'{name} department'})]
+
+
+def _doctor(plan, number, rng):
+    user_id = 1 + number
+    return [
+        (Doctor.__table__, {
+            'id': number, 'user_id': user_id, 'name': f'Dr. {_name(rng)}',
+            'specialization_id': rng.randint(1, plan.specializations),
+            'phone': f'98{rng.randint(10000000, 99999999)}', 'experience': rng.randint(1, 35),
+            'bio': f'Consultant with an interest in {rng.choice(DIAGNOSES).lower()}.', 'is_active': True,
+        }),
+        (User.__table__, {'id': user_id, 'email': email('doctor', number), 'role': 'doctor',
+                          'created_at': plan.created_at}),
+    ]
+
+
+def _patient(plan, number, rng):
+    user_id = 1 + plan.doctors + number
+    return [
+        (Patient.__table__, {
+            'id': number, 'user_id': user_id, 'name': _name(rng),
+            'phone': f'97{rng.randint(10000000, 99999999)}',
+            'date_of_birth': date(1940, 1, 1) + timedelta(days=rng.randint(0, 30000)),
+            'address': f'{rng.randint(1, 400)} MG Road', 'medical_history': None,
+        }),
+        (User.__table__, {'id': user_id, 'email': email('patient', number), 'role': 'patient',
+                          'created_at': plan.created_at}),
+    ]
+
+
+def _availability(plan, number, rng):
+    doctor_index, day_index = divmod(number - 1, len(plan.upcoming))
+    return [(Availability.__table__, {
+        'id': number, 'doctor_id': doctor_index + 1, 'date': plan.upcoming[day_index],
+        'start_time': DAY_START, 'end_time': DAY_END, 'is_available': True,
+    })]
+
+
+def _appointment(plan, number, rng):
+    slot = (plan.offset + (number - 1) * plan.stride) % plan.capacity
+    slot, doctor_index = divmod(slot, plan.doctors)
+    day_index, time_index = divmod(slot, len(plan.times))
+    day, moment = plan.workdays[day_index], plan.times[time_index]
+    booked_at = datetime.combine(day - timedelta(days=rng.randint(1, 30)), time(rng.randint(8, 20)))
+    draw = rng.random()
+    if day >= plan.today:
+        status = 'Cancelled' if draw < 0.1 else 'Booked'
+    else:
+        status = 'Completed' if draw < 0.8 else 'Cancelled'
+    rows = [(Appointment.__table__, {
+        'id': number, 'patient_id': rng.randint(1, plan.patients), 'doctor_id': doctor_index + 1,
+        'appointment_date': day, 'appointment_time': moment, 'status': status,
+        'reason': rng.choice(REASONS), 'created_at': booked_at,
+    })]
+    diagnosis = rng.choice(DIAGNOSES)
+    if status == 'Completed':
+        rows.append((Treatment.__table__, {
+            'id': number, 'appointment_id': number, 'diagnosis': diagnosis,
+            'prescription': 'As discussed', 'notes': None,
+            'created_at': datetime.combine(day, moment),
+        }))
+    return rows
+
+
+# (phase, its table, row function, number of rows)
+PHASES = (
+    ('specializations', Specialization.__table__, _specialization, lambda plan: plan.specializations),
+    ('doctors', Doctor.__table__, _doctor, lambda plan: plan.doctors),
+    ('patients', Patient.__table__, _patient, lambda plan: plan.patients),
+    ('availability', Availability.__table__, _availability, lambda plan: plan.doctors * len(plan.upcoming)),
+    ('appointments', Appointment.__table__, _appointment, lambda plan: plan.appointments),
+)
+
+
+# Tables a phase writes besides its own
+EXTRA_TABLES = {
+    'doctors': (User.__table__,),
+    'patients': (User.__table__,),
+    'appointments': (Treatment.__table__,),
+}
+
+
+def _last_user_id(plan, phase, done):
+    """Highest user id while `done` rows of the phase are written"""
+    if phase == 'doctors':
+        return 1 + done
+    return 1 + plan.doctors + done
+
+
+def _generate(plan, phase, make, start, stop):
+    """{table: rows} for ids start + 1 .. stop, in insert order"""
+    rows = OrderedDict()
+    for block in range(start // BLOCK, (stop - 1) // BLOCK + 1):
+        rng = random.Random(f'{plan.seed}:{phase}:{block}')
+        for number in range(block * BLOCK + 1, min((block + 1) * BLOCK, stop) + 1):
+            made = make(plan, number, rng)
+            if number > start:
+                # Users before the profiles that reference them
+                for table, row in sorted(made, key=lambda item: item[0] is not User.__table__):
+                    rows.setdefault(table, []).append(row)
+    return rows
+
+
+def _check(connection, plan, phase, table, make, number):
+    """Raise unless row `number` of the phase is the one this plan generates"""
+    expected = _generate(plan, phase, make, number - 1, number)[table][0]
+    found = connection.execute(select(table).where(table.c.id == number)).mappings().first()
+    if found is None or any(found[key] != value for key, value in expected.items()):
+        raise ValueError(f'{phase}: the rows in the database were not generated with these options; '
+                         'use the options of the earlier run (including --seed and --today) '
+                         'or an empty database')
+
+
+def _seed_admin(plan, hashes, report):
+    with db.engine.begin() as connection:
+        admin_user_id = connection.scalar(select(User.id).where(User.email == ADMIN_EMAIL))
+        last_user_id = connection.scalar(select(func.max(User.id)))
+        if admin_user_id is None and last_user_id is not None and (plan.doctors or plan.patients):
+            raise ValueError('the database already has users; seed an empty database')
+        if admin_user_id is not None and admin_user_id != 1 and (plan.doctors or plan.patients):
+            raise ValueError(f'{ADMIN_EMAIL} is not user 1; seed an empty database')
+        if admin_user_id is None:
+            user = {'email': ADMIN_EMAIL, 'password_hash': hashes['admin'], 'role': 'admin',
+                    'created_at': plan.created_at}
+            if last_user_id is None:
+                user['id'] = 1
+            admin_user_id = connection.execute(User.__table__.insert(), user).inserted_primary_key[0]
+            connection.execute(Admin.__table__.insert(),
+                               {'user_id': admin_user_id, 'name': 'System Administrator'})
+            report.admin_created = True
+
+
+def seed(plan, batch_size=None, on_progress=None):
+    """Write the plan's rows, resuming an earlier run; returns a SeedReport"""
+    plan.validate()
+    batch_size = batch_size or current_app.config.get('SEED_BATCH_SIZE', 10000)
+    hash_method = passwords.method()
+    hashes = {role: generate_password_hash(password, hash_method) for role, password in PASSWORDS.items()}
+    report = SeedReport()
+
+    # Check every phase before writing anything
+    with db.engine.connect() as connection:
+        for phase, table, make, count in PHASES:
+            total = count(plan)
+            done = connection.scalar(select(func.max(table.c.id))) or 0
+            if done and total:
+                _check(connection, plan, phase, table, make, min(done, total))
+            # The user ids this phase has yet to write must be free
+            if phase in ('doctors', 'patients') and done < total:
+                if (connection.scalar(select(func.max(User.id))) or 0) > _last_user_id(plan, phase, done):
+                    raise ValueError(f'{phase}: there are users beyond the generated ones; '
+                                     'use the options of the earlier run or an empty database')
+            report.existing[phase] = done
+
+    _seed_admin(plan, hashes, report)
+    for phase, table, make, count in PHASES:
+        total, done = count(plan), report.existing[phase]
+        report.existing[phase] = min(done, total)
+        report.inserted[phase] = 0
+        if on_progress is not None:
+            on_progress(phase, min(done, total), total)
+
+        # A big load is much faster into bare tables; the indexes are built once afterwards
+        if total - done > max(done, batch_size):
+            with db.engine.begin() as connection:
+                for target in (table,) + EXTRA_TABLES.get(phase, ()):
+                    for index in target.indexes:
+                        index.drop(connection, checkfirst=True)
+
+        for start in range(done, total, batch_size):
+            stop = min(start + batch_size, total)
+            rows = _generate(plan, phase, make, start, stop)
+            if phase in ('doctors', 'patients'):
+                for row in rows[User.__table__]:
+                    row['password_hash'] = hashes[row['role']]
+            with db.engine.begin() as connection:
+                for target, batch in rows.items():
+                    connection.execute(target.insert(), batch)
+            report.inserted[phase] += stop - start
+            if on_progress is not None:
+                on_progress(phase, stop, total)
+
+    # Also those an interrupted run left dropped
+    missing = [
+        index
+        for phase, table, make, count in PHASES
+        for target in (table,) + EXTRA_TABLES.get(phase, ())
+        for index in sorted(target.indexes, key=lambda index: index.name)
+        if not inspect(db.engine).has_index(target.name, index.name)
+    ]
+    for number, index in enumerate(missing):
+        if on_progress is not None:
+            on_progress('indexes', number, len(missing))
+        with db.engine.begin() as connection:
+            index.create(connection)
+    if missing and on_progress is not None:
+        on_progress('indexes', len(missing), len(missing))
+
+    if any(report.inserted.values()):
+        if on_progress is not None:
+            on_progress('derived tables', 0, 1)
+        # Core inserts skip the flush hooks
+        with db.engine.begin() as connection:
+            counters.rebuild(connection)
+            search.rebuild(connection)
+            next_slots.rebuild(connection)
+            roster.rebuild(connection)
+        reference_data.invalidate()
+        if on_progress is not None:
+            on_progress('derived tables', 1, 1)
+    return report
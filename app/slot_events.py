@@ -0,0 +1,339 @@
+"""Live slot events for the doctor profile and booking pages.
+
+Events are published on one channel per doctor and day ('<doctor_id>:<date>'):
+
+    slot-taken              {doctor_id, date, time}   a slot was booked
+    slot-freed              {doctor_id, date, time}   a booking was cancelled,
+                                                      moved or deleted
+    availability-changed    {doctor_id, date}         windows were edited;
+                                                      re-read the free slots
+
+An after_flush hook collects them from appointment and availability
+changes and they are published after the transaction commits, so nobody
+hears about a booking that was rolled back. Core writes (template
+generation) queue theirs with `defer()`.
+
+Two brokers deliver them to the SSE streams (SLOT_EVENTS_BROKER):
+
+    'memory'    in-process fan-out; enough for a single worker process
+    'database'  events go through the `slot_events` table and a poller
+                thread in every process fans them out locally, so all
+                gunicorn workers (on any host sharing the database) see
+                every event. A stand-in for a real message broker.
+"""
+import itertools
+import json
+import os
+import queue
+import threading
+import time
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta
+from flask import current_app, has_app_context
+from sqlalchemy import delete, event, func, inspect, select
+from sqlalchemy.orm import Session
+from app import db
+from app.history import keep_previous
+from app.models import Appointment, Availability, SlotEvent
+
+Event = namedtuple('Event', 'id channel type data')
+
+_broker_lock = threading.Lock()
+
+
+class SubscribersFull(RuntimeError):
+    """This process already serves SLOT_EVENTS_MAX_SUBSCRIBERS streams"""
+
+
+def channel(doctor_id, day):
+    return f'{doctor_id}:{day.isoformat()}'
+
+
+class Subscription:
+
+    def __init__(self, channels, queue_size):
+        self.channels = frozenset(channels)
+        self.overflowed = False  # events were dropped; the client must re-read
+        self._queue = queue.Queue(maxsize=queue_size)
+
+    def put(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+
+    def get(self, timeout):
+        """The next event, or None after `timeout` seconds"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def drain(self):
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                return
+
+
+class MemoryBroker:
+    """Fan-out to the subscribers of this process"""
+
+    def __init__(self, queue_size=100, max_subscribers=8):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self._channels = defaultdict(set)
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.published = 0
+
+    def publish(self, events):
+        """Deliver [(channel, type, data), ...]"""
+        self._dispatch(Event(next(self._ids), *item) for item in events)
+
+    def _dispatch(self, events):
+        with self._lock:
+            for item in events:
+                self.published += 1
+                for subscription in self._channels.get(item.channel, ()):
+                    subscription.put(item)
+
+    def subscribe(self, channels):
+        with self._lock:
+            if len(self._subscriptions) >= self.max_subscribers:
+                raise SubscribersFull('Too many live slot streams')
+            subscription = Subscription(channels, self.queue_size)
+            self._subscriptions.add(subscription)
+            for name in subscription.channels:
+                self._channels[name].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+            for name in subscription.channels:
+                subscribers = self._channels.get(name)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._channels[name]
+
+    def stats(self):
+        with self._lock:
+            return {'broker': type(self).__name__, 'subscribers': len(self._subscriptions),
+                    'channels': len(self._channels), 'published': self.published}
+
+
+class DatabaseBroker(MemoryBroker):
+    """Publish through the slot_events table; every process polls it"""
+
+    def __init__(self, engine, poll_interval=1.0, retention=300, **kwargs):
+        super().__init__(**kwargs)
+        self.engine = engine
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self._poller = None
+        self._pid = None
+
+    def publish(self, events):
+        rows = [{'channel': name, 'type': kind, 'payload': json.dumps(data),
+                 'created_at': datetime.utcnow()}
+                for name, kind, data in events]
+        if rows:
+            with self.engine.begin() as connection:
+                connection.execute(SlotEvent.__table__.insert(), rows)
+
+    def subscribe(self, channels):
+        self._ensure_poller()
+        return super().subscribe(channels)
+
+    def _ensure_poller(self):
+        # Threads don't survive a fork: every worker process starts its own
+        with self._lock:
+            if self._poller is not None and self._poller.is_alive() and self._pid == os.getpid():
+                return
+            with self.engine.connect() as connection:
+                last_id = connection.scalar(select(func.max(SlotEvent.id))) or 0
+            self._pid = os.getpid()
+            self._poller = threading.Thread(target=self._poll, args=(last_id,),
+                                            name='slot-events-poller', daemon=True)
+            self._poller.start()
+
+    def _poll(self, last_id):
+        table = SlotEvent.__table__
+        next_cleanup = 0
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                with self.engine.begin() as connection:
+                    rows = connection.execute(
+                        select(table.c.id, table.c.channel, table.c.type, table.c.payload)
+                        .where(table.c.id > last_id).order_by(table.c.id)
+                    ).all()
+                    if time.monotonic() >= next_cleanup:
+                        cutoff = datetime.utcnow() - timedelta(seconds=self.retention)
+                        connection.execute(delete(table).where(table.c.created_at < cutoff))
+                        next_cleanup = time.monotonic() + 60
+            except Exception:
+                continue  # the database may be busy; try again next round
+            if rows:
+                last_id = rows[-1].id
+                self._dispatch(Event(row.id, row.channel, row.type, json.loads(row.payload))
+                               for row in rows)
+
+
+def get_broker():
+    """The broker of the current app, created on first use"""
+    broker = current_app.extensions.get('slot_events')
+    if broker is not None:
+        return broker
+    with _broker_lock:
+        broker = current_app.extensions.get('slot_events')
+        if broker is not None:
+            return broker
+        config = current_app.config
+        options = {'queue_size': config.get('SLOT_EVENTS_QUEUE_SIZE', 100),
+                   'max_subscribers': config.get('SLOT_EVENTS_MAX_SUBSCRIBERS', 8)}
+        if config.get('SLOT_EVENTS_BROKER', 'memory') == 'database':
+            broker = DatabaseBroker(db.engine,
+                                    poll_interval=config.get('SLOT_EVENTS_POLL_INTERVAL', 1.0),
+                                    retention=config.get('SLOT_EVENTS_RETENTION', 300),
+                                    **options)
+        else:
+            broker = MemoryBroker(**options)
+        current_app.extensions['slot_events'] = broker
+    return broker
+
+
+def _slot_event(kind, doctor_id, day, slot_time=None):
+    data = {'doctor_id': doctor_id, 'date': day.isoformat()}
+    if slot_time is not None:
+        data['time'] = slot_time.strftime('%H:%M')
+    return (channel(doctor_id, day), kind, data)
+
+
+def defer(events, session=None):
+    """Queue events to be published when the session's transaction commits"""
+    session = session or db.session()
+    session.info.setdefault('slot_events', []).extend(events)
+
+
+def availability_changed(doctor_days):
+    """Events for [(doctor_id, date), ...] whose windows changed"""
+    return [_slot_event('availability-changed', doctor_id, day)
+            for doctor_id, day in sorted(set(doctor_days))]
+
+
+def _old_values(state, keys):
+    values = []
+    for key in keys:
+        history = state.attrs[key].history
+        values.append(history.deleted[0] if history.deleted else getattr(state.object, key))
+    return tuple(values)
+
+
+_SLOT = ('doctor_id', 'appointment_date', 'appointment_time')
+
+
+def _collect(session):
+    events, windows = [], set()
+    for obj in session.new:
+        if isinstance(obj, Appointment) and (obj.status or 'Booked') == 'Booked':
+            events.append(_slot_event('slot-taken', obj.doctor_id, obj.appointment_date,
+                                      obj.appointment_time))
+        elif isinstance(obj, Availability):
+            windows.add((obj.doctor_id, obj.date))
+
+    for obj in session.dirty:
+        if isinstance(obj, Appointment):
+            state = inspect(obj)
+            old_slot, old_status = _old_values(state, _SLOT), _old_values(state, ('status',))[0]
+            new_slot = tuple(getattr(obj, key) for key in _SLOT)
+            moved = old_slot != new_slot
+            if old_status == 'Booked' and (moved or obj.status != 'Booked'):
+                events.append(_slot_event('slot-freed', *old_slot))
+            if obj.status == 'Booked' and (moved or old_status != 'Booked'):
+                events.append(_slot_event('slot-taken', *new_slot))
+        elif isinstance(obj, Availability) and session.is_modified(obj):
+            windows.add(_old_values(inspect(obj), ('doctor_id', 'date')))
+            windows.add((obj.doctor_id, obj.date))
+
+    for obj in session.deleted:
+        if isinstance(obj, Appointment):
+            state = inspect(obj)
+            if _old_values(state, ('status',))[0] == 'Booked':
+                events.append(_slot_event('slot-freed', *_old_values(state, _SLOT)))
+        elif isinstance(obj, Availability):
+            windows.add(_old_values(inspect(obj), ('doctor_id', 'date')))
+
+    return events + availability_changed(windows)
+
+
+def _collect_after_flush(session, flush_context):
+    events = _collect(session)
+    if events:
+        defer(events, session)
+
+
+def publish_deferred(session=None):
+    """Publish the events queued on the session (done on commit)"""
+    session = session or db.session()
+    events = session.info.pop('slot_events', None)
+    if events and has_app_context():
+        get_broker().publish(events)
+
+
+def _publish_after_commit(session):
+    publish_deferred(session)
+
+
+def _discard_after_rollback(session, previous_transaction):
+    if not previous_transaction.nested:
+        session.info.pop('slot_events', None)
+
+
+def _format(kind, data, event_id=None):
+    lines = [f'id: {event_id}'] if event_id is not None else []
+    lines += [f'event: {kind}', f'data: {json.dumps(data)}']
+    return '\n'.join(lines) + '\n\n'
+
+
+def stream(broker, subscription, heartbeat=15, lifetime=300):
+    """Server-sent events for `subscription`, ending after `lifetime` seconds.
+
+    Runs outside the request (no app context, no database connection).
+    Comment lines every `heartbeat` seconds keep proxies from closing the
+    connection; browsers reconnect by themselves when the stream ends.
+    """
+    deadline = time.monotonic() + lifetime
+    try:
+        yield 'retry: 3000\n\n'
+        while time.monotonic() < deadline:
+            event = subscription.get(timeout=heartbeat)
+            if subscription.overflowed:
+                # The client fell behind; have it re-read instead of replaying
+                subscription.overflowed = False
+                subscription.drain()
+                yield _format('resync', {})
+                continue
+            if event is None:
+                yield ': keepalive\n\n'
+                continue
+            yield _format(event.type, event.data, event.id)
+    finally:
+        broker.unsubscribe(subscription)
+
+
+def init_app(app):
+    """Collect slot events from every flush and publish them on commit"""
+    app.extensions['slot_events'] = None
+    for name, listener in (('after_flush', _collect_after_flush),
+                           ('after_commit', _publish_after_commit),
+                           ('after_soft_rollback', _discard_after_rollback)):
+        if not event.contains(Session, name, listener):
+            event.listen(Session, name, listener)
+    # Keep the previous slot on assignment even when the instance was
+    # expired, so a reschedule also announces the slot it left
+    keep_previous(Appointment, _SLOT + ('status',))
@@ -0,0 +1,114 @@
+"""Free appointment slots: Availability windows minus Booked appointments.
+
+Every (doctor, day) gets two bitmaps held in a Python int, one bit per
+minute of the day: the minutes covered by Availability windows and the
+minutes taken by Booked appointments (each occupies one slot length). A
+slot is free when all of its minutes are open and none are taken. The
+slots of a window start at the window's start time and step by the
+window's `slot_minutes` (APPOINTMENT_SLOT_MINUTES when unset); a booking
+takes the length of the window it starts in.
+
+Whatever the number of doctors and days, the computation reads the
+database twice: once for the windows and once for the bookings.
+"""
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from flask import current_app
+from sqlalchemy import select
+from app import db
+from app.models import Appointment, Availability
+
+
+def slot_minutes():
+    return current_app.config.get('APPOINTMENT_SLOT_MINUTES', 30)
+
+
+def _minute(value):
+    return value.hour * 60 + value.minute
+
+
+def _span(start, end):
+    """Bitmap with the bits for minutes [start, end) set"""
+    if end <= start:
+        return 0
+    return ((1 << (end - start)) - 1) << start
+
+
+def free_slots(doctor_ids, start_date, end_date, exclude_appointment_id=None, now=None,
+               connection=None):
+    """Free slot times per doctor and day, between two dates inclusive.
+
+    Returns {doctor_id: {date: [time, ...]}} with days that have no free
+    slot left out. Slots that already started are never free.
+    `exclude_appointment_id` treats that appointment's slot as free (for
+    rescheduling it). Reads through `connection` when given, else the
+    session.
+    """
+    executor = connection if connection is not None else db.session
+    doctor_ids = list(doctor_ids)
+    if not doctor_ids or end_date < start_date:
+        return {}
+    default_length = slot_minutes()
+    now = now or datetime.now()
+
+    windows = defaultdict(list)
+    available = defaultdict(int)
+    rows = executor.execute(
+        select(Availability.doctor_id, Availability.date, Availability.start_time,
+               Availability.end_time, Availability.slot_minutes)
+        .where(Availability.doctor_id.in_(doctor_ids),
+               Availability.date.between(start_date, end_date),
+               Availability.is_available.is_(True))
+    )
+    for doctor_id, day, start_time, end_time, length in rows:
+        start, end = _minute(start_time), _minute(end_time)
+        windows[(doctor_id, day)].append((start, end, length or default_length))
+        available[(doctor_id, day)] |= _span(start, end)
+    if not windows:
+        return {}
+
+    taken = defaultdict(int)
+    booked = (
+        select(Appointment.doctor_id, Appointment.appointment_date, Appointment.appointment_time)
+        .where(Appointment.doctor_id.in_({doctor_id for doctor_id, _ in windows}),
+               Appointment.appointment_date.between(start_date, end_date),
+               Appointment.status == 'Booked')
+    )
+    if exclude_appointment_id is not None:
+        booked = booked.where(Appointment.id != exclude_appointment_id)
+    for doctor_id, day, appointment_time in executor.execute(booked):
+        start = _minute(appointment_time)
+        length = next((length for window_start, window_end, length in windows.get((doctor_id, day), ())
+                       if window_start <= start < window_end), default_length)
+        taken[(doctor_id, day)] |= _span(start, start + length)
+
+    result = defaultdict(dict)
+    for (doctor_id, day), day_windows in windows.items():
+        if day < now.date():
+            continue
+        earliest = _minute(now) + 1 if day == now.date() else 0
+        open_bits, taken_bits = available[(doctor_id, day)], taken[(doctor_id, day)]
+        starts = set()
+        for start, end, length in day_windows:
+            for minute in range(start, end - length + 1, length):
+                mask = _span(minute, minute + length)
+                if minute >= earliest and open_bits & mask == mask and not taken_bits & mask:
+                    starts.add(minute)
+        if starts:
+            result[doctor_id][day] = [time(m // 60, m % 60) for m in sorted(starts)]
+    return dict(result)
+
+
+def doctor_free_slots(doctor_id, start_date=None, days=None, exclude_appointment_id=None):
+    """{date: [time, ...]} of free slots for one doctor, from start_date on"""
+    start_date = start_date or date.today()
+    days = days or current_app.config.get('BOOKING_WINDOW_DAYS', 7)
+    slots = free_slots([doctor_id], start_date, start_date + timedelta(days=days - 1),
+                       exclude_appointment_id=exclude_appointment_id)
+    return dict(sorted(slots.get(doctor_id, {}).items()))
+
+
+def is_free(doctor_id, day, slot_time, exclude_appointment_id=None):
+    """Whether `slot_time` on `day` is one of the doctor's free slots"""
+    slots = free_slots([doctor_id], day, day, exclude_appointment_id=exclude_appointment_id)
+    return slot_time.replace(second=0, microsecond=0) in slots.get(doctor_id, {}).get(day, [])
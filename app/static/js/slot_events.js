@@ -0,0 +1,30 @@
+// Live slot updates for the doctor profile and booking pages.
+// Elements with data-slot="YYYY-MM-DDTHH:MM" are removed as soon as that
+// slot is booked by someone else; when slots open up a notice offers a refresh.
+
+function showSlotNotice(html) {
+    const notice = document.getElementById('slot-notice');
+    if (!notice) return;
+    notice.innerHTML = html;
+    notice.classList.remove('d-none');
+}
+
+function watchSlots(url) {
+    if (!window.EventSource) return;
+    const source = new EventSource(url);
+
+    source.addEventListener('slot-taken', (e) => {
+        const data = JSON.parse(e.data);
+        document.querySelectorAll(`[data-slot="${data.date}T${data.time}"]`).forEach((el) => {
+            if (el.tagName === 'OPTION' && el.selected) {
+                showSlotNotice('The slot you picked was just booked by someone else. Please choose another.');
+            }
+            el.remove();
+        });
+    });
+
+    const offerRefresh = () => showSlotNotice('New slots may have opened up. <a href="">Refresh</a> to see them.');
+    source.addEventListener('slot-freed', offerRefresh);
+    source.addEventListener('availability-changed', offerRefresh);
+    source.addEventListener('resync', offerRefresh);
+}
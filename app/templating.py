@@ -0,0 +1,60 @@
+"""Persistent Jinja bytecode cache.
+
+Jinja compiles a template to Python code on its first use in a process.
+With TEMPLATE_BYTECODE_CACHE on, the compiled code is also written to
+TEMPLATE_CACHE_DIR (instance/jinja-cache by default), and a new worker
+loads it from there instead of compiling again. Entries are keyed by
+template and checked against the source, so an edited template is
+recompiled. Files are written under a temporary name and renamed, so
+workers can share the directory.
+
+`flask precompile-templates` compiles every template into the cache at
+build time, so even the first worker after a deploy finds it filled.
+"""
+import logging
+import os
+import time
+from collections import namedtuple
+from flask import current_app
+from jinja2 import FileSystemBytecodeCache, TemplateError
+
+logger = logging.getLogger(__name__)
+
+Compiled = namedtuple('Compiled', 'name ms error')
+
+
+def cache_directory(app=None):
+    app = app or current_app
+    return app.config.get('TEMPLATE_CACHE_DIR') or os.path.join(app.instance_path, 'jinja-cache')
+
+
+def precompile():
+    """Compile every template of the app into the bytecode cache; returns [Compiled]"""
+    env = current_app.jinja_env
+    if env.bytecode_cache is None:
+        raise RuntimeError('TEMPLATE_BYTECODE_CACHE is off')
+    results = []
+    for name in sorted(env.list_templates()):
+        started = time.perf_counter()
+        try:
+            # Compiles the template (or loads it if the cache is current) and stores the bytecode
+            env.get_template(name)
+        except TemplateError as e:
+            results.append(Compiled(name, 0.0, f'{type(e).__name__}: {e}'))
+            continue
+        results.append(Compiled(name, (time.perf_counter() - started) * 1000, None))
+    return results
+
+
+def init_app(app):
+    """Load and store compiled templates in TEMPLATE_CACHE_DIR"""
+    if not app.config.get('TEMPLATE_BYTECODE_CACHE'):
+        return
+    directory = cache_directory(app)
+    try:
+        os.makedirs(directory, exist_ok=True)
+    except OSError:
+        logger.warning('Template bytecode cache disabled: cannot create %s', directory)
+        return
+    # Flask-WTF has created the environment already; templates load lazily
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
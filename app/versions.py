@@ -0,0 +1,132 @@
+"""Per-doctor and per-patient change stamps.
+
+Every flush that changes what a doctor's or a patient's API responses
+contain bumps `entity_versions.version` (and `updated_at`) of that doctor
+or patient, in the same transaction:
+
+    ('doctor', id)    the doctor's profile, availability and appointments,
+                      and the names/specialization shown with them
+    ('patient', id)   the patient's profile and appointments, and the
+                      doctor names shown with them
+
+The API turns a stamp into an ETag and Last-Modified, so a poll that finds
+the stamp unchanged is answered with 304 after one primary-key read.
+Versions only ever grow; there is no rebuild that could hand out an old
+ETag again. Core writes that bypass the session (bulk availability
+generation) call `bump()` themselves.
+"""
+from datetime import datetime
+from sqlalchemy import event, inspect, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from app import db
+from app.models import Appointment, Availability, Doctor, EntityVersion, Patient, Specialization
+
+_UPSERT_DIALECTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+
+def bump(connection, keys):
+    """Increment the stamps of {(scope, scope_id), ...} on `connection`"""
+    keys = sorted({key for key in keys if key[1] is not None})
+    if not keys:
+        return
+    now = datetime.utcnow()
+    # Sorted so concurrent transactions lock stamp rows in the same order
+    rows = [{'scope': scope, 'scope_id': scope_id, 'version': 1, 'updated_at': now}
+            for scope, scope_id in keys]
+    table = EntityVersion.__table__
+
+    upsert = _UPSERT_DIALECTS.get(connection.dialect.name)
+    if upsert is not None:
+        statement = upsert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=['scope', 'scope_id'],
+            set_={'version': table.c.version + 1, 'updated_at': statement.excluded.updated_at}
+        )
+        connection.execute(statement, rows)
+        return
+
+    for row in rows:
+        result = connection.execute(
+            update(table)
+            .where(table.c.scope == row['scope'], table.c.scope_id == row['scope_id'])
+            .values(version=table.c.version + 1, updated_at=now)
+        )
+        if result.rowcount == 0:
+            connection.execute(table.insert().values(**row))
+
+
+def get(scope, scope_id):
+    """(version, updated_at) of one stamp; (0, None) if it never changed"""
+    row = db.session.execute(
+        select(EntityVersion.version, EntityVersion.updated_at)
+        .where(EntityVersion.scope == scope, EntityVersion.scope_id == scope_id)
+    ).first()
+    return tuple(row) if row else (0, None)
+
+
+def _previous(state, key):
+    history = state.attrs[key].history
+    return history.deleted[0] if history.deleted else None
+
+
+def _changed(state, key):
+    return state.attrs[key].history.has_changes()
+
+
+def _collect_keys(session, connection):
+    keys = set()
+    renamed_doctors, renamed_patients, renamed_specializations = set(), set(), set()
+
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if obj in session.dirty and not session.is_modified(obj):
+            continue
+        state = inspect(obj)
+        if isinstance(obj, Appointment):
+            for doctor_id in (obj.doctor_id, _previous(state, 'doctor_id')):
+                keys.add(('doctor', doctor_id))
+            for patient_id in (obj.patient_id, _previous(state, 'patient_id')):
+                keys.add(('patient', patient_id))
+        elif isinstance(obj, Availability):
+            keys.add(('doctor', obj.doctor_id))
+            keys.add(('doctor', _previous(state, 'doctor_id')))
+        elif obj in session.new:
+            continue
+        elif isinstance(obj, Doctor):
+            keys.add(('doctor', obj.id))
+            if _changed(state, 'name'):
+                renamed_doctors.add(obj.id)
+        elif isinstance(obj, Patient):
+            keys.add(('patient', obj.id))
+            if _changed(state, 'name'):
+                renamed_patients.add(obj.id)
+        elif isinstance(obj, Specialization) and _changed(state, 'name'):
+            renamed_specializations.add(obj.id)
+
+    # Names are shown on the other side's responses too
+    appointments = Appointment.__table__
+    if renamed_doctors:
+        keys.update(('patient', patient_id) for patient_id in connection.scalars(
+            select(appointments.c.patient_id).distinct()
+            .where(appointments.c.doctor_id.in_(renamed_doctors))))
+    if renamed_patients:
+        keys.update(('doctor', doctor_id) for doctor_id in connection.scalars(
+            select(appointments.c.doctor_id).distinct()
+            .where(appointments.c.patient_id.in_(renamed_patients))))
+    if renamed_specializations:
+        keys.update(('doctor', doctor_id) for doctor_id in connection.scalars(
+            select(Doctor.id).where(Doctor.specialization_id.in_(renamed_specializations))))
+    return keys
+
+
+def _bump_after_flush(session, flush_context):
+    connection = session.connection()
+    keys = _collect_keys(session, connection)
+    if keys:
+        bump(connection, keys)
+
+
+def init_app(app):
+    """Bump the stamps of doctors and patients touched by every flush"""
+    if not event.contains(Session, 'after_flush', _bump_after_flush):
+        event.listen(Session, 'after_flush', _bump_after_flush)
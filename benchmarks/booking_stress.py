@@ -0,0 +1,134 @@
+"""Concurrent booking stress test.
+
+Fires N parallel bookings at a single doctor/slot and checks that exactly
+one of them wins, then books N distinct slots in parallel to show that
+bookings for different slots do not serialize behind each other.
+
+    python -m benchmarks.booking_stress --bookings 50
+
+A throwaway SQLite file is used unless --database-url points at a scratch
+database (the script creates its own tables and rows there).
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta, time as dtime
+
+
+def _run_parallel(app, jobs):
+    """Run each job in its own thread and app context, all released at once"""
+    from app.booking import SlotUnavailable
+
+    barrier = threading.Barrier(len(jobs))
+    results = [None] * len(jobs)
+
+    def worker(index, job):
+        with app.app_context():
+            barrier.wait()
+            try:
+                job()
+                results[index] = 'booked'
+            except SlotUnavailable:
+                results[index] = 'taken'
+            except Exception as e:
+                results[index] = f'error: {type(e).__name__}: {e}'
+
+    threads = [threading.Thread(target=worker, args=(i, job)) for i, job in enumerate(jobs)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - started
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--bookings', type=int, default=50, help='parallel bookings per phase')
+    parser.add_argument('--database-url', help='scratch database to run against')
+    args = parser.parse_args(argv)
+
+    if not args.database_url:
+        workdir = tempfile.mkdtemp(prefix='booking-stress-')
+        args.database_url = f'sqlite:///{os.path.join(workdir, "stress.db")}'
+    # config.py reads DATABASE_URL at import time
+    os.environ['DATABASE_URL'] = args.database_url
+
+    from werkzeug.security import generate_password_hash
+    from app import create_app, db
+    from app.booking import book_slot
+    from app.models import Appointment, Doctor, Patient, Specialization, User
+
+    app = create_app('development')
+    app.config['SQL_QUERY_BUDGET'] = None
+
+    with app.app_context():
+        db.create_all()
+        password_hash = generate_password_hash('stress', method='pbkdf2:sha256:1000')
+        run_id = int(time.time())
+
+        spec = Specialization(name=f'Stress {run_id}')
+        doctor_user = User(email=f'stress-doctor-{run_id}@example.com', role='doctor',
+                           password_hash=password_hash)
+        db.session.add_all([spec, doctor_user])
+        db.session.flush()
+        doctor = Doctor(user_id=doctor_user.id, name='Stress Doctor', specialization_id=spec.id)
+        db.session.add(doctor)
+
+        patient_ids = []
+        for i in range(args.bookings):
+            user = User(email=f'stress-patient-{run_id}-{i}@example.com', role='patient',
+                        password_hash=password_hash)
+            db.session.add(user)
+            db.session.flush()
+            patient = Patient(user_id=user.id, name=f'Stress Patient {i}')
+            db.session.add(patient)
+            db.session.flush()
+            patient_ids.append(patient.id)
+        db.session.commit()
+        doctor_id = doctor.id
+
+    slot_date = date.today() + timedelta(days=1)
+    slot_time = dtime(10, 0)
+
+    # Phase 1: everybody wants the same slot
+    jobs = [
+        (lambda pid=pid: book_slot(pid, doctor_id, slot_date, slot_time))
+        for pid in patient_ids
+    ]
+    results, elapsed = _run_parallel(app, jobs)
+    booked = results.count('booked')
+    taken = results.count('taken')
+    errors = [r for r in results if r.startswith('error')]
+
+    with app.app_context():
+        rows = Appointment.query.filter_by(
+            doctor_id=doctor_id, appointment_date=slot_date,
+            appointment_time=slot_time, status='Booked'
+        ).count()
+
+    print(f'Same slot:      {args.bookings} attempts in {elapsed:.3f}s -> '
+          f'{booked} booked, {taken} rejected, {len(errors)} errors, {rows} row(s) in the database')
+    for error in sorted(set(errors)):
+        print(f'  {error}')
+
+    # Phase 2: every booking has its own slot, nothing should be rejected
+    other_date = slot_date + timedelta(days=1)
+    jobs = [
+        (lambda pid=pid, i=i: book_slot(pid, doctor_id, other_date, dtime(i // 60 % 24, i % 60)))
+        for i, pid in enumerate(patient_ids)
+    ]
+    results, elapsed = _run_parallel(app, jobs)
+    print(f'Distinct slots: {args.bookings} bookings in {elapsed:.3f}s '
+          f'({args.bookings / elapsed:.0f}/s), {results.count("booked")} booked')
+
+    ok = booked == 1 and rows == 1 and not errors and results.count('booked') == args.bookings
+    print('PASS' if ok else 'FAIL')
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,180 @@
+"""Concurrent read/write throughput with and without the engine tuning profile.
+
+Starts --workers processes (like gunicorn workers), each running a mix of
+reads (a doctor's latest appointments) and writes (an ORM booking committed
+through all the flush hooks) for --seconds, once with DATABASE_TUNING off
+(SQLAlchemy/driver defaults) and once with the profile of the config class
+(app/engine.py), and prints operations per second, write latency and
+errors such as "database is locked" for both.
+
+    python -m benchmarks.engine_throughput --workers 4 --seconds 10
+
+Each run gets a throwaway SQLite file unless --database-url points at a
+scratch database (the script creates its own tables and rows there, and
+runs both profiles against it).
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import date, timedelta, time as dtime
+
+DOCTORS = 20
+PATIENTS = 200
+SLOTS = [dtime(8 + i // 2, 30 * (i % 2)) for i in range(20)]
+
+
+def _make_app(config_name, tuned, database_url):
+    from app import create_app
+    from config import config
+
+    config['engine-benchmark'] = type('EngineBenchmarkConfig', (config[config_name],), {
+        'SQLALCHEMY_DATABASE_URI': database_url,
+        'DATABASE_TUNING': tuned,
+    })
+    app = create_app('engine-benchmark')
+    app.config['SQL_QUERY_BUDGET'] = None
+    return app
+
+
+def _seed(app):
+    from werkzeug.security import generate_password_hash
+    from app import db
+    from app.models import Doctor, Patient, Specialization, User
+
+    with app.app_context():
+        db.create_all()
+        password_hash = generate_password_hash('bench', method='pbkdf2:sha256:1000')
+        run_id = f'{int(time.time())}-{os.getpid()}'
+        spec = Specialization(name=f'Bench {run_id}')
+        db.session.add(spec)
+        db.session.flush()
+        doctor_ids, patient_ids = [], []
+        for role, count, ids in (('doctor', DOCTORS, doctor_ids), ('patient', PATIENTS, patient_ids)):
+            for i in range(count):
+                user = User(email=f'bench-{role}-{run_id}-{i}@example.com', role=role,
+                            password_hash=password_hash)
+                db.session.add(user)
+                db.session.flush()
+                if role == 'doctor':
+                    profile = Doctor(user_id=user.id, name=f'Bench Doctor {i}', specialization_id=spec.id)
+                else:
+                    profile = Patient(user_id=user.id, name=f'Bench Patient {i}')
+                db.session.add(profile)
+                db.session.flush()
+                ids.append(profile.id)
+        db.session.commit()
+    return doctor_ids, patient_ids
+
+
+def _worker(index, config_name, tuned, database_url, doctor_ids, patient_ids, write_ratio,
+            start_at, seconds, results):
+    from sqlalchemy.orm import joinedload
+    from app import db
+    from app.models import Appointment
+
+    app = _make_app(config_name, tuned, database_url)
+    rng = random.Random(index)
+    first_day = date.today() + timedelta(days=400 + index * 2000)
+    counts, errors, latencies = Counter(), Counter(), []
+    booked = 0
+
+    time.sleep(max(0.0, start_at - time.time()))
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        write = rng.random() < write_ratio
+        started = time.perf_counter()
+        try:
+            with app.app_context():
+                if write:
+                    doctor_id = doctor_ids[booked % len(doctor_ids)]
+                    rest = booked // len(doctor_ids)
+                    db.session.add(Appointment(
+                        patient_id=rng.choice(patient_ids), doctor_id=doctor_id,
+                        appointment_date=first_day + timedelta(days=rest // len(SLOTS)),
+                        appointment_time=SLOTS[rest % len(SLOTS)], reason='benchmark'))
+                    db.session.commit()
+                    booked += 1
+                else:
+                    Appointment.query.options(joinedload(Appointment.patient)).filter(
+                        Appointment.doctor_id == rng.choice(doctor_ids)
+                    ).order_by(Appointment.appointment_date.desc(),
+                               Appointment.appointment_time.desc()).limit(25).all()
+        except Exception as e:
+            message = str(getattr(e, 'orig', None) or e).splitlines()[0]
+            errors[f'{type(e).__name__}: {message[:80]}'] += 1
+            if write:
+                booked += 1  # don't retry the same slot
+            continue
+        kind = 'writes' if write else 'reads'
+        counts[kind] += 1
+        if write:
+            latencies.append(time.perf_counter() - started)
+    results.put((counts, errors, latencies))
+
+
+def _run(config_name, tuned, database_url, workers, seconds, write_ratio):
+    app = _make_app(config_name, tuned, database_url)
+    doctor_ids, patient_ids = _seed(app)
+    from app import db
+    with app.app_context():
+        db.engine.dispose()  # no connections inherited by the workers
+
+    results = multiprocessing.Queue()
+    start_at = time.time() + 1.0
+    processes = [
+        multiprocessing.Process(target=_worker, args=(i, config_name, tuned, database_url, doctor_ids,
+                                                      patient_ids, write_ratio, start_at, seconds, results))
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    counts, errors, latencies = Counter(), Counter(), []
+    for _ in processes:
+        worker_counts, worker_errors, worker_latencies = results.get()
+        counts.update(worker_counts)
+        errors.update(worker_errors)
+        latencies.extend(worker_latencies)
+    for process in processes:
+        process.join()
+    return counts, errors, sorted(latencies)
+
+
+def _percentile(values, fraction):
+    if not values:
+        return float('nan')
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4, help='concurrent worker processes')
+    parser.add_argument('--seconds', type=float, default=10, help='duration of each run')
+    parser.add_argument('--write-ratio', type=float, default=0.2, help='share of operations that write')
+    parser.add_argument('--config', default='production', help='config class whose profile is measured')
+    parser.add_argument('--database-url', help='scratch database to run against')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='engine-throughput-')
+    print(f'{args.workers} workers, {args.seconds:g}s per run, {args.write_ratio:.0%} writes, '
+          f'{args.config} config')
+    print(f'{"profile":<9} {"reads/s":>9} {"writes/s":>9} {"write p50":>10} {"write p95":>10} {"errors":>7}')
+    for label, tuned in (('defaults', False), ('tuned', True)):
+        # Separate files: the WAL journal mode sticks to a database file
+        url = args.database_url or f'sqlite:///{os.path.join(workdir, label + ".db")}'
+        counts, errors, latencies = _run(args.config, tuned, url, args.workers, args.seconds,
+                                         args.write_ratio)
+        print(f'{label:<9} {counts["reads"] / args.seconds:>9.0f} {counts["writes"] / args.seconds:>9.0f} '
+              f'{_percentile(latencies, 0.5) * 1000:>8.1f}ms {_percentile(latencies, 0.95) * 1000:>8.1f}ms '
+              f'{sum(errors.values()):>7}')
+        for error, count in errors.most_common(3):
+            print(f'  {count} x {error}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
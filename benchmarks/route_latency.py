@@ -0,0 +1,302 @@
+"""Route latency benchmark with weighted hospital workloads.
+
+Builds the app with `create_app('testing')` on a SQLite file, fills it with
+generated data (app/seeding.py, as `flask seed`) and replays a weighted mix
+of scenarios through the Flask test client:
+
+    patient_search      search by specialization, earliest available slots
+    patient_doctor      a doctor's profile and booking page
+    patient_book        book a free slot
+    patient_history     own appointments and treatment history
+    doctor_dashboard    dashboard, appointment list and patient roster
+    doctor_complete     open a booked appointment and complete it
+    admin_search        doctor/patient search and the appointment list
+
+For every route it reports p50/p95/p99 latency and the SQL statements per
+request. --save-baseline stores the result as JSON. --baseline compares
+with a stored result and exits with 1 when a route's p95 got more than
+--tolerance slower, or when it issues more statements than before.
+
+    python -m benchmarks.route_latency --iterations 500 --save-baseline baseline.json
+    python -m benchmarks.route_latency --iterations 500 --baseline baseline.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import date
+
+SCENARIO_WEIGHTS = {
+    'patient_search': 20,
+    'patient_doctor': 15,
+    'patient_book': 8,
+    'patient_history': 12,
+    'doctor_dashboard': 25,
+    'doctor_complete': 5,
+    'admin_search': 15,
+}
+
+
+class Recorder:
+    """Timings and statement counts per route ('METHOD endpoint')"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statements = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.last = None
+
+    def after_request(self, response):
+        from flask import request
+        from app.query_budget import statement_count
+
+        self.last = (f'{request.method} {request.endpoint or "<unmatched>"}', statement_count())
+        return response
+
+    def call(self, method, client, url, **kwargs):
+        self.last = None
+        started = time.perf_counter()
+        response = client.open(url, method=method, **kwargs)
+        elapsed = time.perf_counter() - started
+        if self.last is not None:
+            route, statements = self.last
+            self.latencies[route].append(elapsed)
+            self.statements[route].append(statements)
+            if response.status_code >= 500:
+                self.errors[route] += 1
+        return response
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def summarize(recorder):
+    summary = {}
+    for route, latencies in sorted(recorder.latencies.items()):
+        statements = recorder.statements[route]
+        summary[route] = {
+            'requests': len(latencies),
+            'p50_ms': round(_percentile(latencies, 0.50) * 1000, 2),
+            'p95_ms': round(_percentile(latencies, 0.95) * 1000, 2),
+            'p99_ms': round(_percentile(latencies, 0.99) * 1000, 2),
+            'sql_mean': round(sum(statements) / len(statements), 1),
+            'sql_max': max(statements),
+            'errors': recorder.errors.get(route, 0),
+        }
+    return summary
+
+
+class Workload:
+    """Logged-in clients and the scenario steps"""
+
+    def __init__(self, app, plan, recorder, rng, pool_size=20):
+        from app.seeding import ADMIN_EMAIL, email
+
+        self.app = app
+        self.recorder = recorder
+        self.rng = rng
+        self.clients = {}
+        self.doctor_ids = list(range(1, plan.doctors + 1))
+        self.patients = [email('patient', number)
+                         for number in rng.sample(range(1, plan.patients + 1), min(pool_size, plan.patients))]
+        self.doctors = [email('doctor', number)
+                        for number in rng.sample(self.doctor_ids, min(pool_size, plan.doctors))]
+        self.admins = [ADMIN_EMAIL]
+        self.specializations = plan.specializations
+
+    def client(self, role, email):
+        from app.seeding import PASSWORDS
+
+        client = self.clients.get(email)
+        if client is None:
+            client = self.app.test_client()
+            response = client.post('/auth/login', data={'email': email, 'password': PASSWORDS[role]})
+            if response.status_code != 302:
+                raise RuntimeError(f'Could not log in as {email}')
+            self.clients[email] = client
+        return client
+
+    def get(self, client, url):
+        return self.recorder.call('GET', client, url)
+
+    def post(self, client, url, data):
+        return self.recorder.call('POST', client, url, data=data)
+
+    def _profile_id(self, email):
+        from app.models import Doctor, Patient, User
+
+        with self.app.app_context():
+            user = User.query.filter_by(email=email).one()
+            model = Doctor if user.role == 'doctor' else Patient
+            return model.query.filter_by(user_id=user.id).one().id
+
+    # Scenarios
+
+    def patient_search(self):
+        client = self.client('patient', self.rng.choice(self.patients))
+        spec_id = self.rng.randint(1, self.specializations)
+        self.get(client, f'/patient/search?spec_id={spec_id}')
+        self.get(client, f'/patient/earliest-available?specialization_id={spec_id}')
+
+    def patient_doctor(self):
+        client = self.client('patient', self.rng.choice(self.patients))
+        doctor_id = self.rng.choice(self.doctor_ids)
+        self.get(client, f'/patient/doctor/{doctor_id}')
+        self.get(client, f'/patient/book-appointment/{doctor_id}')
+
+    def patient_book(self):
+        from app import slots
+
+        client = self.client('patient', self.rng.choice(self.patients))
+        doctor_id = self.rng.choice(self.doctor_ids)
+        with self.app.app_context():
+            free = slots.doctor_free_slots(doctor_id)
+        choices = [(day, moment) for day, moments in free.items() for moment in moments]
+        if not choices:
+            return
+        day, moment = self.rng.choice(choices)
+        self.post(client, f'/patient/book-appointment/{doctor_id}',
+                  {'slot': f'{day.isoformat()}T{moment:%H:%M}', 'reason': 'Benchmark visit'})
+        self.get(client, '/patient/appointments')
+
+    def patient_history(self):
+        client = self.client('patient', self.rng.choice(self.patients))
+        self.get(client, '/patient/appointments')
+        self.get(client, '/patient/history')
+
+    def doctor_dashboard(self):
+        client = self.client('doctor', self.rng.choice(self.doctors))
+        self.get(client, '/doctor/dashboard')
+        self.get(client, '/doctor/appointments')
+        self.get(client, '/doctor/appointments?status=Booked')
+        self.get(client, f"/doctor/patients?sort={self.rng.choice(['name', 'last_visit', 'next_appointment'])}")
+
+    def doctor_complete(self):
+        from app.models import Appointment
+
+        email = self.rng.choice(self.doctors)
+        client = self.client('doctor', email)
+        doctor_id = self._profile_id(email)
+        with self.app.app_context():
+            appointment = Appointment.query.filter_by(doctor_id=doctor_id, status='Booked').order_by(
+                Appointment.appointment_date, Appointment.appointment_time).first()
+            appointment_id = appointment.id if appointment else None
+        if appointment_id is None:
+            return
+        self.get(client, f'/doctor/appointment/{appointment_id}')
+        self.post(client, f'/doctor/appointment/{appointment_id}/complete',
+                  {'diagnosis': 'Benchmark', 'prescription': 'Rest', 'notes': ''})
+
+    def admin_search(self):
+        client = self.client('admin', self.rng.choice(self.admins))
+        term = self.rng.choice(('Sharma', 'Patel', 'Priya', 'Rao', 'Khan'))
+        self.get(client, f'/admin/doctors?search={term}')
+        self.get(client, f'/admin/patients?search={term}')
+        self.get(client, '/admin/appointments')
+
+
+def compare(summary, baseline, tolerance):
+    """Print the change per route; returns the routes that regressed"""
+    regressions = []
+    print(f'\n{"route":<52} {"p95 ms":>9} {"baseline":>9} {"change":>8} {"sql":>6} {"before":>6}')
+    for route, current in summary.items():
+        before = baseline.get(route)
+        if before is None:
+            print(f'{route:<52} {current["p95_ms"]:>9.2f} {"-":>9} {"new":>8} {current["sql_mean"]:>6} {"-":>6}')
+            continue
+        change = (current['p95_ms'] - before['p95_ms']) / before['p95_ms'] if before['p95_ms'] else 0.0
+        slower = change > tolerance
+        more_sql = current['sql_max'] > before['sql_max']
+        flag = '  <-- slower' if slower else ''
+        flag += '  <-- more SQL' if more_sql else ''
+        print(f'{route:<52} {current["p95_ms"]:>9.2f} {before["p95_ms"]:>9.2f} {change:>+8.0%} '
+              f'{current["sql_mean"]:>6} {before["sql_mean"]:>6}{flag}')
+        if slower or more_sql:
+            regressions.append(route)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=500, help='scenarios to replay')
+    parser.add_argument('--warmup', type=int, default=50, help='scenarios run before measuring')
+    parser.add_argument('--doctors', type=int, default=50)
+    parser.add_argument('--patients', type=int, default=2000)
+    parser.add_argument('--appointments', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--database', help='SQLite file to use (default: a fresh temporary file)')
+    parser.add_argument('--save-baseline', metavar='PATH', help='write the results as a baseline')
+    parser.add_argument('--baseline', metavar='PATH', help='compare with a stored baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed p95 slowdown against the baseline (0.25 = 25%%)')
+    args = parser.parse_args(argv)
+
+    from app import create_app, db
+    from config import config
+    from app.seeding import SeedPlan, seed
+
+    path = args.database or os.path.join(tempfile.mkdtemp(prefix='route-latency-'), 'bench.db')
+    if os.path.exists(path):
+        os.remove(path)
+    config['route-benchmark'] = type('RouteBenchmarkConfig', (config['testing'],), {
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{os.path.abspath(path)}',
+        'SQL_QUERY_BUDGET': None,
+    })
+    app = create_app('route-benchmark')
+    recorder = Recorder()
+    app.after_request(recorder.after_request)
+
+    started = time.perf_counter()
+    with app.app_context():
+        db.create_all()
+        plan = SeedPlan(doctors=args.doctors, patients=args.patients, appointments=args.appointments,
+                        history_days=120, seed=args.seed)
+        seed(plan)
+    print(f'Dataset: {args.doctors} doctors, {args.patients} patients, {args.appointments} appointments '
+          f'in {time.perf_counter() - started:.1f}s ({path})')
+
+    rng = random.Random(args.seed)
+    workload = Workload(app, plan, recorder, rng)
+    names, weights = zip(*SCENARIO_WEIGHTS.items())
+    for _ in range(args.warmup):
+        getattr(workload, rng.choices(names, weights)[0])()
+    recorder.__init__()
+
+    started = time.perf_counter()
+    for _ in range(args.iterations):
+        getattr(workload, rng.choices(names, weights)[0])()
+    elapsed = time.perf_counter() - started
+
+    summary = summarize(recorder)
+    total = sum(route['requests'] for route in summary.values())
+    print(f'{args.iterations} scenarios, {total} requests in {elapsed:.1f}s\n')
+    print(f'{"route":<52} {"n":>5} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"sql":>6} {"max":>4} {"5xx":>4}')
+    for route, result in summary.items():
+        print(f'{route:<52} {result["requests"]:>5} {result["p50_ms"]:>8.2f} {result["p95_ms"]:>8.2f} '
+              f'{result["p99_ms"]:>8.2f} {result["sql_mean"]:>6} {result["sql_max"]:>4} {result["errors"]:>4}')
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({'created': date.today().isoformat(), 'iterations': args.iterations,
+                       'routes': summary}, f, indent=2)
+        print(f'\nBaseline written to {args.save_baseline}')
+
+    status = 1 if any(result['errors'] for result in summary.values()) else 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['routes']
+        regressions = compare(summary, baseline, args.tolerance)
+        if regressions:
+            print(f'\n{len(regressions)} route(s) regressed')
+            status = 1
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,167 @@
+"""Time to first response of a fresh worker, with and without the template bytecode cache.
+
+Every run is a new Python process, like a gunicorn worker after a deploy
+or a recycle: it imports the app, calls create_app() and sends the first
+request to each page once (as admin, doctor and patient), so every page
+pays its template compilation. Three modes, --runs processes each:
+
+    no cache      TEMPLATE_BYTECODE_CACHE off (compiled in every process)
+    empty cache   cache on, but nothing precompiled (the first worker fills it)
+    precompiled   after `flask precompile-templates`
+
+It prints the boot time (import + create_app), the time to the first
+response, the first hits of all pages (without boot) and the first-hit
+latency per page, as medians.
+
+    python -m benchmarks.startup_time --runs 5
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+MODES = ('no cache', 'empty cache', 'precompiled')
+
+# (role, path) in request order; None logs out
+PAGES = (
+    (None, '/'),
+    (None, '/auth/login'),
+    (None, '/auth/register'),
+    ('admin', '/admin/dashboard'),
+    ('admin', '/admin/doctors'),
+    ('admin', '/admin/patients'),
+    ('admin', '/admin/appointments'),
+    ('admin', '/admin/specializations'),
+    ('doctor', '/doctor/dashboard'),
+    ('doctor', '/doctor/appointments'),
+    ('doctor', '/doctor/appointment/{appointment_id}'),
+    ('patient', '/patient/dashboard'),
+    ('patient', '/patient/search-doctors'),
+    ('patient', '/patient/search'),
+    ('patient', '/patient/doctor/1'),
+    ('patient', '/patient/book-appointment/1'),
+    ('patient', '/patient/appointments'),
+    ('patient', '/patient/history'),
+    ('patient', '/patient/profile'),
+)
+
+
+def _make_app(database, cache_dir):
+    from app import create_app
+    from config import config
+
+    config['startup-benchmark'] = type('StartupBenchmarkConfig', (config['testing'],), {
+        'DEBUG': False,  # no template auto-reload, as in production
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{database}',
+        'SQL_QUERY_BUDGET': None,
+        'TEMPLATE_BYTECODE_CACHE': cache_dir is not None,
+        'TEMPLATE_CACHE_DIR': cache_dir,
+    })
+    return create_app('startup-benchmark')
+
+
+def _prepare(workdir):
+    """Seed the database and fill a precompiled cache; returns (database, appointment id)"""
+    from app import db, templating
+    from app.models import Appointment
+    from app.seeding import SeedPlan, seed
+
+    database = os.path.join(workdir, 'startup.db')
+    app = _make_app(database, os.path.join(workdir, 'precompiled'))
+    with app.app_context():
+        db.create_all()
+        seed(SeedPlan())
+        appointment_id = db.session.scalar(
+            db.select(Appointment.id).filter_by(doctor_id=1).order_by(Appointment.id).limit(1))
+        failed = [result for result in templating.precompile() if result.error]
+        if failed:
+            raise SystemExit(f'{failed[0].name}: {failed[0].error}')
+    return database, appointment_id
+
+
+def _child(database, cache_dir, appointment_id):
+    """One fresh worker; prints its timings as JSON"""
+    started = time.perf_counter()
+    app = _make_app(database, cache_dir)
+    boot_ms = (time.perf_counter() - started) * 1000
+
+    from app.seeding import ADMIN_EMAIL, PASSWORDS, email
+
+    logins = {'admin': ADMIN_EMAIL, 'doctor': email('doctor', 1), 'patient': email('patient', 1)}
+    client, role = app.test_client(), None
+    pages = {}
+    for page_role, path in PAGES:
+        if page_role != role:
+            client = app.test_client()
+            if page_role is not None:
+                client.post('/auth/login', data={'email': logins[page_role], 'password': PASSWORDS[page_role]})
+            role = page_role
+        path = path.format(appointment_id=appointment_id)
+        request_started = time.perf_counter()
+        response = client.get(path)
+        pages[path] = (time.perf_counter() - request_started) * 1000
+        if response.status_code != 200:
+            raise SystemExit(f'{path}: HTTP {response.status_code}')
+    json.dump({'boot_ms': boot_ms, 'first_response_ms': boot_ms + next(iter(pages.values())),
+               'first_hits_ms': sum(pages.values()), 'all_pages_ms': boot_ms + sum(pages.values()),
+               'pages': pages}, sys.stdout)
+
+
+def _run(database, cache_dir, appointment_id):
+    command = [sys.executable, '-m', 'benchmarks.startup_time', '--child', '--database', database,
+               '--appointment', str(appointment_id)]
+    if cache_dir is not None:
+        command += ['--cache-dir', cache_dir]
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='fresh processes per mode')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--database', help=argparse.SUPPRESS)
+    parser.add_argument('--cache-dir', help=argparse.SUPPRESS)
+    parser.add_argument('--appointment', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        _child(args.database, args.cache_dir, args.appointment)
+        return 0
+
+    workdir = tempfile.mkdtemp(prefix='startup-time-')
+    try:
+        database, appointment_id = _prepare(workdir)
+        results = {mode: [] for mode in MODES}
+        for _ in range(args.runs):
+            results['no cache'].append(_run(database, None, appointment_id))
+            empty = os.path.join(workdir, 'empty')
+            shutil.rmtree(empty, ignore_errors=True)
+            results['empty cache'].append(_run(database, empty, appointment_id))
+            results['precompiled'].append(_run(database, os.path.join(workdir, 'precompiled'), appointment_id))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    def median(mode, key):
+        return statistics.median(run[key] for run in results[mode])
+
+    print(f'{len(PAGES)} pages, {args.runs} fresh processes per mode (medians)\n')
+    print(f'{"":<14} {"boot ms":>9} {"first response ms":>18} {"first hits ms":>14} {"all pages ms":>13}')
+    for mode in MODES:
+        print(f'{mode:<14} {median(mode, "boot_ms"):>9.0f} {median(mode, "first_response_ms"):>18.0f} '
+              f'{median(mode, "first_hits_ms"):>14.0f} {median(mode, "all_pages_ms"):>13.0f}')
+
+    print(f'\n{"first hit ms":<40}' + ''.join(f'{mode:>13}' for mode in MODES))
+    for path in results['no cache'][0]['pages']:
+        print(f'{path:<40}' + ''.join(
+            f'{statistics.median(run["pages"][path] for run in results[mode]):>13.1f}' for mode in MODES))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -12,6 +12,26 @@ class Config:
     
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
+    # Engine tuning per backend (app/engine.py); explicit SQLALCHEMY_ENGINE_OPTIONS win
+    DATABASE_TUNING = True  # False: SQLAlchemy/driver defaults
+    SQLITE_JOURNAL_MODE = 'WAL'  # readers don't block the writer and vice versa
+    SQLITE_BUSY_TIMEOUT = 5000  # ms a writer waits for the lock before "database is locked"
+    SQLITE_SYNCHRONOUS = 'NORMAL'  # durable with WAL, without an fsync per commit
+    SQLITE_CACHE_SIZE = -16000  # negative: KiB of page cache per connection
+    DATABASE_POOL_SIZE = 5  # PostgreSQL/MySQL: connections kept per process
+    DATABASE_MAX_OVERFLOW = 10  # extra connections under bursts
+    DATABASE_POOL_TIMEOUT = 10  # seconds to wait for a free connection
+    DATABASE_POOL_RECYCLE = 1800  # seconds; below server and proxy idle timeouts
+    DATABASE_POOL_PRE_PING = True  # replace connections the server dropped
+    
+    # Read replica (app/replica.py); unset: every query goes to the primary
+    REPLICA_DATABASE_URL = os.environ.get('REPLICA_DATABASE_URL')
+    SQLALCHEMY_BINDS = {'read': REPLICA_DATABASE_URL} if REPLICA_DATABASE_URL else {}
+    REPLICA_BLUEPRINTS = ('admin', 'doctor', 'patient', 'specialization')  # GET/HEAD only
+    REPLICA_STICKY_SECONDS = 10  # a browser reads from the primary this long after writing
+    REPLICA_CHECK_INTERVAL = 5  # seconds between health probes per process
+    REPLICA_MAX_LAG = 5  # seconds of replay lag tolerated (PostgreSQL)
+    
     # Session Configuration
     PERMANENT_SESSION_LIFETIME = timedelta(hours=24)
     SESSION_COOKIE_SECURE = False
@@ -21,6 +41,79 @@ class Config:
     # Flask-WTF
     WTF_CSRF_ENABLED = True
     WTF_CSRF_TIME_LIMIT = None
+    
+    # Request metrics at /metrics (app/metrics.py)
+    METRICS_ENABLED = True
+    METRICS_DIR = os.environ.get('METRICS_DIR')  # shared by the workers so /metrics adds them up
+    METRICS_WRITE_INTERVAL = 5  # seconds between a worker's writes to METRICS_DIR
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')  # scrapers send "Authorization: Bearer <token>"
+    METRICS_ALLOWED_ADDRESSES = ('127.0.0.1', '::1')
+    
+    # On-demand profiler and slow query log (app/profiling.py, /admin/profiling)
+    PROFILING_DIR = None  # default: instance/profiles
+    PROFILING_HEADER = 'X-Profile'  # carries a signed token from the admin page
+    PROFILING_TOKEN_MAX_AGE = 3600
+    PROFILING_MAX_MINUTES = 60  # profiling switches itself off after this
+    PROFILING_SLOW_QUERY_MS = 100
+    PROFILING_MAX_PROFILES = 200  # older .prof files are deleted
+    
+    # Compiled templates shared by the workers (app/templating.py, flask precompile-templates)
+    TEMPLATE_BYTECODE_CACHE = True
+    TEMPLATE_CACHE_DIR = os.environ.get('TEMPLATE_CACHE_DIR')  # default: instance/jinja-cache
+    
+    # SQL statement budget per request ('warn' logs, 'raise' fails the request)
+    SQL_QUERY_BUDGET = 30
+    SQL_QUERY_BUDGET_ACTION = 'warn'
+    
+    # Rows per page on keyset-paginated list views
+    PAGE_SIZE = 25
+    
+    # Appointment booking
+    APPOINTMENT_SLOT_MINUTES = 30
+    BOOKING_RETRIES = 3
+    BOOKING_WINDOW_DAYS = 7  # days of free slots offered on the booking pages
+    AVAILABILITY_GENERATE_DAYS = 28  # days materialized from weekly templates per run
+    
+    # Precomputed next free slots per doctor (earliest available search)
+    NEXT_FREE_SLOTS_PER_DOCTOR = 5
+    NEXT_FREE_SLOT_DAYS = 30
+    
+    # Password hashing (werkzeug method string; old hashes are upgraded on login)
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD') or 'scrypt:32768:8:1'
+    PASSWORD_HASH_WORKERS = 2  # hashing threads per process
+    PASSWORD_HASH_QUEUE = 16  # calls allowed to wait; more get a 503
+    PASSWORD_HASH_TIMEOUT = 10  # seconds before a waiting call gives up
+    
+    # Live slot events (SSE) on the doctor profile and booking pages
+    SLOT_EVENTS_BROKER = os.environ.get('SLOT_EVENTS_BROKER') or 'memory'  # 'database' with several workers
+    SLOT_EVENTS_MAX_SUBSCRIBERS = 8  # open streams per process; each holds a worker thread
+    SLOT_EVENTS_STREAM_SECONDS = 300  # browsers reconnect after this
+    SLOT_EVENTS_HEARTBEAT = 15
+    SLOT_EVENTS_POLL_INTERVAL = 1.0  # 'database' broker only
+    
+    # Bulk CSV import (flask import-csv, /admin/import)
+    IMPORT_CHUNK_SIZE = 1000
+    IMPORT_HASH_WORKERS = None  # processes hashing passwords; None: one per CPU
+    
+    # Appointment export (flask export-appointments, /admin/appointments/export)
+    EXPORT_BATCH_SIZE = 1000  # rows fetched from the cursor at a time
+    
+    # Archive tier (flask archive-appointments)
+    ARCHIVE_AFTER_DAYS = 365  # closed appointments older than this are archived
+    ARCHIVE_BATCH_SIZE = 500  # appointments moved per transaction
+    ARCHIVE_BATCH_PAUSE = 0.2  # seconds between batches
+    
+    # Generated data (flask seed, seed.py)
+    SEED_BATCH_SIZE = 10000  # ids inserted per transaction
+    
+    # In-process cache of specializations and the doctor directory
+    REFERENCE_CACHE_TTL = 300  # seconds; 0 disables caching
+    REFERENCE_CACHE_MAX_ENTRIES = 128
+    
+    # In-process cache of the logged-in user and profile (0 disables it;
+    # other processes see user/profile changes after at most this many seconds)
+    IDENTITY_CACHE_TTL = 0
+    IDENTITY_CACHE_MAX_ENTRIES = 10000
 
 class DevelopmentConfig(Config):
     """Development configuration"""
@@ -33,6 +126,10 @@ class ProductionConfig(Config):
     DEBUG = False
     TESTING = False
     SESSION_COOKIE_SECURE = True
+    METRICS_ALLOWED_ADDRESSES = ()  # behind a proxy every request comes from localhost
+    SQLITE_BUSY_TIMEOUT = 15000  # several gunicorn workers queue up for the lock
+    DATABASE_POOL_SIZE = 10
+    DATABASE_MAX_OVERFLOW = 20
 
 class TestingConfig(Config):
     """Testing configuration"""
@@ -40,6 +137,9 @@ class TestingConfig(Config):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
     WTF_CSRF_ENABLED = False
+    SQL_QUERY_BUDGET_ACTION = 'raise'
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'  # cheap hashes keep tests fast
+    TEMPLATE_BYTECODE_CACHE = False
 
 config = {
     'development': DevelopmentConfig,
@@ -0,0 +1,45 @@
+"""Gunicorn settings: `gunicorn run:app` picks this file up from the working directory.
+
+Threaded workers are required, not just recommended:
+- live slot streams hold a thread each for SLOT_EVENTS_STREAM_SECONDS,
+  up to SLOT_EVENTS_MAX_SUBSCRIBERS per worker
+- the password hashing pool (app/passwords.py) can only shed a login rush
+  with a 503 when a process serves several requests at once. Under sync
+  workers every process handles one request at a time, so its queue never
+  fills and a login blocks the whole worker for the length of the hash.
+
+With METRICS_DIR set, child_exit folds the counters of a worker that died
+without cleaning up (killed, timed out) into the shared totals.
+"""
+import os
+from config import config
+
+worker_class = 'gthread'
+workers = int(os.environ.get('GUNICORN_WORKERS', 2))
+threads = int(os.environ.get('GUNICORN_THREADS', 32))
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+
+
+def _settings():
+    return config.get(os.getenv('FLASK_ENV', 'development'), config['default'])
+
+FREE_THREADS = 4  # threads per worker that logins and live streams can never take
+
+
+def on_starting(server):
+    settings = _settings()
+    held = (settings.PASSWORD_HASH_WORKERS + settings.PASSWORD_HASH_QUEUE
+            + settings.SLOT_EVENTS_MAX_SUBSCRIBERS)
+    # sync with threads > 1 runs as gthread; with fewer threads logins and streams could take them all
+    if server.cfg.worker_class_str in ('sync', 'gthread') and server.cfg.threads < held + FREE_THREADS:
+        raise RuntimeError(
+            f'Run gthread workers with at least {held + FREE_THREADS} threads '
+            f'(PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE + SLOT_EVENTS_MAX_SUBSCRIBERS '
+            f'+ {FREE_THREADS}), not {server.cfg.threads}')
+
+
+def child_exit(server, worker):
+    directory = _settings().METRICS_DIR
+    if directory and os.path.isdir(directory):
+        from app.metrics import mark_process_dead
+        mark_process_dead(directory, worker.pid)
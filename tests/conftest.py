@@ -0,0 +1,31 @@
+import pytest
+from app import create_app, db
+from app.seeding import SeedPlan, seed
+from config import TestingConfig
+
+
+def _seeded_app(plan_options):
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        seed(SeedPlan(**plan_options))
+    return app
+
+
+@pytest.fixture
+def app():
+    """In-memory database with the default seed data"""
+    app = _seeded_app({})
+    with app.app_context():
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def file_app(tmp_path, monkeypatch):
+    """SQLite file database, so threads get their own connections and transactions"""
+    monkeypatch.setattr(TestingConfig, 'SQLALCHEMY_DATABASE_URI', f'sqlite:///{tmp_path / "test.db"}')
+    app = _seeded_app({'patients': 20})
+    yield app
+    with app.app_context():
+        db.engine.dispose()
@@ -0,0 +1,118 @@
+"""Slot uniqueness is enforced by the database, not by a check-then-insert (user-004)"""
+import threading
+from datetime import date, time, timedelta
+import pytest
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.booking import SlotUnavailable, book_slot, reschedule_slot
+from app.models import Appointment, Doctor, Patient
+
+SLOT_DATE = date.today() + timedelta(days=60)  # past the seeded bookings
+SLOT_TIME = time(10, 0)
+
+
+def _ids(model, count=1):
+    return [row.id for row in model.query.order_by(model.id).limit(count)]
+
+
+def test_unique_index_rejects_second_booked_row(app):
+    doctor_id, = _ids(Doctor)
+    first, second = _ids(Patient, 2)
+    db.session.add(Appointment(patient_id=first, doctor_id=doctor_id, appointment_date=SLOT_DATE,
+                               appointment_time=SLOT_TIME, status='Booked'))
+    db.session.commit()
+    db.session.add(Appointment(patient_id=second, doctor_id=doctor_id, appointment_date=SLOT_DATE,
+                               appointment_time=SLOT_TIME, status='Booked'))
+    with pytest.raises(IntegrityError):
+        db.session.commit()
+    db.session.rollback()
+
+
+def test_cancelled_rows_do_not_hold_the_slot(app):
+    doctor_id, = _ids(Doctor)
+    first, second = _ids(Patient, 2)
+    cancelled = book_slot(first, doctor_id, SLOT_DATE, SLOT_TIME)
+    cancelled.status = 'Cancelled'
+    db.session.commit()
+
+    booked = book_slot(second, doctor_id, SLOT_DATE, SLOT_TIME)
+    assert booked.status == 'Booked'
+
+
+def test_booking_a_taken_slot_raises_slot_unavailable(app):
+    doctor_id, = _ids(Doctor)
+    first, second = _ids(Patient, 2)
+    book_slot(first, doctor_id, SLOT_DATE, SLOT_TIME)
+
+    with pytest.raises(SlotUnavailable) as raised:
+        book_slot(second, doctor_id, SLOT_DATE, SLOT_TIME)
+    assert all(alternative > SLOT_TIME for alternative in raised.value.alternatives)
+    assert Appointment.query.filter_by(doctor_id=doctor_id, appointment_date=SLOT_DATE,
+                                       appointment_time=SLOT_TIME).count() == 1
+
+
+def test_rescheduling_onto_a_taken_slot_keeps_the_old_slot(app):
+    doctor_id, = _ids(Doctor)
+    first, second = _ids(Patient, 2)
+    book_slot(first, doctor_id, SLOT_DATE, SLOT_TIME)
+    moving = book_slot(second, doctor_id, SLOT_DATE, time(11, 0))
+    moving_id = moving.id
+
+    with pytest.raises(SlotUnavailable):
+        reschedule_slot(moving, SLOT_DATE, SLOT_TIME)
+    assert db.session.get(Appointment, moving_id).appointment_time == time(11, 0)
+
+
+def _book_in_parallel(app, jobs):
+    barrier = threading.Barrier(len(jobs))
+    results = [None] * len(jobs)
+
+    def worker(index, job):
+        with app.app_context():
+            barrier.wait()
+            try:
+                job()
+                results[index] = 'booked'
+            except SlotUnavailable:
+                results[index] = 'taken'
+            except Exception as e:
+                results[index] = f'error: {type(e).__name__}: {e}'
+            finally:
+                db.session.remove()
+
+    threads = [threading.Thread(target=worker, args=(i, job)) for i, job in enumerate(jobs)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_parallel_bookings_of_one_slot_book_it_once(file_app):
+    with file_app.app_context():
+        doctor_id, = _ids(Doctor)
+        patient_ids = _ids(Patient, 20)
+
+    results = _book_in_parallel(file_app, [
+        (lambda patient_id=patient_id: book_slot(patient_id, doctor_id, SLOT_DATE, SLOT_TIME))
+        for patient_id in patient_ids
+    ])
+
+    assert results.count('booked') == 1, results
+    assert results.count('taken') == len(patient_ids) - 1, results
+    with file_app.app_context():
+        assert Appointment.query.filter_by(doctor_id=doctor_id, appointment_date=SLOT_DATE,
+                                           appointment_time=SLOT_TIME, status='Booked').count() == 1
+
+
+def test_parallel_bookings_of_distinct_slots_all_succeed(file_app):
+    with file_app.app_context():
+        doctor_id, = _ids(Doctor)
+        patient_ids = _ids(Patient, 20)
+
+    results = _book_in_parallel(file_app, [
+        (lambda patient_id=patient_id, i=i: book_slot(patient_id, doctor_id, SLOT_DATE, time(8 + i // 2, 30 * (i % 2))))
+        for i, patient_id in enumerate(patient_ids)
+    ])
+
+    assert results == ['booked'] * len(patient_ids)
@@ -0,0 +1,57 @@
+"""The hot queries use the declared indexes (user-003)"""
+import os
+import pytest
+from sqlalchemy import inspect
+from app import create_app, db
+from app.query_plans import check_query_plans
+from config import TestingConfig
+
+
+def _assert_no_scans():
+    results = check_query_plans()
+    assert results
+    scans = {name: scans for name, plan, scans in results if scans}
+    assert scans == {}
+
+
+def test_hot_queries_use_indexes(app):
+    _assert_no_scans()
+
+
+def test_create_indexes_adds_missing_indexes(app):
+    # An existing database created before the indexes were declared
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.drop(db.engine, checkfirst=True)
+    with pytest.raises(AssertionError):
+        _assert_no_scans()
+
+    result = app.test_cli_runner().invoke(args=['create-indexes'])
+    assert result.exit_code == 0, result.output
+
+    existing = {(table.name, index['name'])
+                for table in db.metadata.sorted_tables
+                for index in inspect(db.engine).get_indexes(table.name)}
+    declared = {(table.name, index.name) for table in db.metadata.sorted_tables for index in table.indexes}
+    assert declared <= existing
+    _assert_no_scans()
+
+
+def test_check_query_plans_command_passes(app):
+    result = app.test_cli_runner().invoke(args=['check-query-plans'])
+    assert result.exit_code == 0, result.output
+    assert '✗' not in result.output
+
+
+@pytest.mark.skipif(not os.environ.get('TEST_POSTGRESQL_URL'),
+                    reason='set TEST_POSTGRESQL_URL to a scratch PostgreSQL database')
+def test_hot_queries_use_indexes_on_postgresql(monkeypatch):
+    monkeypatch.setattr(TestingConfig, 'SQLALCHEMY_DATABASE_URI', os.environ['TEST_POSTGRESQL_URL'])
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        try:
+            _assert_no_scans()
+        finally:
+            db.session.remove()
+            db.drop_all()